@@ -0,0 +1,88 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Timing of the molecular descriptor methods in compute_md
+##
+# This file is part of Flame
+##
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+##
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+##
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Times the descriptor methods of flame.chem.compute_md on SDFiles built by
+replicating the molecules of an input SDFile an increasing number of times.
+
+The time per molecule must remain constant when the number of molecules
+grows (linear scaling).
+
+usage: python benchmarks/bench_compute_md.py [-f input.sdf] [-n 1 10 50]
+'''
+
+import os
+import time
+import argparse
+import tempfile
+
+from flame.chem import compute_md
+
+DEFAULT_SDF = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'flame', 'tests', 'data', 'minicaco.sdf')
+
+METHODS = [('RDKit_properties', compute_md._RDKit_properties),
+           ('RDKit_md', compute_md._RDKit_descriptors),
+           ('morganFP', compute_md._RDKit_morganFPS)]
+
+
+def replicate_sdf(ifile, times, ofile):
+    ''' writes in ofile the content of ifile repeated times times '''
+    with open(ifile, 'r') as f:
+        content = f.read()
+
+    if not content.endswith('\n'):
+        content += '\n'
+
+    with open(ofile, 'w') as f:
+        for i in range(times):
+            f.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compute_md benchmark')
+    parser.add_argument('-f', '--infile', default=DEFAULT_SDF,
+                        help='input SDFile')
+    parser.add_argument('-n', '--replicates', nargs='+', type=int,
+                        default=[1, 10, 50, 100],
+                        help='number of times the input is replicated')
+    args = parser.parse_args()
+
+    print(f'{"method":<18}{"mols":>8}{"time (s)":>12}{"ms/mol":>10}')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for times in args.replicates:
+            sdf = os.path.join(tmp, f'bench_{times}.sdf')
+            replicate_sdf(args.infile, times, sdf)
+
+            for label, method in METHODS:
+                t0 = time.perf_counter()
+                success, results = method(sdf)
+                elapsed = time.perf_counter() - t0
+
+                if not success:
+                    print(f'{label:<18} failed: {results}')
+                    continue
+
+                nmols = results['matrix'].shape[0]
+                print(f'{label:<18}{nmols:>8}{elapsed:>12.3f}'
+                      f'{1000*elapsed/nmols:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Timing of the prediction of the models used as external input
+##
+# This file is part of Flame
+##
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+##
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+##
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compares the time needed to predict an input file with a set of models
+(e.g. the model_set of an ext_input model), running every model separately
+(as done before) or with context.predict_model_set, which computes the
+input only once for the models sharing it.
+
+The models are given as a list of endpoint:version or as an ext_input
+model, whose model_set is used. The list is replicated to obtain the
+number of models requested. Both ways must obtain the same results.
+
+usage: python benchmarks/bench_ensemble.py -f input.sdf -e ENSEMBLE [-n 8 16]
+       python benchmarks/bench_ensemble.py -f input.sdf -m CACO2:0 LOGP:1
+'''
+
+import time
+import argparse
+
+from flame import context
+from flame.parameters import Parameters
+from flame.util import utils
+
+
+def model_list(args) -> list:
+    if args.models:
+        models = []
+        for item in args.models:
+            endpoint, _, version = item.partition(':')
+            models.append({'endpoint': endpoint,
+                           'version': utils.intver(version)})
+        return models
+
+    param = Parameters()
+    param.loadYaml(args.endpoint, utils.intver(args.version))
+    return param.getVal('model_set')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ensemble benchmark')
+    parser.add_argument('-f', '--infile', required=True,
+                        help='input SDFile')
+    parser.add_argument('-e', '--endpoint',
+                        help='ext_input model defining the model set')
+    parser.add_argument('-v', '--version', default=0,
+                        help='version of the ext_input model')
+    parser.add_argument('-m', '--models', nargs='+',
+                        help='models as endpoint:version')
+    parser.add_argument('-n', '--nmodels', nargs='+', type=int,
+                        default=[8, 16],
+                        help='number of models predicted')
+    args = parser.parse_args()
+
+    base = model_list(args)
+
+    print(f'{"models":>8}{"separate (s)":>16}{"shared (s)":>14}{"speedup":>10}')
+
+    for nmodels in args.nmodels:
+        model_set = [dict(base[i % len(base)], infile=args.infile)
+                     for i in range(nmodels)]
+
+        t0 = time.perf_counter()
+        expected = [context.predict_cmd(model, 'JSON')[1]
+                    for model in model_set]
+        separate = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        results = context.predict_model_set(model_set)[1]
+        shared = time.perf_counter() - t0
+
+        if results != expected:
+            print(f'{nmodels:>8} different results!')
+            continue
+
+        print(f'{nmodels:>8}{separate:>16.2f}{shared:>14.2f}'
+              f'{separate/shared:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Timing of the TSV writers of Odata
+##
+# This file is part of Flame
+##
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+##
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+##
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compares the block-wise writers of output_md.tsv and output.tsv in
+flame.odata with the previous implementation, which built every line
+concatenating the cells one by one, for random results and descriptor
+matrices (fingerprints and float descriptors) of increasing size.
+
+Both implementations must write exactly the same files.
+
+usage: python benchmarks/bench_odata.py [-n 1000 10000] [-v 2048]
+'''
+
+import io
+import time
+import argparse
+
+import numpy as np
+
+from flame import odata
+
+
+def previous_matrix(fo, obj_nam, xmatrix):
+    ''' previous writer of the lines of output_md.tsv '''
+    shape = np.shape(xmatrix)
+
+    if len(shape) > 1:
+        for x in range(shape[0]):
+            line = obj_nam[x]
+            for y in range(shape[1]):
+                line += '\t'+str(xmatrix[x, y])
+            fo.write(line+'\n')
+
+    else:
+        line = obj_nam[0]
+        for y in range(shape[0]):
+            line += '\t'+str(xmatrix[y])
+        fo.write(line+'\n')
+
+
+def previous_results(fo, columns, obj_num):
+    ''' previous writer of the lines of output.tsv '''
+    for i in range(obj_num):
+        line = ''
+        for column in columns:
+
+            if column is None or i >= len(column):
+                val = None
+            else:
+                val = column[i]
+
+            if val is None:
+                line += '-'
+            else:
+                if isinstance(val, float):
+                    line += "%.4f" % val
+                else:
+                    line += str(val)
+            line += '\t'
+        fo.write(line+'\n')
+
+
+def results(nobj, rng):
+    ''' columns similar to the ones of a conformal quantitative model '''
+    values = rng.normal(size=nobj)
+    values[::50] = np.nan
+    return [np.array([f'mol_{i}' for i in range(nobj)]),
+            np.array(['CC(=O)Oc1ccccc1C(=O)O'] * nobj),
+            values, values - 1.0, values + 1.0,
+            rng.randint(0, 2, nobj).astype(bool),
+            np.array([None, 1.5, 'x'] * (nobj // 3) + [None] * (nobj % 3),
+                     dtype=object)]
+
+
+def timed(function, *args):
+    ''' returns the output written by function and the time used '''
+    fo = io.StringIO()
+    t0 = time.perf_counter()
+    function(fo, *args)
+    return fo.getvalue(), time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Odata writers benchmark')
+    parser.add_argument('-n', '--objects', nargs='+', type=int,
+                        default=[1000, 10000],
+                        help='number of objects')
+    parser.add_argument('-v', '--variables', type=int, default=2048,
+                        help='number of fingerprint bits')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+
+    print(f'{"file":<22}{"objects":>9}{"previous (s)":>14}'
+          f'{"block (s)":>11}{"speedup":>9}')
+
+    for nobj in args.objects:
+        obj_nam = np.array([f'mol_{i}' for i in range(nobj)])
+
+        cases = [
+            ('output_md.tsv (FP)', previous_matrix, odata._write_matrix,
+             (obj_nam, (rng.rand(nobj, args.variables) < 0.1)
+              .astype(np.uint8))),
+            ('output_md.tsv (MD)', previous_matrix, odata._write_matrix,
+             (obj_nam, rng.lognormal(size=(nobj, 200)))),
+            ('output.tsv', previous_results, odata._write_results,
+             (results(nobj, rng), nobj))]
+
+        for label, previous, block, data in cases:
+            expected, tprevious = timed(previous, *data)
+            output, tblock = timed(block, *data)
+
+            if output != expected:
+                print(f'{label:<22}{nobj:>9} different output!')
+                continue
+
+            print(f'{label:<22}{nobj:>9}{tprevious:>14.3f}{tblock:>11.3f}'
+                  f'{tprevious/tblock:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -31,78 +31,124 @@ from rdkit.Chem import rdMolDescriptors
 from rdkit.Chem import Descriptors
 from rdkit.ML.Descriptors import MoleculeDescriptors
 
+from flame.chem import fingerprints
 from flame.util import get_logger
 
 LOG = get_logger(__name__)
 
 
-def _calc_descriptors(md_function, ifile: str,  descrip_names: list) -> (np.ndarray, np.ndarray):
+def _mol_supplier(source):
+    """Returns an indexable sequence of mols for the source provided, which
+    can be the name of an SDFile or a list of RDKit mols (with None for
+    molecules which failed in previous steps).
+    """
+    if isinstance(source, str):
+        return Chem.SDMolSupplier(source)
+    return source
+
+
+def _source_name(source) -> str:
+    """Returns a description of the source for log messages"""
+    if isinstance(source, str):
+        return source
+    return 'input molecules'
+
+
+def _calc_descriptors(md_function, ifile: str, descrip_names: list,
+                      dtype=np.float64, ncols=None) -> (bool, dict):
     """Helper function for handling all the safety measures of computing
     RDKit descriptors.
 
+    The descriptor matrix is preallocated with one row per molecule block
+    present in the SDFile and filled in a single pass, so the cost grows
+    linearly with the number of molecules.
+
     Parameters
     ----------
 
     md_function: callable
-        descriptor method
+        descriptor method, returning the descriptor vector of a mol
 
-    ifile: str
-        SDF input file
+    ifile: str or list
+        SDF input file or list of mols
 
     descrip_names: list
         list of descriptor names
 
+    dtype: numpy dtype
+        type of the descriptor matrix (np.float64 by default)
+
+    ncols: int
+        number of columns of the descriptor matrix, if different from
+        the number of descriptor names (e.g. packed fingerprints)
+
     Returns
     -------
 
-    descriptors_matrix: ndarray
-        matrix with the descriptors
+    success: bool
+        False if the supplier could not be created or no molecule
+        was processed successfully
 
-    success_arr: ndarray
-        array with bool values indicating if mol
-        had any issues during supplier (None) or in the descreiptor
-        array (presence of NaNs)
+    results_dict: dict, with the following keys
+
+        'matrix': ndarray, descriptors matrix. Full form with non processed
+                and failed molecules.
+        'names': list, matrix column names. descriptors names.
+        'success_arr': ndarray, array with bool values indicating if mol
+                    had any issues during supplier (None) or in the
+                    descriptor array (presence of NaNs).
+
+    When success is False, the second element is an error message
     """
     try:
-        suppl = Chem.SDMolSupplier(ifile)
+        suppl = _mol_supplier(ifile)
     except Exception as err:
         LOG.error(f'Unable to create supplier with exception {err}')
-        raise err
+        return False, 'Unable to create supplier'
 
-    n_cols = len(descrip_names)
-    matrix_shape = (len(suppl), n_cols)
-    descrip_matrix = np.zeros(matrix_shape)
+    n_mols = len(suppl)
+    if ncols is None:
+        ncols = len(descrip_names)
+
+    descrip_matrix = np.zeros((n_mols, ncols), dtype=dtype)
+    success_arr = np.zeros(n_mols, dtype=bool)
 
-    success_list = []
     for i, mol in enumerate(suppl):
         # check mol
         if mol is None:
-            LOG.warning(f'Supplier failed to read molecule #{i+1} in {ifile}')
-            success_list.append(False)
+            LOG.warning(f'Supplier failed to read molecule #{i+1}'
+                        f' in {_source_name(ifile)}')
             continue
 
         # fill in matrix with descriptor array
         try:
             descrip_matrix[i, :] = md_function(mol)
         except Exception as e:
-            LOG.error(f'Failed to compute RDKit properties for mol {i+1}'
-                      f' in {ifile} with exception {e}')
-            success_list.append(False)
+            LOG.error(f'Failed to compute descriptors for mol #{i+1}'
+                      f' in {_source_name(ifile)} with exception {e}')
+            continue
 
-        success_list.append(True)
+        success_arr[i] = True
 
     # check if any descriptor has NaNs
-    # returns False when row has NaN
-    mols_wthout_nan = ~ np.isnan(descrip_matrix).any(axis=1)
-    # num of mols that have NaNs in descriptors
-    n_mols_wth_nan = sum(~mols_wthout_nan)
+    # only float matrices can contain NaNs
+    if np.issubdtype(dtype, np.floating):
+        mols_wth_nan = np.isnan(descrip_matrix).any(axis=1)
+        # num of mols that have NaNs in descriptors
+        n_mols_wth_nan = np.count_nonzero(mols_wth_nan & success_arr)
+
+        if n_mols_wth_nan != 0:
+            LOG.debug(f'{n_mols_wth_nan} molecules have `NaN` in'
+                      ' the descriptors and will be descarted')
 
-    if n_mols_wth_nan != 0:
-        LOG.debug(f'{n_mols_wth_nan} molecules have `NaN` in'
-                  ' the descriptors and will be descarted')
+        # add False to succes list in mol idx where properties results has NaNs
+        success_arr &= ~mols_wth_nan
 
-    # add False to succes list in mol idx where properties results has NaNs
-    success_arr = np.array(success_list) & mols_wthout_nan
+    LOG.debug(f'computed descriptors matrix with shape {descrip_matrix.shape}')
+
+    if not success_arr.any():
+        return False, 'Unable to compute descriptors for any molecule in '\
+            f'{_source_name(ifile)}'
 
     results_dict = {
         'matrix': descrip_matrix,
@@ -110,29 +156,24 @@ def _calc_descriptors(md_function, ifile: str,  descrip_names: list) -> (np.ndar
         'success_arr': success_arr
     }
 
-    return results_dict
+    return True, results_dict
 
 
-def _RDKit_descriptors_FUTURE(ifile: str) -> dict:
+def _RDKit_descriptors(ifile, **kwargs) -> (bool, dict):
     """ Computes RDKit descriptors for the SDF provided as argument
 
     Parameters:
     -----------
 
-    ifile: str
-        SDF input file
+    ifile: str or list
+        SDF input file or list of mols
 
     Returns:
     --------
 
-    results_dict: dict, with the following keys
+    success: bool
 
-        'matrix': ndarray, descriptors matrix. Full form with non processed
-                and failed molecules.
-        'names': list, matrix column names. descriptors names.
-        'success_arr': ndarray, array with bool values indicating if mol
-                    had any issues during supplier (None) or in the 
-                    descriptor array (presence of NaNs).
+    results_dict: dict, as described in _calc_descriptors
 
     """
 
@@ -143,135 +184,115 @@ def _RDKit_descriptors_FUTURE(ifile: str) -> dict:
     LOG.info('Computing {} RDKit descriptors per molecule...'
              .format(len(descrip_names)))
 
-    results_dict = _calc_descriptors(
-        md_calculator.CalcDescriptors,
-        ifile,
-        descrip_names,
-    )
-
-    return results_dict
+    return _calc_descriptors(md_calculator.CalcDescriptors,
+                             ifile, descrip_names)
 
 
-def _RDKit_properties_FUTURE(ifile) -> (dict):
+def _RDKit_properties(ifile, **kwargs) -> (bool, dict):
     '''Computes RDKit properties for the SDF provided as argument
 
     Parameters
     ----------
 
-    ifile: str
-        SDF input file
+    ifile: str or list
+        SDF input file or list of mols
 
     Returns
     -------
 
-    results_dict: dict, with the following keys
+    success: bool
 
-        'matrix': ndarray, properties matrix. Full form with non processed
-                and failed molecules.
-        'names': list, matrix column names. Properties names.
-        'success_arr': ndarray, array with bool values indicating if mol
-                    had any issues during supplier (None) or in the 
-                    descriptor array (presence of NaNs).
+    results_dict: dict, as described in _calc_descriptors
 
     '''
     properties = rdMolDescriptors.Properties()
 
     props_names = [propname for propname in properties.GetPropertyNames()]
-    n_props = len(props_names)
 
-    n_cols = n_props
+    LOG.info('computing {} RDKit properties per molecule...'
+             .format(len(props_names)))
 
-    LOG.info('computing {} RDKit properties per molecule...'.format(n_cols))
+    return _calc_descriptors(properties.ComputeProperties,
+                             ifile, props_names)
 
-    results_dict = _calc_descriptors(
-        properties.ComputeProperties,
-        ifile,
-        props_names
-    )
 
-    return results_dict
+def _RDKit_morganFPS(ifile, **kwargs) -> (bool, dict):
+    '''Computes Morgan circular fingerprints using RDKit for the SDF
+    provided as argument
 
+    Parameters
+    ----------
+
+    ifile: str or list
+        SDF input file or list of mols
+
+    kwargs: MD_settings, including morgan_radius, morgan_features
+        and (optionally) morgan_nbits and morgan_packed
+
+    Returns
+    -------
+
+    success: bool
+
+    results_dict: dict, as described in _calc_descriptors. The matrix
+        contains one uint8 column (0/1) per fingerprint bit or, if
+        morgan_packed is True, a PackedFingerprints object storing the
+        bits in uint64 words
 
-def _RDKit_morganFPS(ifile, **kwargs) -> (bool, (np.ndarray, list, list)):
-    ''' 
-    Morgan circular FP using RDkit output is a boolean and
-    a tupla with the xmatrix and the variable names
     '''
-    try:
-        suppl = Chem.SDMolSupplier(ifile)
-    except Exception as e:
-        LOG.error(f'Unable to create supplier with exception {e}')
-        return False, 'unable to create supplier'
+    morgan_radius = kwargs.get('morgan_radius', 2)
+    morgan_features = kwargs.get('morgan_features', True)
+    morgan_nbits = kwargs.get('morgan_nbits', 2048)
+    morgan_packed = kwargs.get('morgan_packed', False)
 
-    morgan_radius = kwargs['morgan_radius']
-    morgan_features = kwargs['morgan_features']
+    # None values are obtained from parameter files not defining them
+    if morgan_radius is None:
+        morgan_radius = 2
+    if morgan_nbits is None:
+        morgan_nbits = 2048
 
     LOG.info(f'computing MorganFP fingerprint... with r={morgan_radius}')
 
-    # get from here num of properties
+    def bitvect(mol):
+        return AllChem.GetMorganFingerprintAsBitVect(mol,
+                                                     morgan_radius,
+                                                     nBits=morgan_nbits,
+                                                     useFeatures=morgan_features)
 
-    success_list = []
-    xmatrix = []
+    fp_names = [f'morganFP_{i}' for i in range(morgan_nbits)]
 
-    try:
-        num_obj = 0
-        for mol in suppl:
-            if mol is None:
-                LOG.error(
-                    f'Unable to process molecule #{num_obj+1} in {ifile}')
-                success_list.append(False)
-                continue
-
-            # xmatrix [num_obj] = properties.ComputeProperties(mol)
-            if num_obj == 0:
-                fp = AllChem.GetMorganFingerprintAsBitVect(mol,
-			                    morgan_radius,  
-                                useFeatures=morgan_features)
-                # what is going on here??
-                if np.isnan(xmatrix).any():
-                    success_list.append(False)
-                    continue
-                else:
-                    xmatrix = fp
-            else:
-                fp = AllChem.GetMorganFingerprintAsBitVect(mol,
-			                    morgan_radius,  
-                                useFeatures=morgan_features)
-                if np.isnan(fp).any():
-                    success_list.append(False)
-                    continue
-                xmatrix = np.vstack(
-                    (xmatrix, fp))
-
-            success_list.append(True)
-            num_obj += 1
-
-    except Exception as e:
-        LOG.error(f'Failed computing RDKit properties for molecule #{num_obj+1} in {ifile}'
-                  f' with exception: {e}')
-        return False, 'Failed computing RDKit properties for molecule' + str(num_obj+1) + 'in file ' + ifile
-
-    LOG.debug(f'computed RDKit properties matrix with shape {np.shape(xmatrix)}')
-    if num_obj == 0:
-        return False, 'Unable to compute RDKit properties for molecule '+ifile
+    if morgan_packed:
+        nwords = fingerprints.n_words(morgan_nbits)
 
-    results = {
-        'matrix': xmatrix,
-        'names' : [],
-        'success_arr': success_list
-    }
-    return True, results
+        def fingerprint(mol):
+            on_bits = np.array(bitvect(mol).GetOnBits(), dtype=np.uint64)
+            words = np.zeros(nwords, dtype=np.uint64)
+            np.bitwise_or.at(words, (on_bits >> np.uint64(6)).astype(np.intp),
+                             np.uint64(1) << (on_bits & np.uint64(63)))
+            return words
+
+        success, results = _calc_descriptors(fingerprint, ifile, fp_names,
+                                             dtype=np.uint64, ncols=nwords)
+        if success:
+            results['matrix'] = fingerprints.PackedFingerprints(
+                results['matrix'], morgan_nbits)
 
+        return success, results
 
-    raise NotImplementedError
+    def fingerprint(mol):
+        bits = np.zeros(morgan_nbits, dtype=np.uint8)
+        bits[list(bitvect(mol).GetOnBits())] = 1
+        return bits
 
+    return _calc_descriptors(fingerprint, ifile, fp_names, dtype=np.uint8)
 
-def _padel_descriptors(ifile):
+
+def _padel_descriptors(ifile, **kwargs) -> (bool, dict):
     ''' 
     computes Padel molecular descriptors calling an external web service for
     the file provided as argument
 
-    output is a boolean and a tupla with the xmatrix and the variable names
+    output is a boolean and a results dict, as described in _calc_descriptors
 
     '''
 
@@ -310,7 +331,7 @@ def _padel_descriptors(ifile):
         index = 0
         var_nam = []
         success_list = []
-        xmatrix = []
+        rows = []
 
         for line in of:
 
@@ -323,14 +344,11 @@ def _padel_descriptors(ifile):
                 value_list = line.strip().split(',')
 
                 try:
-                    nvalue_list = [float(x) for x in value_list[1:]]
+                    md = np.array(value_list[1:], dtype=np.float64)
                 except:
-                    success_list.append(False)
-                    print(
-                        'ERROR (@_padel_descriptors) in Padel results parsing for object '+str(index))
-                    continue
-
-                md = np.array(nvalue_list, dtype=np.float64)
+                    LOG.error('Padel results parsing failed for object '
+                              f'#{index}')
+                    md = np.full(len(var_nam), np.nan)
 
                 # md = np.nan_to_num(md)
                 # detected a rare bug producing extremely large PaDel
@@ -338,149 +356,23 @@ def _padel_descriptors(ifile):
                 # apply a conservative top cutoff of 1.0e10
                 # md [ md > 1.0e10 ] = 1.0e10
 
-                if index == 1:  # copy the value list to the xmatrix
-                    xmatrix = md
-                else:
-                    xmatrix = np.vstack((xmatrix, md))
-
-                success_list.append(True)
+                # rows are collected and stacked only once at the end
+                rows.append(md)
+                success_list.append(not np.isnan(md).any())
 
             index += 1
 
     shutil.rmtree(tmpdir)
 
-    # if no object was processed with success (index==1) return False
+    # if no object was processed with success return False
     # this is common when series are processed object-wise
+    if not any(success_list):
+        return False, 'Unable to compute Padel descriptors for any molecule in '+ifile
 
-    return (index > 1), (xmatrix, var_nam, success_list)
-
-
-def _RDKit_descriptors(ifile, **kwargs) -> (bool, (np.ndarray, list, list)):
-    '''
-    computes RDKit descriptors for the file provided as argument
-
-    output is a boolean and a tupla with the xmatrix and the variable names
-    '''
-    try:
-        suppl = Chem.SDMolSupplier(ifile)
-    except Exception as e:
-        LOG.error(f'Unable to create supplier with exception {e}')
-        return False, 'Unable to compute RDKit MD'
-
-    LOG.info('Computing RDKit descriptors...')
-    # what is this??
-    nms = [x[0] for x in Descriptors._descList]
-
-    md = MoleculeDescriptors.MolecularDescriptorCalculator(nms)
-    success_list = []
-    xmatrix = []
-
-    try:
-        num_obj = 0
-        for mol in suppl:
-            if mol is None:
-                LOG.error('Unable to process molecule'
-                          f'#{num_obj+1} in {ifile}')
-                success_list.append(False)
-                continue
-
-            if num_obj == 0:
-                xmatrix = md.CalcDescriptors(mol)
-                LOG.debug(
-                    f'first descriptor vector computet with shape {np.shape(xmatrix)}')
-                if np.isnan(xmatrix).any():
-                    # what is the deal if there is any NaN?
-                    success_list.append(False)
-                    continue
-            else:
-                descriptors = md.CalcDescriptors(mol)
-                if np.isnan(descriptors).any():
-                    success_list.append(False)
-                    continue
-                xmatrix = np.vstack((xmatrix, descriptors))
-
-            success_list.append(True)
-            num_obj += 1
-
-    except:  # if any mol fails the whole try except will break
-        return False, 'Failed computing RDKit descriptors for molecule' + str(num_obj+1) + 'in file ' + ifile
-
-    LOG.debug(f'computed RDKit descriptors matrix with shape {np.shape(xmatrix)}')
-    if num_obj == 0:
-        return False, 'Unable to compute RDKit properties for molecule '+ifile
-    
     results = {
-        'matrix': xmatrix,
-        'names': nms,
-        'success_arr': success_list
+        'matrix': np.array(rows, dtype=np.float64),
+        'names': var_nam,
+        'success_arr': np.array(success_list, dtype=bool)
     }
 
     return True, results
-
-
-def _RDKit_properties(ifile, **kwargs) -> (bool, (np.ndarray, list, list)):
-    ''' 
-    computes RDKit properties for the file provided as argument
-
-    output is a boolean and a tupla with the xmatrix and the variable names
-    '''
-    try:
-        suppl = Chem.SDMolSupplier(ifile)
-    except Exception as e:
-        LOG.error(f'Unable to create supplier with exception {e}')
-        return False, 'unable to create supplier'
-
-    LOG.info('computing RDKit properties...')
-
-    properties = rdMolDescriptors.Properties()
-
-    # get from here num of properties
-    md_name = [prop_name for prop_name in properties.GetPropertyNames()]
-
-    success_list = []
-    xmatrix = []
-
-    try:
-        num_obj = 0
-        for mol in suppl:
-            if mol is None:
-                LOG.error(
-                    f'Unable to process molecule #{num_obj+1} in {ifile}')
-                success_list.append(False)
-                continue
-
-            # xmatrix [num_obj] = properties.ComputeProperties(mol)
-            if num_obj == 0:
-                descriptors = properties.ComputeProperties(mol)
-                # what is going on here??
-                if np.isnan(xmatrix).any():
-                    success_list.append(False)
-                    continue
-                else:
-                    xmatrix = descriptors
-            else:
-                descriptors = properties.ComputeProperties(mol)
-                if np.isnan(descriptors).any():
-                    success_list.append(False)
-                    continue
-                xmatrix = np.vstack(
-                    (xmatrix, descriptors))
-
-            success_list.append(True)
-            num_obj += 1
-
-    except Exception as e:
-        LOG.error(f'Failed computing RDKit properties for molecule #{num_obj+1} in {ifile}'
-                  f' with exception: {e}')
-        return False, 'Failed computing RDKit properties for molecule' + str(num_obj+1) + 'in file ' + ifile
-
-    LOG.debug(f'computed RDKit properties matrix with shape {np.shape(xmatrix)}')
-    if num_obj == 0:
-        return False, 'Unable to compute RDKit properties for molecule '+ifile
-
-    results = {
-        'matrix': xmatrix,
-        'names': md_name,
-        'success_arr': success_list
-    }
-    return True, results
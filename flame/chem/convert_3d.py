@@ -25,17 +25,26 @@ import numpy as np
 from rdkit import Chem
 from rdkit.Chem import AllChem
 
-from flame.util import get_logger
-import flame.chem.sdfileutils as sdfu
+from flame.util import get_logger, pool
 
 LOG = get_logger(__name__)
 
 
+def _embed(mol):
+    """ Returns a copy of mol with hydrogens and ETKDG 3D coordinates.
+    Raises an exception if the conversion fails
+    """
+    mol3 = Chem.AddHs(mol)
+    AllChem.EmbedMolecule(mol3, AllChem.ETKDG())
+    return mol3
+
+
 def _ETKDG(ifile) -> (bool, str):
     """ Assigns 3D structures to the molecular structures provided as input.
     """
 
-    success_list = [True for i in range(sdfu.count_mols(ifile))]
+    # one item for every valid mol, appended while reading them
+    success_list = []
 
     LOG.info('Converting to ETKDG 3D structures')
     try:
@@ -59,12 +68,11 @@ def _ETKDG(ifile) -> (bool, str):
                             f' molecule #{mcount+1} in {ifile}')
                 continue
             try:
-                mol3 = Chem.AddHs(mol)
-                AllChem.EmbedMolecule(mol3, AllChem.ETKDG())
+                mol3 = _embed(mol)
             except:
                 LOG.error('Failed to generate 3D structures using'
                             f'ETKDG method for molecule #{mcount+1} in {ifile}')
-                success_list[mcount]=False
+                success_list.append(False)
                 mcount += 1
                 continue
 
@@ -79,6 +87,47 @@ def _ETKDG(ifile) -> (bool, str):
 
             fo.write(Chem.MolToMolBlock(mol3))
             fo.write('\n$$$$\n')  # end of mol
+            success_list.append(True)
             mcount += 1
 
     return success_list, ofile
+
+
+def _embed_block(block):
+    """ Returns the mol block of the ETKDG 3D structure of the mol block
+    given as argument, or None if the conversion failed
+    """
+    if block is None:
+        return None
+    try:
+        return Chem.MolToMolBlock(_embed(Chem.MolFromMolBlock(block)))
+    except:
+        return None
+
+
+def _ETKDG_mols(mols, ncpu=1) -> list:
+    """ Assigns 3D structures to a list of mols, returning a list of the same
+    length with None for the molecules which could not be converted.
+
+    The molecules are processed using ncpu processes of the shared pool.
+    The 3D structures are read back from their mol blocks, so they are
+    identical to the ones obtained from the SDFile written by _ETKDG
+    """
+
+    LOG.info('Converting to ETKDG 3D structures')
+
+    blocks = [None if mol is None else Chem.MolToMolBlock(mol)
+              for mol in mols]
+
+    mols3 = []
+    for i, block3 in enumerate(pool.imap(_embed_block, blocks, ncpu)):
+        if block3 is None:
+            if mols[i] is not None:
+                LOG.error('Failed to generate 3D structures using'
+                            f'ETKDG method for molecule #{i+1}')
+            mols3.append(None)
+            continue
+
+        mols3.append(Chem.MolFromMolBlock(block3))
+
+    return mols3
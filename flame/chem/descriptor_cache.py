@@ -0,0 +1,299 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame persistent molecular descriptor cache
+##
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+##
+# Copyright 2018 Manuel Pastor
+##
+# This file is part of Flame
+##
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+##
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+##
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+from contextlib import closing
+
+import numpy as np
+import rdkit
+from rdkit import Chem
+
+from flame.chem import fingerprints
+from flame.util import get_logger
+
+LOG = get_logger(__name__)
+
+# increase when the format of the stored rows changes
+CACHE_FORMAT = 1
+
+CACHE_FILE = 'descriptor_cache.db'
+
+# max number of host parameters in a single SQLite statement
+_SQL_CHUNK = 500
+
+
+def settings_key(method: str, md_settings: dict, **kwargs) -> str:
+    '''
+    Returns a hash identifying the descriptor method, its settings and
+    any other setting (given as kwargs) modifying the structures used
+    to compute the descriptors (e.g. normalize or convert3D methods)
+    '''
+    settings = {'method': method,
+                'md_settings': md_settings,
+                'format': CACHE_FORMAT,
+                'rdkit': rdkit.__version__}
+    settings.update(kwargs)
+
+    serial = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.md5(serial.encode()).hexdigest()
+
+
+def read_blocks(ifile: str) -> list:
+    '''
+    Returns the list of molecule blocks in an SDFile, in the same order
+    and number as the records returned by Chem.SDMolSupplier
+    '''
+    blocks = []
+    block = []
+    with open(ifile, 'r') as f:
+        for line in f:
+            block.append(line)
+            if line.rstrip() == '$$$$':
+                blocks.append(''.join(block))
+                block = []
+
+    # last molecule without terminator
+    if ''.join(block).strip():
+        blocks.append(''.join(block) + '$$$$\n')
+
+    return blocks
+
+
+def structure_keys(records: list) -> list:
+    '''
+    Returns the standard InChIKey of every record (molecule block or mol)
+    or None for molecules which cannot be read or converted
+    '''
+    keys = []
+    for record in records:
+        key = None
+        try:
+            mol = record
+            if isinstance(record, str):
+                mol = Chem.MolFromMolBlock(record)
+            if mol is not None:
+                key = Chem.MolToInchiKey(mol) or None
+        except Exception as e:
+            LOG.debug(f'Unable to obtain InChIKey with exception {e}')
+        keys.append(key)
+
+    return keys
+
+
+class DescriptorCache:
+    '''
+    Content addressed store of molecular descriptors, saved as an SQLite
+    database.
+
+    Every row is identified by the InChIKey of the structure and by a
+    hash of the descriptor method and settings (see settings_key). The
+    number of rows is limited to max_entries, removing the least
+    recently used when the limit is exceeded.
+
+    Errors accessing the database are logged and reported as cache
+    misses, so the descriptors are then computed as usual.
+    '''
+
+    def __init__(self, path: str, max_entries=None):
+        self.path = path
+        self.max_entries = max_entries
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=60)
+        con.execute('CREATE TABLE IF NOT EXISTS descriptors ('
+                    'inchikey TEXT, settings TEXT, row BLOB, '
+                    'last_used REAL, PRIMARY KEY (inchikey, settings))')
+        con.execute('CREATE TABLE IF NOT EXISTS variables ('
+                    'settings TEXT PRIMARY KEY, names TEXT, dtype TEXT, '
+                    'nbits INTEGER)')
+        con.execute('CREATE INDEX IF NOT EXISTS lru_index '
+                    'ON descriptors (last_used)')
+        return con
+
+    def get(self, keys: list, settings: str):
+        '''
+        Returns the cached rows for the InChIKeys in keys as a dictionary
+        with the keys found and their rows (bytes), together with a tupla
+        (names, dtype, nbits) describing the variables, or None if they
+        were never stored
+        '''
+        rows = {}
+        variables = None
+        unique = list({k for k in keys if k is not None})
+
+        try:
+            con = self._connect()
+            with closing(con), con:
+                var = con.execute('SELECT names, dtype, nbits FROM variables '
+                                  'WHERE settings=?', (settings,)).fetchone()
+                if var is None:
+                    return rows, None
+
+                variables = (json.loads(var[0]), np.dtype(var[1]), var[2])
+
+                for i in range(0, len(unique), _SQL_CHUNK):
+                    chunk = unique[i:i+_SQL_CHUNK]
+                    marks = ','.join('?' * len(chunk))
+                    for key, row in con.execute(
+                            'SELECT inchikey, row FROM descriptors '
+                            f'WHERE settings=? AND inchikey IN ({marks})',
+                            [settings] + chunk):
+                        rows[key] = row
+
+                    con.execute('UPDATE descriptors SET last_used=? '
+                                f'WHERE settings=? AND inchikey IN ({marks})',
+                                [time.time(), settings] + chunk)
+        except sqlite3.Error as e:
+            LOG.warning(f'Unable to read descriptor cache {self.path}: {e}')
+            return {}, None
+
+        return rows, variables
+
+    def put(self, keys: list, matrix, names: list, settings: str) -> None:
+        '''
+        Stores the rows of matrix (np.ndarray or PackedFingerprints) for
+        the InChIKeys in keys, skipping rows with key None
+        '''
+        nbits = None
+        if isinstance(matrix, fingerprints.PackedFingerprints):
+            nbits = matrix.nbits
+            matrix = matrix.words
+
+        now = time.time()
+        data = [(key, settings, matrix[i].tobytes(), now)
+                for i, key in enumerate(keys) if key is not None]
+
+        try:
+            con = self._connect()
+            with closing(con), con:
+                con.execute('INSERT OR REPLACE INTO variables VALUES '
+                            '(?,?,?,?)', (settings, json.dumps(names),
+                                          matrix.dtype.str, nbits))
+                con.executemany('INSERT OR REPLACE INTO descriptors VALUES '
+                                '(?,?,?,?)', data)
+                self._evict(con)
+        except sqlite3.Error as e:
+            LOG.warning(f'Unable to write descriptor cache {self.path}: {e}')
+
+    def _evict(self, con) -> None:
+        ''' removes the least recently used rows above max_entries '''
+        if not self.max_entries:
+            return
+
+        nrows = con.execute('SELECT COUNT(*) FROM descriptors').fetchone()[0]
+        excess = nrows - self.max_entries
+        if excess > 0:
+            con.execute('DELETE FROM descriptors WHERE rowid IN (SELECT rowid '
+                        'FROM descriptors ORDER BY last_used LIMIT ?)',
+                        (excess,))
+            LOG.debug(f'{excess} rows removed from descriptor cache')
+
+    def _store(self, keys: list, results: dict, settings: str) -> None:
+        ''' stores the successful rows of full form results '''
+        ok = results['success_arr']
+        self.put([key for key, iok in zip(keys, ok) if iok],
+                 results['matrix'][ok, :], results['names'], settings)
+
+    def compute(self, md_function, ifile: str, settings: str) -> (bool, dict):
+        '''
+        Computes the descriptors of the molecules in ifile (an SDFile or a
+        list of mols) using md_function (one of the methods in compute_md,
+        returning results in full form) only for the molecules not present
+        in the cache
+
+        Returns a boolean and a full form results dictionary, as md_function
+        '''
+        if isinstance(ifile, str):
+            records = read_blocks(ifile)
+        else:
+            records = ifile
+        keys = structure_keys(records)
+
+        cached, variables = self.get(keys, settings)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+
+        LOG.info(f'{len(records)-len(missing)} molecules of {len(records)}'
+                 ' found in the descriptor cache')
+
+        if len(missing) == len(records):
+            success, computed = md_function(ifile)
+            if success:
+                self._store(keys, computed, settings)
+            return success, computed
+
+        computed = None
+        if len(missing) > 0:
+            if isinstance(ifile, str):
+                temp_path = tempfile.mkdtemp()
+                mfile = os.path.join(temp_path, 'missing.sdf')
+                with open(mfile, 'w') as f:
+                    f.writelines(records[i] for i in missing)
+                success, computed = md_function(mfile)
+                shutil.rmtree(temp_path)
+            else:
+                success, computed = md_function([records[i] for i in missing])
+
+            # failing for all new molecules is not an error if others
+            # were found in the cache
+            if not success:
+                LOG.warning(computed)
+                computed = None
+            elif computed['names'] != variables[0]:
+                LOG.warning('Cached variables do not match the computed '
+                            'ones, recomputing all the molecules')
+                success, computed = md_function(ifile)
+                if success:
+                    self._store(keys, computed, settings)
+                return success, computed
+            else:
+                self._store([keys[i] for i in missing], computed, settings)
+
+        names, dtype, nbits = variables
+
+        # assemble the full form matrix from cached and computed rows
+        ncols = len(names) if nbits is None else fingerprints.n_words(nbits)
+        matrix = np.zeros((len(records), ncols), dtype=dtype)
+        success_arr = np.zeros(len(records), dtype=bool)
+
+        for i, key in enumerate(keys):
+            if key in cached:
+                matrix[i] = np.frombuffer(cached[key], dtype=dtype)
+                success_arr[i] = True
+
+        if computed is not None:
+            cmatrix = computed['matrix']
+            if nbits is not None:
+                cmatrix = cmatrix.words
+            matrix[missing] = cmatrix
+            success_arr[missing] = computed['success_arr']
+
+        if nbits is not None:
+            matrix = fingerprints.PackedFingerprints(matrix, nbits)
+
+        return True, {'matrix': matrix, 'names': names,
+                      'success_arr': success_arr}
@@ -0,0 +1,292 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame bit-packed binary fingerprints and similarity kernels
+##
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+##
+# Copyright 2018 Manuel Pastor
+##
+# This file is part of Flame
+##
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+##
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+##
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from flame.util import get_logger
+
+LOG = get_logger(__name__)
+
+# bits stored in every word of a packed fingerprint
+WORD_BITS = 64
+
+# max words of the intermediate arrays of tanimoto_similarity (32 MB)
+BLOCK_WORDS = 1 << 22
+
+# number of bits set for every possible 16 bit value
+_POPCOUNT_TABLE16 = np.zeros(2**16, dtype=np.uint8)
+for _i in range(16):
+    _POPCOUNT_TABLE16 += ((np.arange(2**16) >> _i) & 1).astype(np.uint8)
+
+
+def n_words(nbits: int) -> int:
+    ''' number of uint64 words required to store nbits bits '''
+    return (nbits + WORD_BITS - 1) // WORD_BITS
+
+
+def pack_bits(matrix) -> np.ndarray:
+    '''
+    Packs a 2D matrix of 0/1 values (any dtype) into a uint64 matrix
+    with n_words(ncols) words per row. Bit j of the row is stored in
+    word j // 64, position j % 64
+    '''
+    matrix = np.atleast_2d(np.asarray(matrix))
+    nrows, nbits = matrix.shape
+    nbytes = n_words(nbits) * 8
+
+    packed = np.zeros((nrows, nbytes), dtype=np.uint8)
+    packed[:, :(nbits + 7) // 8] = np.packbits(matrix != 0, axis=1,
+                                                bitorder='little')
+
+    return packed.view('<u8')
+
+
+def unpack_bits(words: np.ndarray, nbits: int, dtype=np.uint8) -> np.ndarray:
+    '''
+    Inverse of pack_bits, returns a (nrows, nbits) matrix of 0/1 values
+    '''
+    words = np.ascontiguousarray(np.atleast_2d(words), dtype='<u8')
+    dense = np.unpackbits(words.view(np.uint8), axis=1, count=nbits,
+                          bitorder='little')
+
+    return dense.astype(dtype, copy=False)
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    '''
+    Number of bits set in the words, summed over the last axis
+    '''
+    words = np.ascontiguousarray(words, dtype='<u8')
+
+    # numpy >= 2.0 provides a native popcount
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+
+    return _POPCOUNT_TABLE16[words.view(np.uint16)].sum(axis=-1,
+                                                        dtype=np.int64)
+
+
+def _as_words(X):
+    ''' returns the packed words of X, packing dense matrices if needed '''
+    if isinstance(X, PackedFingerprints):
+        return X.words
+    return pack_bits(X)
+
+
+def _block_rows(nwords: int, block_size=None) -> int:
+    ''' rows of X and Y compared together, so that the intermediate
+        (rows, rows, nwords) array has at most BLOCK_WORDS words '''
+    if block_size is not None:
+        return block_size
+    return max(1, int(np.sqrt(BLOCK_WORDS / max(nwords, 1))))
+
+
+def tanimoto_similarity(X, Y=None, block_size=None) -> np.ndarray:
+    '''
+    Tanimoto (Jaccard) similarity between the rows of X and the rows of Y
+
+    Parameters
+    ----------
+
+    X, Y: PackedFingerprints or 2D arrays of 0/1 values
+        if Y is None the similarity of X with itself is computed
+
+    block_size: int
+        number of rows of X and of Y compared together. By default it is
+        chosen so that the intermediate (block_size, block_size, nwords)
+        array uses at most BLOCK_WORDS words
+
+    Returns
+    -------
+
+    np.ndarray (len(X), len(Y)) of float64 similarities. Pairs of empty
+    fingerprints have similarity 0, as in RDKit
+    '''
+    wx = _as_words(X)
+    wy = wx if Y is None else _as_words(Y)
+
+    if wx.shape[1] != wy.shape[1]:
+        raise ValueError('Fingerprints of different length: '
+                         f'{wx.shape[1]} and {wy.shape[1]} words')
+
+    count_x = popcount(wx)
+    count_y = popcount(wy)
+    rows = _block_rows(wx.shape[1], block_size)
+
+    sim = np.empty((wx.shape[0], wy.shape[0]), dtype=np.float64)
+
+    for xstart in range(0, wx.shape[0], rows):
+        xend = min(xstart + rows, wx.shape[0])
+        for ystart in range(0, wy.shape[0], rows):
+            yend = min(ystart + rows, wy.shape[0])
+            common = popcount(wx[xstart:xend, None, :] &
+                              wy[None, ystart:yend, :])
+            union = (count_x[xstart:xend, None] +
+                     count_y[None, ystart:yend] - common)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sim[xstart:xend, ystart:yend] = np.where(
+                    union > 0, common / union, 0.0)
+
+    return sim
+
+
+def jaccard_distance(X, Y=None, block_size=None) -> np.ndarray:
+    '''
+    Jaccard distance (1 - Tanimoto similarity) between the rows of X and
+    the rows of Y
+    '''
+    return 1.0 - tanimoto_similarity(X, Y, block_size)
+
+
+def tanimoto_kernel(X, Y) -> np.ndarray:
+    '''
+    Tanimoto kernel for sklearn estimators accepting callable kernels
+    (e.g. SVC, SVR). X and Y are dense matrices, as passed by sklearn, and
+    their non-zero values are considered set bits.
+
+    The common bits are obtained with a matrix product, instead of packing
+    X and Y again in every call. The 0/1 float32 products are exact up to
+    2**24 bits
+    '''
+    bx = (np.asarray(X) != 0).astype(np.float32)
+    by = bx if Y is X else (np.asarray(Y) != 0).astype(np.float32)
+
+    common = (bx @ by.T).astype(np.float64)
+    union = bx.sum(axis=1, dtype=np.float64)[:, None] + \
+        by.sum(axis=1, dtype=np.float64)[None, :] - common
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, common / union, 0.0)
+
+
+class PackedFingerprints:
+    '''
+    Matrix of binary fingerprints stored as rows of packed uint64 words.
+
+    Uses 1 bit per fingerprint bit (64 times less memory than a float64
+    matrix). It behaves as a (nobj, nbits) matrix in the places where
+    Flame handles xmatrix: shape, row selection and conversion to a dense
+    numpy array (np.asarray) are supported.
+
+    Attributes
+    ----------
+
+    words: np.ndarray
+        (nobj, n_words(nbits)) uint64 matrix
+    nbits: int
+        number of bits of every fingerprint
+    '''
+
+    def __init__(self, words, nbits: int):
+        words = np.asarray(words, dtype='<u8')
+        if words.ndim == 1:
+            words = words.reshape(1, -1)
+
+        if words.shape[1] != n_words(nbits):
+            raise ValueError(f'{nbits} bits cannot be stored in'
+                             f' {words.shape[1]} words')
+        self.words = words
+        self.nbits = nbits
+
+    @classmethod
+    def from_dense(cls, matrix):
+        ''' packs a dense matrix of 0/1 values '''
+        matrix = np.atleast_2d(np.asarray(matrix))
+        return cls(pack_bits(matrix), matrix.shape[1])
+
+    @property
+    def shape(self):
+        return (self.words.shape[0], self.nbits)
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def nbytes(self):
+        return self.words.nbytes
+
+    def __len__(self):
+        return self.words.shape[0]
+
+    def __repr__(self):
+        return f'PackedFingerprints(nobj={len(self)}, nbits={self.nbits})'
+
+    def __getitem__(self, key):
+        '''
+        Row selection (int, slice, mask or index array) returns
+        PackedFingerprints. Selections including columns return the
+        corresponding dense values
+        '''
+        if isinstance(key, tuple):
+            rows, cols = key
+            # X[rows, :] and X[rows, ...] (used by sklearn) select rows
+            if cols is Ellipsis or \
+               (isinstance(cols, slice) and cols == slice(None)):
+                return self[rows]
+            return self.unpack()[key]
+
+        return PackedFingerprints(self.words[key], self.nbits)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.unpack(dtype if dtype is not None else np.uint8)
+
+    def unpack(self, dtype=np.uint8) -> np.ndarray:
+        ''' returns the fingerprints as a dense (nobj, nbits) matrix '''
+        return unpack_bits(self.words, self.nbits, dtype)
+
+    def copy(self):
+        return PackedFingerprints(self.words.copy(), self.nbits)
+
+    def popcount(self) -> np.ndarray:
+        ''' number of bits set in every fingerprint '''
+        return popcount(self.words)
+
+    def tanimoto(self, other=None, block_size=None) -> np.ndarray:
+        ''' Tanimoto similarity matrix with other (or with itself) '''
+        return tanimoto_similarity(self, other, block_size)
+
+
+def vstack(matrices: list):
+    '''
+    Stacks vertically a list of matrices. When all of them are
+    PackedFingerprints of the same length, the result is also packed,
+    otherwise dense matrices are stacked with np.vstack
+    '''
+    if all(isinstance(m, PackedFingerprints) for m in matrices):
+        nbits = {m.nbits for m in matrices}
+        if len(nbits) != 1:
+            raise ValueError(f'Cannot stack fingerprints of lengths {nbits}')
+        return PackedFingerprints(np.vstack([m.words for m in matrices]),
+                                  nbits.pop())
+
+    return np.vstack([np.asarray(m) for m in matrices])
+
+
+def to_dense(matrix, dtype=np.float64):
+    '''
+    Returns matrix as a dense numpy array, unpacking PackedFingerprints
+    '''
+    if isinstance(matrix, PackedFingerprints):
+        return matrix.unpack(dtype)
+    return matrix
@@ -20,25 +20,240 @@
 # You should have received a copy of the GNU General Public License
 # along with Flame. If not, see <http://www.gnu.org/licenses/>.
 
+import io
 import os
+import re
+import mmap
+import hashlib
+import collections
+
+import numpy as np
 from rdkit import Chem
 from flame.util import get_logger
 
 LOG = get_logger(__name__)
 
 
+# byte pattern of the SDFile record terminator line
+_TERMINATOR = re.compile(rb'^\$\$\$\$[^\n]*(?:\n|$)', re.MULTILINE)
+
+# counts line (numbers of atoms and bonds) following the 3 header lines
+# of a record, and end of its connection table
+_COUNTS_LINE = re.compile(rb'(?:[^\n]*\n){3}[ \d]{2}\d[ \d]{2}\d')
+_MOL_END = re.compile(rb'^M  END', re.MULTILINE)
+
+# version of the index files cached next to the SDFiles
+INDEX_VERSION = 1
+
+# indexes created by this process, by absolute path (least recently
+# used first)
+MAX_INDEXES = 32
+_index_memo = collections.OrderedDict()
+
+
+class SDFIndex:
+    ''' Index of the records present in an SDFile, giving O(1) access to the
+        number of records and to the bytes of any record
+
+        The index is obtained in a single scan of the raw bytes, looking for
+        the "$$$$" terminators, and contains the byte offset and length of
+        every record, in the same order and number of records reported by
+        Chem.SDMolSupplier. The records containing a connection table,
+        which are counted by count_mols, are identified in the same scan
+
+        The mask of valid molecules (those producing a 'mol' which is not
+        None) requires parsing all the records with RDKit. It is computed
+        only when needed and saved, together with the offsets, in a
+        file located next to the SDFile and identified by its MD5. Use
+        SDFIndex.get(ifile) to reuse indexes already built.
+    '''
+
+    def __init__(self, ifile, cache=True):
+        self.ifile = os.path.abspath(ifile)
+        self.cache = cache
+        self._valid = None
+
+        with open(self.ifile, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                data = b''
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self.md5 = hashlib.md5(data).hexdigest()
+            if not (self.cache and self._load_cache()):
+                self._scan(data)
+            self._blocks = self._scan_blocks(data)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    def _scan(self, data):
+        ''' obtains the offsets and lengths of the records in data '''
+        ends = [m.end() for m in _TERMINATOR.finditer(data)]
+
+        # trailing content without terminator is also a record
+        last = ends[-1] if len(ends) > 0 else 0
+        if data[last:].strip():
+            ends.append(len(data))
+
+        ends = np.array(ends, dtype=np.int64)
+        self.offsets = np.concatenate(([0], ends[:-1])).astype(np.int64)
+        self.lengths = ends - self.offsets
+
+    def _scan_blocks(self, data) -> np.ndarray:
+        ''' boolean mask of the records in data containing a connection
+            table (a counts line and an "M  END" line) '''
+        with_end = np.zeros(len(self), dtype=bool)
+        ends = np.array([m.start() for m in _MOL_END.finditer(data)],
+                        dtype=np.int64)
+        if len(ends) > 0 and len(self) > 0:
+            with_end[np.searchsorted(self.offsets, ends, side='right') - 1] \
+                = True
+
+        counts = np.array([_COUNTS_LINE.match(data, offset) is not None
+                           for offset in self.offsets.tolist()], dtype=bool)
+
+        return with_end & counts
+
+    @classmethod
+    def get(cls, ifile):
+        ''' returns the index of ifile, reusing the one built in this
+            process if the file was not modified since '''
+        path = os.path.abspath(ifile)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        memo = _index_memo.get(path)
+        if memo is not None and memo[0] == signature:
+            _index_memo.move_to_end(path)
+            return memo[1]
+
+        index = cls(path)
+        _index_memo[path] = (signature, index)
+        _index_memo.move_to_end(path)
+        while len(_index_memo) > MAX_INDEXES:
+            _index_memo.popitem(last=False)
+        return index
+
+    @property
+    def cache_file(self):
+        dirname, basename = os.path.split(self.ifile)
+        return os.path.join(dirname, '.' + basename + '.idx.npz')
+
+    def _load_cache(self):
+        ''' loads offsets and valid mask from the cache file, if it was
+            created for the current content of the SDFile '''
+        try:
+            with np.load(self.cache_file) as npz:
+                if str(npz['md5']) != self.md5 or \
+                   int(npz['version']) != INDEX_VERSION:
+                    return False
+                self.offsets = npz['offsets']
+                self.lengths = npz['lengths']
+                if npz['valid'].shape == self.offsets.shape:
+                    self._valid = npz['valid']
+        except Exception:
+            return False
+
+        return True
+
+    def _save_cache(self):
+        try:
+            with open(self.cache_file, 'wb') as f:
+                np.savez(f, md5=self.md5, version=INDEX_VERSION,
+                         offsets=self.offsets, lengths=self.lengths,
+                         valid=self._valid)
+        except Exception as e:
+            LOG.debug(f'Unable to save SDFile index {self.cache_file}: {e}')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def record(self, i) -> bytes:
+        ''' returns the bytes of record i '''
+        with open(self.ifile, 'rb') as f:
+            f.seek(self.offsets[i])
+            return f.read(self.lengths[i])
+
+    def __getitem__(self, key):
+        ''' bytes of a record (int key) or list of bytes (slice key) '''
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return [self.record(i) for i in range(start, stop, step)]
+            if start >= stop:
+                return []
+            with open(self.ifile, 'rb') as f:
+                f.seek(self.offsets[start])
+                data = f.read(self.offsets[stop-1] + self.lengths[stop-1]
+                              - self.offsets[start])
+            bounds = self.offsets[start:stop] - self.offsets[start]
+            return [data[b:b+l] for b, l in zip(bounds,
+                                                self.lengths[start:stop])]
+
+        return self.record(key)
+
+    def mol(self, i):
+        ''' returns the RDKit mol of record i (None if it is not valid),
+            including the SDFile fields as properties '''
+        suppl = Chem.SDMolSupplier()
+        suppl.SetData(self.record(i).decode('utf-8', errors='replace'))
+        return suppl[0] if len(suppl) > 0 else None
+
+    def byte_range(self, start, stop) -> (int, int):
+        ''' returns the first and last+1 bytes of records start to stop-1 '''
+        if start >= stop:
+            return 0, 0
+        return (int(self.offsets[start]),
+                int(self.offsets[stop-1] + self.lengths[stop-1]))
+
+    @property
+    def valid(self) -> np.ndarray:
+        ''' boolean mask of records producing a valid mol '''
+        if self._valid is None:
+            self._valid = np.zeros(len(self), dtype=bool)
+            for i, mol in enumerate(Chem.SDMolSupplier(self.ifile)):
+                if i >= len(self):
+                    break
+                self._valid[i] = mol is not None
+            if self.cache:
+                self._save_cache()
+
+        return self._valid
+
+    def count_valid(self) -> int:
+        ''' number of records producing a valid mol '''
+        return int(np.count_nonzero(self.valid))
+
+    def count_blocks(self) -> int:
+        ''' number of records containing a connection table, obtained
+            from the raw bytes without parsing them '''
+        return int(np.count_nonzero(self._blocks))
+
+
 def count_mols(ifile):
-    ''' returns the number of valid molecules within an SDFile
+    ''' returns the number of molecules within an SDFile
 
-        do not consider invalid molecular blocks unable to produce
-        a valid 'mol' (those for which 'mol is None')
+        do not consider molecular blocks without a connection table (a
+        counts line after the header and an "M  END" line), which cannot
+        produce a valid 'mol'. The records are not parsed, so blocks
+        rejected by RDKit for other reasons (e.g. wrong valences) are
+        counted. SDFIndex.valid gives the exact mask of valid mols
     '''
-    suppl = Chem.SDMolSupplier(ifile)
-    num_mols = 0
-    for mol in suppl:
-        if mol is not None :
-            num_mols +=1
-    return num_mols
+    return SDFIndex.get(ifile).count_blocks()
+
+def write_mols(mols, ofile):
+    ''' writes the list of mols provided as argument into the SDFile ofile,
+        skipping None elements
+    '''
+    writer = Chem.SDWriter(ofile)
+    for mol in mols:
+        if mol is not None:
+            writer.write(mol)
+    writer.close()
+
+    return ofile
 
 def split_SDFile(ifile, num_chunks):
     ''' splits the input SDfile in num_chunks SDfiles, containing a balanced number
@@ -124,6 +339,88 @@ def split_SDFile(ifile, num_chunks):
     return True, (temp_files_name, temp_files_size)
 
 
+def split_SDFile_ranges(ifile, num_chunks):
+    ''' splits the input SDFile in num_chunks byte ranges, containing a
+    balanced number of valid molecules, without writting any file
+
+    Every range is a tupla (ifile, start, end) which can be used as input
+    of read_mols. The ranges follow the order of the molecules in ifile
+
+    Argument:
+        ifile       : input SDfile
+        num_chunks  : number of pieces
+
+    Output:
+        list of ranges
+        list of number of valid molecules within each range
+    '''
+    index = SDFIndex.get(ifile)
+    valid_records = np.flatnonzero(index.valid)
+
+    if len(valid_records) == 0:
+        LOG.critical(f'No molecule found in {ifile}')
+        return False, 'No molecule found in file: '+ifile
+
+    num_chunks = max(1, min(num_chunks, len(valid_records)))
+    LOG.debug(f'Splitting {ifile} into {num_chunks} ranges')
+
+    ranges = []
+    sizes = []
+    for chunk in np.array_split(valid_records, num_chunks):
+        start, end = index.byte_range(chunk[0], chunk[-1] + 1)
+        ranges.append((index.ifile, start, end))
+        sizes.append(len(chunk))
+
+    return True, (ranges, sizes)
+
+
+def read_bytes(source) -> bytes:
+    ''' returns the content of source, an SDFile name or a tupla
+        (ifile, start, end) describing a byte range '''
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+
+    ifile, start, end = source
+    with open(ifile, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def read_mols(source) -> list:
+    ''' returns the valid mols in source, an SDFile name or a tupla
+        (ifile, start, end) describing a byte range. Only the bytes in
+        the range are parsed '''
+    if isinstance(source, str):
+        return [m for m in Chem.SDMolSupplier(source) if m is not None]
+
+    suppl = Chem.ForwardSDMolSupplier(io.BytesIO(read_bytes(source)))
+    return [m for m in suppl if m is not None]
+
+
+def write_range(source, ofile):
+    ''' copies the bytes of a range (ifile, start, end) into ofile '''
+    with open(ofile, 'wb') as fo:
+        fo.write(read_bytes(source))
+    return ofile
+
+
+def record_ranges(source) -> list:
+    ''' returns the ranges of the individual valid records in source, an
+        SDFile name or a tupla (ifile, start, end) '''
+    if isinstance(source, str):
+        source = (source, 0, os.path.getsize(source))
+
+    ifile, start, end = source
+    index = SDFIndex.get(ifile)
+
+    records = np.flatnonzero(index.valid & (index.offsets >= start) &
+                             (index.offsets + index.lengths <= end))
+
+    return [(index.ifile, int(index.offsets[i]),
+             int(index.offsets[i] + index.lengths[i])) for i in records]
+
+
 def getName(mol, count=1, field=None):
     ''' returns a name for the mol object provided as argument
         Names are extracted from the SDFile fields, using the list of
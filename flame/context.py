@@ -22,52 +22,35 @@
 # along with Flame. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import copy
 import shutil
 import pathlib
+import tempfile
+import collections
 
-from flame.util import utils, get_logger
-
-# if the number of models is higher, try to run in multithread
-MAX_MODELS_SINGLE_CPU = 4
+from flame.util import utils, pool, get_logger
 
 LOG = get_logger(__name__)
 
+# parameters of the models predicted in this process, by (endpoint, version)
+MAX_PARAMETERS = 32
+_parameters_cache = collections.OrderedDict()
+
+
 def get_external_input(task, model_set, infile):
     '''
     Manage obtention of input data from external
     data sources (e.g. models or MD servers)
     '''
 
-    # parallel is approppriate for many external sources
-    parallel = (len(model_set) > MAX_MODELS_SINGLE_CPU)
-    if parallel:
-        task.set_single_CPU()
-
     # add input molecule to the model input definition of every internal model
     for mi in model_set:
         mi['infile'] = infile
 
-    model_suc = []
-    model_res = []
-
     # TODO: if any of the models belongs to another module, send a POST for
     # obtaining the results
 
-    if parallel:
-
-        import multiprocessing as mp
-        
-        pool = mp.Pool(len(model_set))
-        model_temp = pool.map(predict_cmd, model_set)
-
-        for x in model_temp:
-            model_suc.append(x[0])
-            model_res.append(x[1])
-    else:
-        for mi in model_set:
-            success, results = predict_cmd(mi)
-            model_suc.append(success)
-            model_res.append(results)
+    model_suc, model_res = predict_model_set(model_set)
 
     if False in model_suc:
         return False, 'Some external input sources failed: ', str(model_suc)
@@ -77,6 +60,146 @@ def get_external_input(task, model_set, infile):
     return True, model_res
 
 
+def _parameters(endpoint, version):
+    '''
+    Returns a copy of the parameters of the model, reading the model
+    parameters file only when it is not in memory or was modified, or
+    None if it cannot be read
+    '''
+    from flame.parameters import Parameters
+
+    key = (endpoint, version)
+    param_file = os.path.join(utils.model_path(endpoint, version),
+                              'parameters.yaml')
+    try:
+        stamp = os.stat(param_file).st_mtime_ns
+    except OSError:
+        return None
+
+    if key in _parameters_cache and _parameters_cache[key][0] == stamp:
+        _parameters_cache.move_to_end(key)
+        return copy.deepcopy(_parameters_cache[key][1])
+
+    param = Parameters()
+    success, message = param.loadYaml(endpoint, version)
+    if not success:
+        return None
+
+    _parameters_cache[key] = (stamp, param)
+    _parameters_cache.move_to_end(key)
+    while len(_parameters_cache) > MAX_PARAMETERS:
+        _parameters_cache.popitem(last=False)
+
+    return copy.deepcopy(param)
+
+
+def _predict(model):
+    ''' returns a Predict object of the model, with JSON output '''
+    from flame.predict import Predict
+
+    return Predict(model['endpoint'], model['version'], 'JSON',
+                   parameters=_parameters(model['endpoint'],
+                                          model['version']))
+
+
+def _input_task(task):
+    ''' generates the input of a group of models, running Idata for the
+        first one and saving the conveyor in input_path. Models with
+        external input are predicted completely '''
+    model, input_path = task
+    predict = _predict(model)
+
+    ext_input, model_set = predict.get_model_set()
+    if ext_input:
+        return predict_cmd(model, 'JSON')
+
+    predict.run_idata(model['infile'])
+    predict.conveyor.saveFile(input_path)
+    return None
+
+
+def _apply_task(task):
+    ''' completes the prediction of a model with the input saved in
+        input_path. The arrays of the input are memory-mapped, so the
+        models of a group share them '''
+    model, input_path = task
+    predict = _predict(model)
+
+    with open(input_path, 'rb') as fi:
+        success, message = predict.conveyor.load(fi)
+    if not success:
+        return False, f'Unable to read the input of {model["endpoint"]}: '\
+                      f'{message}'
+
+    predict.conveyor.addMeta('endpoint', predict.param.getVal('endpoint'))
+    predict.conveyor.addMeta('version', predict.param.getVal('version'))
+
+    predict.run_apply()
+    return predict.run_odata()
+
+
+def predict_model_set(model_set):
+    '''
+    Predicts the input file of every model in model_set, returning the
+    lists of success and results (in JSON format) of every model.
+
+    Models generating the same input (see Predict.idata_signature) are
+    grouped, so the molecules are normalized and the descriptors computed
+    only once for each group. The input of every group and then the
+    predictions of every model are run in parallel.
+
+    The workers only receive the model identifiers and the path of the
+    input of the group, saved once in a temporary conveyor file
+    '''
+    groups = collections.OrderedDict()
+    for i, mi in enumerate(model_set):
+        predict = _predict(mi)
+
+        if predict.get_model_set()[0]:
+            signature = i
+        else:
+            signature = predict.idata_signature()
+        groups.setdefault(signature, []).append(i)
+
+    LOG.info(f'{len(model_set)} external input models'
+             f' grouped in {len(groups)} input groups')
+
+    model_out = [None] * len(model_set)
+
+    with tempfile.TemporaryDirectory(prefix='flame-input-') as tmp_dir:
+        input_paths = [os.path.join(tmp_dir, f'group-{i}.conveyor')
+                       for i in range(len(groups))]
+
+        group_tasks = [(model_set[igroup[0]], input_path)
+                       for igroup, input_path in zip(groups.values(),
+                                                     input_paths)]
+        ncpu = min(len(group_tasks), pool.cpu_count())
+
+        apply_index = []
+        apply_tasks = []
+
+        for igroup, input_path, result in zip(
+                groups.values(), input_paths,
+                pool.map(_input_task, group_tasks, ncpu)):
+            if result is not None:
+                model_out[igroup[0]] = result
+                continue
+
+            for i in igroup:
+                apply_index.append(i)
+                apply_tasks.append((model_set[i], input_path))
+
+        ncpu = min(len(apply_tasks), pool.cpu_count())
+        for i, result in zip(apply_index,
+                             pool.map(_apply_task, apply_tasks, ncpu)):
+            model_out[i] = result
+
+    model_suc = [success for success, results in model_out]
+    model_res = [results for success, results in model_out]
+
+    return model_suc, model_res
+
+
 def predict_cmd(model, output_format=None):
     '''
     Instantiates a Predict object to run a prediction using the given input
@@ -203,6 +326,12 @@ def manage_cmd(args):
         success, results = manage.action_refactoring(args.file)
     elif args.action == 'info':
         success, results = manage.action_info(args.endpoint, version)
+    elif args.action == 'significance':
+        significances = getattr(args, 'significance', None)
+        if significances is not None:
+            significances = [float(x) for x in significances.split(',')]
+        success, results = manage.action_significance(
+            args.endpoint, version, significances)
     elif args.action == 'results':
         success, results = manage.action_results(args.endpoint, version)
     elif args.action == 'parameters':
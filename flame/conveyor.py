@@ -20,12 +20,75 @@
 # You should have received a copy of the GNU General Public License
 # along with Flame. If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import pickle
 import numpy as np
 import json
-from flame.util import utils
+from flame.util import utils, jsonwriter
+
+CONVEYOR_VER = 2    # update only for major changes
+
+# conveyors are stored in a container starting with MAGIC, followed by the
+# length of a JSON header (8 bytes, little endian), the header and the data
+# of every key in a block aligned to ALIGN bytes. The header describes the
+# manifest, meta and the position of every block, so the keys can be read
+# separately. Numeric arrays are stored as raw data and memory-mapped when
+# they are larger than MMAP_BYTES. Any other value is pickled
+MAGIC = b'FLAMECNV'
+ALIGN = 64
+MMAP_BYTES = 65536
+
+# python types stored in typed numpy columns. Strings are kept in object
+# columns, since fixed-width unicode arrays use 4 bytes per character of
+# the longest string for every element
+COLUMN_TYPES = (bool, int, float)
+
+
+def to_column(values):
+    '''
+    Returns the values of an object dimension key as a 1D numpy array.
+    Lists of values of a single numeric type (bool, int, float) are
+    stored in typed arrays and any other list (e.g. strings) in an object
+    array, so the elements are not converted. Arrays and other values are
+    not modified
+    '''
+    if not isinstance(values, (list, tuple)):
+        return values
+
+    types = set(type(value) for value in values)
+    if len(types) == 1 and types.pop() in COLUMN_TYPES:
+        return np.array(values)
+
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
+def _raw(value) -> bool:
+    ''' True for the arrays stored as raw data '''
+    return isinstance(value, np.ndarray) and not value.dtype.hasobject \
+        and value.dtype.fields is None
+
+
+def read_header(fi):
+    '''
+    Returns the header of the conveyor container stored in fi, at the
+    current position, or None for conveyors saved in the old format. The
+    position of fi is not modified
+    '''
+    start = fi.tell()
+    try:
+        if fi.read(len(MAGIC)) != MAGIC:
+            return None
+        size = int.from_bytes(fi.read(8), 'little')
+        header = json.loads(fi.read(size).decode('utf-8'))
+    finally:
+        fi.seek(start)
+
+    header['data_start'] = start + len(MAGIC) + 8 + size
+    return header
 
-CONVEYOR_VER = 1    # update only for major changes
 
 class Conveyor:
     ''' Class storing all data generated in the workflows. This class is 
@@ -35,6 +98,11 @@ class Conveyor:
     The class contains data (data) an index (manifest) and an auxiliar 
     dictionary for identifying important data
 
+    The data of the objects (objs dimension) is stored in numpy columns
+    (see to_column), so the objects can be selected with a boolean mask in
+    all the keys at once (filterObjects). The manifest items are indexed
+    by key and dimension, so the lookups do not scan the manifest
+
     It is also used to handle workflow errors. Errors are dumped here and
     checked frequently in the code. When detected, the workflow is aborted
 
@@ -51,20 +119,140 @@ class Conveyor:
         self.meta = { 'main' : [] }
         self.error = None
         self.warning = None
+        self._index()
+
+    def _index(self):
+        ''' indexes the manifest items by key and by dimension '''
+        self.items = {}
+        self.dimensions = {}
+        for item in self.manifest:
+            self.items[item['key']] = item
+        for item in self.items.values():
+            self.dimensions.setdefault(item['dimension'], []).append(
+                item['key'])
+
+    def save(self, fo, extra=None):
+        '''
+        Writes the conveyor in fo, in the container format. The dictionary
+        extra (JSON serializable) is stored in the header and can be
+        checked with read_header without reading the data
+        '''
+        entries = {}
+        blocks = []
+        offset = 0
+        for key in self.data:
+            value = self.data[key]
+            if _raw(value):
+                value = np.ascontiguousarray(value)
+                entry = {'dtype': value.dtype.str, 'shape': list(value.shape)}
+                block = value.tobytes()
+            else:
+                entry = {'dtype': None}
+                block = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+            padding = -offset % ALIGN
+            offset += padding
+            entry['offset'] = offset
+            entry['nbytes'] = len(block)
+            entries[key] = entry
+            blocks.append((padding, block))
+            offset += len(block)
+
+        header = {'version': self.conveyor_ver,
+                  'origin': self.origin,
+                  'manifest': self.manifest,
+                  'error': self.error,
+                  'warning': self.warning,
+                  'extra': extra,
+                  'entries': entries}
+        try:
+            header['meta'] = json.loads(json.dumps(self.meta))
+        except (TypeError, ValueError):
+            header['meta_pickle'] = pickle.dumps(self.meta).hex()
+
+        header = json.dumps(header, default=str).encode('utf-8')
+        # the data starts aligned
+        header += b' ' * (-(len(MAGIC) + 8 + len(header)) % ALIGN)
+
+        fo.write(MAGIC)
+        fo.write(len(header).to_bytes(8, 'little'))
+        fo.write(header)
+        for padding, block in blocks:
+            fo.write(b'\0' * padding)
+            fo.write(block)
+
+    def saveFile(self, path, extra=None):
+        ''' writes the conveyor in path, replacing it only when complete,
+            so memory-mapped copies of the old file are not modified '''
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fo:
+            self.save(fo, extra)
+        os.replace(tmp_path, path)
+
+    def load(self, fi, keys=None):
+        '''
+        Reads the conveyor stored in fi. When keys is given, only these
+        keys are read (e.g. for reading model info without the X matrix).
+        The large arrays of conveyors read from a file are memory-mapped
+        (copy-on-write)
+        '''
+        try:
+            header = read_header(fi)
+        except Exception:
+            return False, 'Error extracting header'
 
-    def save(self,fo):        
-        ''' constructor '''
-        pickle.dump(self.conveyor_ver, fo)
-        pickle.dump(self.origin, fo)
-        pickle.dump(self.data, fo)
-        pickle.dump(self.manifest, fo)
-        pickle.dump(self.meta, fo)
-        pickle.dump(self.error, fo)
-        pickle.dump(self.warning, fo)
-        
-    def load(self, fi):
-        ''' constructor '''
-        if pickle.load(fi) != self.conveyor_ver:
+        if header is None:
+            return self._load_pickles(fi)
+
+        if header['version'] != self.conveyor_ver:
+            return False, 'Wrong version'
+
+        self.origin = header['origin']
+        self.manifest = header['manifest']
+        self.error = header['error']
+        self.warning = header['warning']
+        if 'meta' in header:
+            self.meta = header['meta']
+        else:
+            self.meta = pickle.loads(bytes.fromhex(header['meta_pickle']))
+
+        path = getattr(fi, 'name', None)
+        if not isinstance(path, str) or not os.path.isfile(path):
+            path = None
+
+        self.data = {}
+        try:
+            for key, entry in header['entries'].items():
+                if keys is None or key in keys:
+                    self.data[key] = self._read_entry(
+                        fi, path, header['data_start'] + entry['offset'],
+                        entry)
+        except Exception:
+            return False, 'Error extracting data'
+
+        self._index()
+        return True, 'OK'
+
+    def _read_entry(self, fi, path, offset, entry):
+        ''' returns the value of a header entry, stored at offset '''
+        if entry['dtype'] is not None and path is not None and \
+           entry['nbytes'] >= MMAP_BYTES:
+            return np.memmap(path, dtype=np.dtype(entry['dtype']), mode='c',
+                             offset=offset,
+                             shape=tuple(entry['shape'])).view(np.ndarray)
+
+        fi.seek(offset)
+        block = fi.read(entry['nbytes'])
+        if entry['dtype'] is None:
+            return pickle.loads(block)
+
+        return np.frombuffer(block, dtype=np.dtype(entry['dtype'])).reshape(
+            entry['shape']).copy()
+
+    def _load_pickles(self, fi):
+        ''' reads conveyors saved in the old format (version 1), as a
+            sequence of pickles '''
+        if pickle.load(fi) != 1:
             return False, 'Wrong version'
         try:
             self.origin = pickle.load(fi)
@@ -76,6 +264,12 @@ class Conveyor:
         except:
             return False, 'Error extracting pickle'
 
+        # conveyors saved with lists in the object keys
+        self._index()
+        for key in self.objectKeys():
+            if key in self.data:
+                self.data[key] = to_column(self.data[key])
+
         return True, 'OK'
 
     def isKey(self, _key):
@@ -96,6 +290,11 @@ class Conveyor:
     def addMeta (self, key, value):
         self.meta[key] = value
 
+    def getMeta (self, key):
+        if key in self.meta:
+            return self.meta[key]
+        return None
+
     def getError (self):
         return self.error is not None
     
@@ -122,8 +321,32 @@ class Conveyor:
     def setVal(self, key, value):
         if not key in self.data:
             return
+        if self.getDimension(key) == 'objs':
+            value = to_column(value)
         self.data[key]=value
 
+    def getManifest(self, key):
+        ''' returns the manifest item of the key or None '''
+        return self.items.get(key)
+
+    def getDimension(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        return item['dimension']
+
+    def filterObjects(self, mask):
+        '''
+        Keeps only the objects selected by the boolean mask in all the keys
+        of the objs dimension. Keys with a different number of objects are
+        not modified
+        '''
+        mask = np.asarray(mask, dtype=bool)
+        for key in self.objectKeys():
+            value = self.data.get(key)
+            if value is not None and len(value) == len(mask):
+                self.data[key] = to_column(value)[mask]
+
     def addVal(self, var, _key, _label, _type, _dimension='objs',
                _description=None, _relevance=None):
         '''
@@ -151,6 +374,8 @@ class Conveyor:
         '''
         
         # add the data 
+        if _dimension == 'objs':
+            var = to_column(var)
         self.data[_key] = var
 
         # insert the information in manifest
@@ -161,69 +386,65 @@ class Conveyor:
                         'description': _description,
                         'relevance': _relevance
                         }
-    
-        self.manifest.append(manifest_item)
+
+        # keys added again replace their manifest item
+        if _key in self.items:
+            old_item = self.items[_key]
+            self.manifest[self.manifest.index(old_item)] = manifest_item
+            if old_item['dimension'] != _dimension:
+                self.dimensions[old_item['dimension']].remove(_key)
+                self.dimensions.setdefault(_dimension, []).append(_key)
+        else:
+            self.manifest.append(manifest_item)
+            self.dimensions.setdefault(_dimension, []).append(_key)
+        self.items[_key] = manifest_item
 
         # if the are adding data of type 'main' insert the key in main
-        if _relevance == 'main':
+        if _relevance == 'main' and _key not in self.meta['main']:
             self.addMain(_key)
 
     def objectKeys (self):
         ''' returns data keys containing objects values '''
-        object_elements = []
-        for i in self.manifest:
-            if i['dimension'] == 'objs':
-                object_elements.append(i['key'])
-
-        return object_elements
+        return list(self.dimensions.get('objs', []))
     
     def singleKeys (self):
         ''' returns data keys containing single values '''
-        single_elements = []
-        for i in self.manifest:
-            if i['dimension'] == 'single':
-                single_elements.append(i['key'])
-        return single_elements
+        return list(self.dimensions.get('single', []))
 
-    def getJSON (self):
+    def getJSON (self, float_format=None):
         ''' returns a JSON containing 
             - error/warnings 
             - manifest and meta
             - data (only single and object)
+
+            float_format is a %-format for the floats (e.g. '%.4f')
          '''
-        temp_json = {}
+        return jsonwriter.dumps(self._jsonContent(), float_format=float_format)
+
+    def writeJSON (self, fo, float_format=None):
+        ''' writes the JSON returned by getJSON to the stream fo (a text or
+            binary file, socket...), encoding the data incrementally
+        '''
+        jsonwriter.dump(self._jsonContent(), fo, float_format=float_format)
 
+    def _jsonContent (self):
+        ''' returns the dictionary serialized by getJSON. The arrays are
+            not converted, these are encoded directly by the JSON writer
+        '''
         if self.error is not None:
-            temp_json['error'] = self.error
-            return json.dumps(temp_json)
+            return {'error': self.error}
 
+        content = {}
         if self.warning is not None:
-            temp_json['warning'] = self.warning
+            content['warning'] = self.warning
 
-        temp_json['manifest'] = self.manifest
-        temp_json['meta'] = self.meta
+        content['manifest'] = self.manifest
+        content['meta'] = self.meta
 
-        white_keys  = self.objectKeys()
-        white_keys += self.singleKeys()
+        for key in self.objectKeys() + self.singleKeys():
+            content[key] = self.data[key]
 
-        for key in white_keys:
-            value = self.data[key]
-
-            if key in ['model_build_info', 'model_valid_info']:
-                json_temp = []
-                for i in value:
-                    json_temp.append(self.modelInfoJSON(i))
-                temp_json[key] = json_temp
-
-            # np.arrays cannot be serialized to JSON and must be transformed
-            elif isinstance(value, np.ndarray):
-                temp_json[key]=value.tolist()
-            else:
-                temp_json[key]=value
-
-        #print (json.dumps(temp_json))
-
-        return json.dumps(temp_json)
+        return content
 
     def modelInfoJSON (self,i):
         ''' Results describing the model quality and characteristics are tuples 
@@ -232,25 +453,17 @@ class Conveyor:
             This function returns a version of this tuple suitable for being 
             serialized to JSON
         '''
+        value = i[2]
+
+        # numpy scalars
+        if isinstance(value, np.integer):
+            return (i[0], i[1], int(value))
 
-        # int64
-        if 'numpy.int64' in str(type(i[2])):
-            try:
-                v = int(i[2])
-            except:
-                v = None
-            return((i[0], i[1], v))
-
-        # int64
-        if 'numpy.float64' in str(type(i[2])):
-            try:
-                v = float(i[2])
-            except:
-                v = None
-            return((i[0], i[1], v))
+        if isinstance(value, np.floating):
+            return (i[0], i[1], float(value))
 
         # ndarrays
-        if isinstance(i[2], np.ndarray):
-            return((i[0], i[1], i[2].tolist()) )
+        if isinstance(value, np.ndarray):
+            return (i[0], i[1], value.tolist())
 
         return i
\ No newline at end of file
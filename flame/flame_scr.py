@@ -86,10 +86,15 @@ def main():
                         help='File with model building parameters.',
                         required=False)
 
+    parser.add_argument('--significance',
+                        help='Comma separated conformal significances '
+                             '(manage significance action).',
+                        required=False)
+
     parser.add_argument('-c', '--command',
                         action='store',
-                        choices=['predict', 'build', 'manage', 'config'],
-                        help='Action type: \'predict\' or \'build\' or \'manage\'',
+                        choices=['predict', 'build', 'manage', 'config', 'serve'],
+                        help='Action type: \'predict\' or \'build\' or \'manage\' or \'serve\'',
                         required=True)
 
     # parser.add_argument('-log', '--loglevel',
@@ -99,6 +104,15 @@ def main():
                         help='Defines the directory for the models repository.',
                         required=False)
 
+    parser.add_argument('-s', '--socket',
+                        help='Unix socket used by the prediction server.',
+                        required=False)
+
+    parser.add_argument('--port',
+                        help='Local TCP port used by the prediction server.',
+                        type=int,
+                        required=False)
+
     args = parser.parse_args()
 
     # init logger Level and set general config
@@ -160,6 +174,15 @@ def main():
         config(args.directory)
         change_config_status()
 
+    elif args.command == 'serve':
+
+        if (args.socket is None) and (args.port is None):
+            print('flame serve : socket or port argument is compulsory')
+            return
+
+        from flame.serve import serve
+        serve(socket_path=args.socket, port=args.port)
+
 # import multiprocessing
 
 if __name__ == '__main__':
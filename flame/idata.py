@@ -26,8 +26,8 @@ import pickle
 import shutil
 import json
 import tempfile
-import multiprocessing as mp
 import pathlib
+import functools
 
 import numpy as np
 from rdkit import Chem
@@ -37,8 +37,11 @@ from standardiser import standardise
 import flame.chem.sdfileutils as sdfutils
 import flame.chem.compute_md as computeMD
 import flame.chem.convert_3d as convert3D
+import flame.chem.fingerprints as fingerprints
+import flame.chem.descriptor_cache as descriptor_cache
 
-from flame.util import utils, get_logger, supress_log
+from flame.util import utils, pool, get_logger, supress_log
+from flame.conveyor import read_header
 
 LOG = get_logger(__name__)
 
@@ -116,6 +119,12 @@ class Idata:
         success_list = []
         obj_num = 0
 
+        # when predicting large files in chunks, the numbering of unnamed
+        # molecules continues from the previous chunks
+        obj_offset = self.conveyor.getMeta('obj_offset')
+        if obj_offset is None:
+            obj_offset = 0
+
         # Iterate for every molecule inside the SDFile
         for mol in suppl:
 
@@ -129,8 +138,8 @@ class Idata:
                 continue
 
             # extract the molecule name, using a sdfileutils algorithm 
-            name = sdfutils.getName(
-                mol, count=obj_num, field=self.param.getVal('SDFile_name'))
+            name = sdfutils.getName(mol, count=obj_offset+obj_num,
+                                    field=self.param.getVal('SDFile_name'))
 
             # extracts biological information (activity) which is used as dependent variable
             # for the model training and is provided as a prediction for new compounds
@@ -185,6 +194,9 @@ class Idata:
                              'decoration', 'objs',
                              'Experimental anotation present in the input file')
 
+        # number of molecules read, before removing any failed molecule
+        self.conveyor.addMeta('obj_read', obj_num)
+
         LOG.debug(f'processed {obj_num} molecules'
                   f' from a supplier of {len(suppl)} without issues')
         
@@ -209,7 +221,8 @@ class Idata:
 
         '''
         
-        success_list = [True for i in range(sdfutils.count_mols(ifile))]
+        # one item for every valid mol, appended while reading them
+        success_list = []
         
         if not method :
             method = ''
@@ -237,49 +250,18 @@ class Idata:
                               f' #{mcount+1} in {ifile}')
                     continue
 
-                name = sdfutils.getName(m, count=mcount,
-                                    field=self.param.getVal('SDFile_name'))
-
-                parent = None
-
-                if 'standardize' in method:
-                    try:
+                parent = self._standardize_mol(m, method, mcount)
 
-                        parent = standardise.run(Chem.MolToMolBlock(m))
-
-                    except standardise.StandardiseException as e:
-
-                        if e.name == "no_non_salt":
-                            # very commong warning, use parent mol and proceed
-                            LOG.debug(f'"No non salt error" found. Skiped standardize for mol'
-                                      f' #{mcount} {name}')
-                            parent = Chem.MolToMolBlock(m)
-                        else:
-                            # serious issue, no parent was generated, use original mol
-                            if (parent is None):
-                                LOG.error(f'Critical standardize exception: {e}'
-                                        f' when processing mol #{mcount} {name}. Skipping normalization')
-                                parent = Chem.MolToMolBlock(m)
-                            # minor isse, parent was generated, show a warning and proceed
-                            else:
-                                LOG.info(f'Standardize exception: {e}'
-                                        f' when processing mol #{mcount} {name}. Normalization applied')
-                        #return False, e.name
-
-                    except Exception as e:
-                        # this error means an execution error running standardizer
-                        # the molecule is discarded and therefore the list of molecules must be updated 
-                        LOG.error(f'Critical standardize execution exception {e}'
-                                    f' when processing mol #{mcount} {name}. Discarding molecule')
-                        success_list[mcount]=False
-                        continue
-
-                else:
-                    LOG.info(f'Skipping normalization.')
-                    parent = Chem.MolToMolBlock(m)
+                # execution error running standardizer, the molecule is
+                # discarded and therefore the list of molecules must be updated
+                if parent is None:
+                    success_list.append(False)
+                    mcount += 1
+                    continue
 
                 # in any case, write parent plus internal ID (flameID)
                 fo.write(parent)
+                success_list.append(True)
 
                 # *** discarded method to control errors ****
                 # flameID = 'fl%0.10d' % mcount
@@ -292,6 +274,76 @@ class Idata:
 
         return success_list, ofile
 
+    def _standardize_mol(self, m, method, mcount):
+        '''
+        Applies the normalization method to the mol m, returning the
+        mol block of the parent molecule or None if the standardizer
+        failed and the molecule must be discarded
+        '''
+        name = sdfutils.getName(m, count=mcount,
+                            field=self.param.getVal('SDFile_name'))
+
+        parent = None
+
+        if 'standardize' in method:
+            try:
+
+                parent = standardise.run(Chem.MolToMolBlock(m))
+
+            except standardise.StandardiseException as e:
+
+                if e.name == "no_non_salt":
+                    # very commong warning, use parent mol and proceed
+                    LOG.debug(f'"No non salt error" found. Skiped standardize for mol'
+                              f' #{mcount} {name}')
+                    parent = Chem.MolToMolBlock(m)
+                else:
+                    # serious issue, no parent was generated, use original mol
+                    if (parent is None):
+                        LOG.error(f'Critical standardize exception: {e}'
+                                f' when processing mol #{mcount} {name}. Skipping normalization')
+                        parent = Chem.MolToMolBlock(m)
+                    # minor isse, parent was generated, show a warning and proceed
+                    else:
+                        LOG.info(f'Standardize exception: {e}'
+                                f' when processing mol #{mcount} {name}. Normalization applied')
+                #return False, e.name
+
+            except Exception as e:
+                # this error means an execution error running standardizer
+                # the molecule is discarded and therefore the list of molecules must be updated 
+                LOG.error(f'Critical standardize execution exception {e}'
+                            f' when processing mol #{mcount} {name}. Discarding molecule')
+                return None
+
+        else:
+            LOG.info(f'Skipping normalization.')
+            parent = Chem.MolToMolBlock(m)
+
+        return parent
+
+    def normalize_mols(self, mols, method):
+        '''
+        In memory version of normalize. Applies the normalization method to
+        a list of mols, returning a list of the same length with None for
+        the molecules which failed or were discarded
+        '''
+        if not method:
+            method = ''
+
+        LOG.info('Starting normalization...')
+
+        parents = []
+        for mcount, m in enumerate(mols):
+            parent = None
+            if m is not None:
+                parent = self._standardize_mol(m, method, mcount)
+            if parent is not None:
+                parent = Chem.MolFromMolBlock(parent)
+            parents.append(parent)
+
+        return parents
+
     def ionize(self, ifile, method):
         '''
         Adjust the ionization status of the molecular structure,
@@ -319,40 +371,90 @@ class Idata:
         if not method:
             return success_list, ifile
         
-        if method is 'ETKDG':
+        if method == 'ETKDG':
             success_list, ofile = convert3D._ETKDG(ifile)
         else:
             ofile = ifile
 
         return success_list, ofile
 
+    def ionize_mols(self, mols, method):
+        '''
+        In memory version of ionize
+        '''
+        if method:
+            LOG.debug ('ionize called, but no method implemented so far')
+
+        return mols
+
+    def convert3D_mols(self, mols, method):
+        '''
+        In memory version of convert3D, returning a list of the same length
+        with None for the molecules which failed
+        '''
+        if method == 'ETKDG':
+            return convert3D._ETKDG_mols(mols, self.param.getVal('numCPUs'))
+
+        return mols
+
     def computeMD_custom(self, ifile):
         '''
         Empty method for computing molecular descriptors.
 
         ifile is a molecular file in SDFile format.
 
-        returns a boolean anda a tupla of two elements:
-        [0] xmatrix (nparray np.float64)
-        [1] list of variable names (str)
-        [2] list of booleans indicating if the computation succeeded for each molecule
+        returns a boolean and a results dictionary with keys:
+        'matrix'      : xmatrix (nparray np.float64) with a row for every
+                        molecule in ifile, including the failed ones
+        'names'       : list of variable names (str)
+        'success_arr' : array of booleans indicating if the computation
+                        succeeded for each molecule
+
+        example:    return True, {'matrix': xmatrix, 'names': md_nam,
+                                  'success_arr': success_arr}
 
-        example:    return True, (xmatrix, md_nam, success_list)
+        for backwards compatibility, a tupla (xmatrix, md_nam, success_list)
+        where xmatrix contains only the successful molecules is also accepted
         '''
         raise NotImplementedError
         #return False, 'not implemented'
 
-    def computeMD(self, ifile: str, methods: list) -> (bool, (np.ndarray, list, list)):
+    @staticmethod
+    def _full_form(results) -> dict:
+        '''
+        Converts MD results given as a tupla (xmatrix, md_nam, success_list),
+        where xmatrix only contains the successful molecules, to the full
+        form results dictionary used by the methods in compute_md
+        '''
+        if isinstance(results, dict):
+            return results
+
+        xmatrix, md_nam, success_list = results
+        success_arr = np.array(success_list, dtype=bool)
+        xmatrix = np.asarray(xmatrix, dtype=np.float64).reshape(
+            np.count_nonzero(success_arr), -1)
+
+        matrix = np.full((len(success_arr), xmatrix.shape[1]), np.nan)
+        matrix[success_arr] = xmatrix
+
+        return {'matrix': matrix, 'names': md_nam, 'success_arr': success_arr}
+
+    def computeMD(self, ifile, methods: list) -> (bool, (np.ndarray, list, list)):
         '''
         Uses the molecular structures for computing an array
         of values (int or float).
 
-        input is the name of a molecule or a series of molecules and a label
-        of the methods output is boolean anda a tupla of two elements:
-        [0] xmatrix (nparray np.float64)
+        input is the name of a molecule or a series of molecules (or a list
+        of RDKit mols, with None for failed molecules) and a label
+        of the methods output is boolean anda a tupla of three elements:
+        [0] xmatrix (nparray), only for the successful molecules
         [1] list of variable names (str)
+        [2] list of booleans indicating if the computation succeeded
+            for each molecule
 
-        FIXIT
+        Every method returns a full form matrix (one row per molecule) and
+        a success array. The matrices are concatenated and filtered only
+        once, after all the methods were computed
         '''
         LOG.info(f'Computing molecular descriptors with methods {methods}...')
         
@@ -372,55 +474,114 @@ class Idata:
             no_recog_meth = [m for m in methods if m not in registered_methods]
             return False, f'Methods {no_recog_meth} not recognized'
 
-            if len(no_recog_meth) == len(methods):
-                # then no md method is correct... so error
-                return False, f'Methods {no_recog_meth} not recognized. No valid method found.'
-
-            # remove bad methods
-            methods = [m for m in methods if m not in no_recog_meth]
+        cache = self._descriptor_cache()
 
-        is_empty = True
+        matrices = []
+        combined_nm = []
+        success_arrays = []
 
         for method in methods:
-            # success, results = registered_methods[method](ifile)
-            success, results = registered_methods[method](ifile, **md_settings)
+            if method == 'custom':
+                # child classes override computeMD_custom(self, ifile)
+                md_function = self.computeMD_custom
+            else:
+                md_function = functools.partial(registered_methods[method],
+                                                **md_settings)
+
+            # these methods can only be applied to SDFiles
+            if method in ('padel', 'custom') and not isinstance(ifile, str):
+                md_function = functools.partial(self._computeMD_mols,
+                                                md_function)
+
+            if cache is not None and method != 'custom':
+                settings = descriptor_cache.settings_key(
+                    method, md_settings,
+                    normalize_method=self.param.getVal('normalize_method'),
+                    ionize_method=self.param.getVal('ionize_method'),
+                    convert3D_method=self.param.getVal('convert3D_method'))
+
+                success, results = cache.compute(md_function, ifile, settings)
+            else:
+                success, results = md_function(ifile)
 
             if not success:  # if computing returns False in status
                 return success, results
 
-            if is_empty:  # first md computed, just copy
+            results = self._full_form(results)
 
-                combined_md = results['matrix']  # np.array of values
-                combined_nm = results['names']  # list of variable names
-                combined_sc = results['success_arr'] # list of true/false
+            # all methods must report the same number of objects
+            if len(matrices) > 0 and \
+                results['matrix'].shape[0] != matrices[0].shape[0]:
 
-                shape = np.shape(combined_md)
+                LOG.error(f'Number of objects processed by {method} '
+                          'does not match those computed by other methods')
+                return False, f'Number of objects processed by {method} '\
+                    'does not match those computed by other methods'
 
-                is_empty = False
+            matrices.append(results['matrix'])
+            combined_nm.extend(results['names'])
+            success_arrays.append(np.asarray(results['success_arr'], dtype=bool))
 
-            else:  # append laterally
-                ishape = np.shape(results['matrix'])
+        if len(matrices) == 1:
+            combined_md = matrices[0]
+        else:
+            combined_md = self._concat_descriptors_matrix(matrices)
 
-                # for 2D arrays, shape[0] is the number of objects
-                if (len(ishape) > 1) and ishape[0] != shape[0]:
+        # All results must be True to keep the molecule
+        combined_md, combined_sc = self._filter_matrix(combined_md,
+                                                       success_arrays)
 
-                    LOG.error(f'Number of objects processed by {method}'
-                              'does not match those computed by other methods')
-                    continue
+        return True, (combined_md, combined_nm, combined_sc)
 
-                combined_md = np.hstack((combined_md, results['matrix']))
-                combined_nm.extend(results['names'])
+    def _computeMD_mols(self, md_function, mols) -> (bool, dict):
+        '''
+        Applies a MD method requiring an SDFile to a list of mols, writting
+        the valid mols to a temporary SDFile
 
-                # combine sucess results into oine list with AND
-                # All results must be True to get True
-                # scc stands for success
-                new_sc = [scc and results['success_arr'][i]
-                          for i, scc in enumerate(combined_sc)]
-                combined_sc = new_sc
+        Returns the results in full form, with a row for every mol
+        '''
+        valid = np.array([m is not None for m in mols], dtype=bool)
+        if not valid.any():
+            return False, 'Unable to compute descriptors for any molecule'
 
-        return True, (combined_md, combined_nm, combined_sc)
+        temp_path = tempfile.mkdtemp()
+        ifile = os.path.join(temp_path, 'mols.sdf')
+        sdfutils.write_mols([m for m in mols if m is not None], ifile)
+
+        success, results = md_function(ifile)
+        shutil.rmtree(temp_path)
+
+        if not success:
+            return success, results
+
+        results = self._full_form(results)
+
+        matrix = np.full((len(mols), results['matrix'].shape[1]), np.nan)
+        matrix[valid] = results['matrix']
+        success_arr = np.zeros(len(mols), dtype=bool)
+        success_arr[valid] = results['success_arr']
+
+        return True, {'matrix': matrix, 'names': results['names'],
+                      'success_arr': success_arr}
+
+    def _descriptor_cache(self):
+        '''
+        Returns the persistent descriptor cache, stored in the root of the
+        model repository, or None if the cache is not enabled (MD_cache)
+        '''
+        if not self.param.getVal('MD_cache'):
+            return None
+
+        try:
+            path = os.path.join(utils.model_repository_path(),
+                                descriptor_cache.CACHE_FILE)
+        except Exception as e:
+            LOG.warning(f'Descriptor cache not available: {e}')
+            return None
+
+        return descriptor_cache.DescriptorCache(
+            path, self.param.getVal('MD_cache_size'))
 
-   
     @staticmethod
     def _filter_matrix(matrix: np.ndarray, succes_list: list):
         """Filters matrix via boolean mask.
@@ -471,6 +632,8 @@ class Idata:
         """ Concatenates horizontaly an arbritary number of matrices.
 
         Used to concat multiple descriptors results into a one array.
+        Packed fingerprints are unpacked, since they cannot be mixed
+        with other descriptors.
 
         Parameters
         ----------
@@ -484,6 +647,8 @@ class Idata:
         np.ndarray
             concatenated matrix of input matrices
         """
+        matrices = [fingerprints.to_dense(m) for m in matrices]
+
         # type check input
         if not all(isinstance(m, np.ndarray) for m in matrices):
             raise TypeError('input matrices must be numpy arrays')
@@ -525,8 +690,10 @@ class Idata:
             internal = iresults[1]
             ixmatrix = internal[0]
 
-            # check that the type of ixmatrix is correct (np.ndarray)
-            if not isinstance(ixmatrix, np.ndarray):
+            # check that the type of ixmatrix is correct (np.ndarray or
+            # packed fingerprints)
+            if not isinstance(ixmatrix, (np.ndarray,
+                                         fingerprints.PackedFingerprints)):
                 LOG.error('Results type in consolidate must be `np.ndarray`.'
                           f' Found: {type(ixmatrix)}')
                 return False, "unknown results type in consolidate"
@@ -558,7 +725,7 @@ class Idata:
 
                         return False, "inconsistent number of variables"
 
-                xmatrix = np.vstack((xmatrix, ixmatrix))
+                xmatrix = fingerprints.vstack((xmatrix, ixmatrix))
                 success_list += internal[2]
 
         return True, (xmatrix, var_nam, success_list)
@@ -581,12 +748,11 @@ class Idata:
         md5_input = utils.md5sum(self.ifile)  # run md5 in self.ifile
 
         try:
-            with open(os.path.join(self.dest_path, 'data.pkl'), 'wb') as fo:
-
-                pickle.dump(md5_parameters, fo)
-                pickle.dump(md5_input, fo)
-
-                self.conveyor.save (fo)
+            # the signatures are stored in the header of the conveyor, so
+            # they are checked without reading the data
+            self.conveyor.saveFile(os.path.join(self.dest_path, 'data.pkl'),
+                                   {'md5_parameters': md5_parameters,
+                                    'md5_input': md5_input})
 
         except Exception as e:
             LOG.error(f"Can't serialize descriptors because of exception: {e}")
@@ -606,11 +772,18 @@ class Idata:
                 return False
 
             with open(picklfile, 'rb') as fi:
-                md5_parameters = pickle.load(fi)
+                header = read_header(fi)
+                if header is not None:
+                    md5_parameters = header['extra']['md5_parameters']
+                    md5_input = header['extra']['md5_input']
+                # files saved in the old format start with the signatures
+                else:
+                    md5_parameters = pickle.load(fi)
+                    md5_input = pickle.load(fi)
+
                 if md5_parameters != self.param.getVal('md5'):
                     return False
 
-                md5_input = pickle.load(fi)
                 if md5_input != utils.md5sum(self.ifile):
                     return False
 
@@ -634,36 +807,22 @@ class Idata:
         Executes in sequence methods required to generate MD,
         starting from a single molecular file.
 
-        input : ifile, a molecular file in SDFile format
+        input : ifile, a molecular file in SDFile format or a tupla
+                (ifile, start, end) describing a byte range of this file
         output: results is a numpy bidimensional array containing MD
         '''
 
-        success_list = []
         md_results = []
         va_results = []
 
-        # split in single molecule pieces
-        num_mol = sdfutils.count_mols(input_file)
-        success, results = sdfutils.split_SDFile(input_file, num_mol)
-
-        if not success:
-            return success, results
-
-        file_list = results[0]
-        file_size = results[1]
+        # process every molecule as a separate byte range
+        file_list = sdfutils.record_ranges(input_file)
+        success_list = [True for i in file_list]
 
-        # check if any of the molecules is empty
-        for fsize in file_size:
-            success_list.append(fsize == 1)
-
-        first_mol = True
+        md_list = []
 
         for i, ifile in enumerate(file_list):
 
-            if not success_list[i]:   # molecule was empty, do not process
-                LOG.error(f'Molecule {i+1} in {ifile} is empty, skiping...')
-                continue
-
             success, results = self.workflow_series(ifile)
 
             # since the workflow was run for a single molecule, results[2] is ignored, because it must match
@@ -675,23 +834,24 @@ class Idata:
                           f' in file {input_file}')
                 continue
 
-            if first_mol:  # first molecule
-                md_results = results[0]
+            if len(md_list) == 0:  # first molecule
                 va_results = results[1]
-                num_var = len(md_results)
-                first_mol = False
+                num_var = np.shape(results[0])[-1]
             else:
-                if len(results[0]) != num_var:
+                if np.shape(results[0])[-1] != num_var:
                     LOG.warning(f'MD length for molecule #{str(i+1)} in file'
                                 f' {input_file} does not match the MD length'
                                 'of the first molecule')
                     success_list[i] = False
                     continue
 
-                md_results = np.vstack((md_results, results[0]))
+            md_list.append(results[0])
 
         #print (success_list)
 
+        if len(md_list) > 0:
+            md_results = fingerprints.vstack(md_list)
+
         return True, (md_results, va_results, success_list)
 
     def updateMolIndex (self, mol_index, success_list):
@@ -729,13 +889,24 @@ class Idata:
 
         '''
 
-        mol_index = [True for i in range(sdfutils.count_mols(input_file))]
+        if self.param.getVal('mol_pipeline') == 'memory':
+            return self.workflow_series_mols(input_file)
+
+        # byte ranges are copied to a file, required by the files pipeline
+        if isinstance(input_file, tuple):
+            ifile, start, end = input_file
+            filename, fileext = os.path.splitext(ifile)
+            input_file = sdfutils.write_range(input_file,
+                                              f'{filename}_{start}{fileext}')
 
         ###
         # 1. normalize
         ###
         success_list, output_normalize_file = self.normalize(
             input_file, self.param.getVal('normalize_method'))
+
+        # normalize reads every valid mol of the input file
+        mol_index = [True for i in range(len(success_list or []))]
         success, mol_index = self.updateMolIndex(mol_index, success_list)
 
         if not success:
@@ -778,6 +949,63 @@ class Idata:
         
         return success, (x, xnames, mol_index)
 
+    def workflow_series_mols(self, input_file):
+        '''
+        In memory version of workflow_series. The input file is parsed only
+        once and the normalize, ionize and convert3D steps exchange lists
+        of RDKit mols, using None for the molecules which failed. The result
+        of every step is reflected in the success list returned by computeMD
+
+        When the parameter mol_pipeline_debug is True, the intermediate
+        structures are written to the same SDFiles used by workflow_series
+
+        output: same as workflow_series
+        '''
+
+        # only the valid molecules are processed, as in workflow_series
+        mols = sdfutils.read_mols(input_file)
+        if len(mols) == 0:
+            return False, f'no molecules found in {input_file}'
+
+        debug = self.param.getVal('mol_pipeline_debug')
+        if isinstance(input_file, tuple):
+            filename, fileext = os.path.splitext(input_file[0])
+            filename += f'_{input_file[1]}'
+        else:
+            filename, fileext = os.path.splitext(input_file)
+
+        ###
+        # 1. normalize
+        ###
+        mols = self.normalize_mols(mols, self.param.getVal('normalize_method'))
+        if debug:
+            filename += '_std'
+            sdfutils.write_mols(mols, filename + fileext)
+
+        ###
+        # 2. ionize
+        ###
+        mols = self.ionize_mols(mols, self.param.getVal('ionize_method'))
+
+        ###
+        # 3. convert3D
+        ###
+        mols = self.convert3D_mols(mols, self.param.getVal('convert3D_method'))
+        if debug and self.param.getVal('convert3D_method'):
+            filename += '_3d'
+            sdfutils.write_mols(mols, filename + fileext)
+
+        ###
+        # 4. compute MD
+        ###
+        success, results = self.computeMD(
+            mols, self.param.getVal('computeMD_method'))
+
+        if not success:
+            return False, results
+
+        return True, results
+
     def ammend_objects(self, inform, workflow) -> None:
         '''
         The arguments inform and workflow are lists of booleans describing
@@ -810,20 +1038,9 @@ class Idata:
         self.conveyor.setVal('obj_num', obj_num)
 
 
-        objkeys = self.conveyor.objectKeys()
-        for ikey in objkeys: 
-            ilist = self.conveyor.getVal(ikey)
-
-            # keys are experim or ymatrix are numpy arrays
-            # if 'numpy.ndarray' in str(type(ilist)):
-            if isinstance(ilist, np.ndarray):
-                ilist = np.delete(ilist, remove_index)
-            # other keys are regular list
-            else:
-                for i in sorted(remove_index, reverse=True):
-                    del ilist[i]
-
-            self.conveyor.setVal(ikey, ilist)
+        keep = np.ones(len(workflow), dtype=bool)
+        keep[remove_index] = False
+        self.conveyor.filterObjects(keep)
 
         message = 'Failed to process ' + \
             str(len(warning_list))+' molecules : '+str(warning_list)
@@ -857,23 +1074,21 @@ class Idata:
         # Execute the workflow in 1 or n CPUs
         if ncpu > 1:
             LOG.debug('Entering molecule workflow for {} cpus'.format(ncpu))
-            success, results = sdfutils.split_SDFile(lfile, ncpu)
+            success, results = sdfutils.split_SDFile_ranges(lfile, ncpu)
 
             if not success:
                 self.conveyor.setError('Unable to split input molecule')
                 return
 
-            split_files_names = results[0]
-            split_files_sizes = results[1]
-
-            pool = mp.Pool(ncpu)
+            split_ranges = results[0]
+            split_sizes = results[1]
 
             if self.param.getVal('mol_batch') == 'series':
-                results = pool.map(self.workflow_series, split_files_names)
+                results = pool.map(self.workflow_series, split_ranges, ncpu)
             else:
-                results = pool.map(self.workflow_objects, split_files_names)
+                results = pool.map(self.workflow_objects, split_ranges, ncpu)
 
-            success, results = self.consolidate(results, split_files_sizes)
+            success, results = self.consolidate(results, split_sizes)
 
         else:
 
@@ -151,6 +151,18 @@ class Learn:
                 'objs',
                 'Y values of the training series predicted by the model')
 
+        # conformal models keep the out-of-fold nonconformity, for assessing
+        # the model at other significances (see manage.action_significance)
+        if 'conformal_oof' in model_validation_results:
+            self.conveyor.addVal(
+                model_validation_results['conformal_oof'],
+                'conformal_oof',
+                'Conformal out-of-fold record',
+                'method',
+                'vars',
+                'Out-of-fold predictions and nonconformity scores of the '
+                'conformal validation')
+
         # conformal qualitative models produce a list of tuples, indicating
         # if the object is predicted to belong to class 0 and 1
         if 'classes' in model_validation_results:
@@ -159,7 +159,8 @@ def action_publish(model):
     src_path = os.path.join (base_path,'dev')
 
     try:
-        shutil.copytree(src_path, new_path)
+        # keeps the links of the estimator directories (see persistence)
+        shutil.copytree(src_path, new_path, symlinks=True)
     except:
         return False, f'Unable to copy contents of dev version for model {model}'
 
@@ -347,7 +348,7 @@ def action_info(model, version, output='text'):
 
         conveyor = Conveyor()
         with open(os.path.join(rdir, 'results.pkl'), 'rb') as handle:
-            conveyor.load(handle)
+            conveyor.load(handle, ['model_build_info', 'model_valid_info'])
         
         info =  conveyor.getVal('model_build_info')
         info += conveyor.getVal('model_valid_info')
@@ -381,6 +382,46 @@ def action_info(model, version, output='text'):
     return True, json.dumps(json_results)
 
 
+def action_significance(model, version=None, significances=None,
+                        output='text'):
+    '''
+    Returns the cross-validation quality of a conformal model at the given
+    significances, obtained from the out-of-fold record stored in
+    results.pkl without refitting the model
+    '''
+
+    if model is None:
+        return False, 'Empty model label'
+
+    if not significances:
+        significances = [0.05, 0.1, 0.2, 0.3]
+
+    rdir = utils.model_path(model, version)
+    if not os.path.isfile(os.path.join(rdir, 'results.pkl')):
+        return False, 'results not found'
+
+    from flame.conveyor import Conveyor
+    from flame.stats import conformal
+
+    conveyor = Conveyor()
+    with open(os.path.join(rdir, 'results.pkl'), 'rb') as handle:
+        conveyor.load(handle, ['conformal_oof'])
+
+    if not conveyor.isKey('conformal_oof'):
+        return False, 'no conformal validation found, rebuild the model'
+
+    info = conformal.oof_quality(conveyor.getVal('conformal_oof'),
+                                 significances)
+
+    if output == 'text':
+        LOG.info(f'conformal quality of model {model} version {version}')
+        for val in info:
+            LOG.info(f'{val[0]} ({val[1]}) : {val[2]}')
+        return True, 'model informed OK'
+
+    return True, json.dumps([conveyor.modelInfoJSON(i) for i in info])
+
+
 def action_results(model, version=None, ouput_variables=False):
     ''' Returns a JSON with whole results info for a given model and version '''
 
@@ -23,11 +23,104 @@
 import os
 import pickle
 import json
+import shutil
 import numpy as np
-from flame.util import utils, get_logger, supress_log
+from flame.chem import fingerprints
+from flame.util import utils, columnar, get_logger, supress_log
 
 LOG = get_logger(__name__)
 
+# rows of output.tsv formatted at once
+BLOCK_ROWS = 4096
+
+# cells of output_md.tsv formatted at once
+BLOCK_CELLS = 1 << 20
+
+
+def _cell(val) -> str:
+    ''' representation of a result in output.tsv '''
+    if val is None:
+        return '-'
+    if isinstance(val, float):
+        return "%.4f" % val
+    return str(val)
+
+
+def _format_column(column, start, stop) -> list:
+    '''
+    Returns the representation of the results start to stop of a column,
+    completed with '-' when the column is missing or shorter
+    '''
+    if column is None:
+        return ['-'] * (stop - start)
+
+    values = column[start:stop]
+
+    # typed columns are converted at once, floats are always np.float64
+    if isinstance(values, np.ndarray) and values.ndim == 1 and \
+       values.dtype == np.float64:
+        cells = list(map("%.4f".__mod__, values.tolist()))
+    elif isinstance(values, np.ndarray) and values.ndim == 1 and \
+         values.dtype.kind in 'biuU':
+        cells = list(map(str, values.tolist()))
+    else:
+        cells = list(map(_cell, values))
+
+    cells.extend(['-'] * (stop - start - len(cells)))
+    return cells
+
+
+def _write_results(fo, columns, obj_num) -> None:
+    ''' writes the lines of output.tsv, formatting the columns by blocks
+        of BLOCK_ROWS objects '''
+    for start in range(0, obj_num, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, obj_num)
+        cells = [_format_column(column, start, stop) for column in columns]
+
+        # lines end with a tab, like the header
+        fo.write(''.join(['\t'.join(row) + '\t\n' for row in zip(*cells)]))
+
+
+def _write_matrix(fo, obj_nam, xmatrix) -> None:
+    ''' writes the lines of output_md.tsv, formatting the descriptors by
+        blocks of about BLOCK_CELLS values '''
+    xmatrix = np.atleast_2d(xmatrix)
+    nobj, nvarx = xmatrix.shape
+
+    # matrices of digits (e.g. fingerprints) are written as the bytes of
+    # the characters, interleaved with tabs
+    digits = xmatrix.dtype.kind in 'iu' and xmatrix.size > 0 and \
+        xmatrix.min() >= 0 and xmatrix.max() <= 9
+
+    # otherwise str of the numpy scalars is the same of the python values,
+    # except for floats other than np.float64
+    native = xmatrix.dtype == np.float64 or xmatrix.dtype.kind in 'biuUO'
+
+    line = '%s' + '\t%s' * nvarx + '\n'
+
+    step = max(1, BLOCK_CELLS // max(nvarx, 1))
+    for start in range(0, nobj, step):
+        block = xmatrix[start:start+step]
+
+        if digits:
+            chars = np.empty((len(block), 2 * nvarx), dtype=np.uint8)
+            chars[:, 0::2] = ord('\t')
+            chars[:, 1::2] = block + ord('0')
+            text = chars.tobytes().decode('ascii')
+
+            width = 2 * nvarx
+            fo.write(''.join([obj_nam[start+i] + text[i*width:(i+1)*width] +
+                              '\n' for i in range(len(block))]))
+            continue
+
+        if native:
+            rows = block.tolist()
+        else:
+            rows = [list(map(str, row)) for row in block]
+
+        fo.write(''.join([line % (obj_nam[start+i], *row)
+                          for i, row in enumerate(rows)]))
+
 
 class Odata():
     """
@@ -43,43 +136,93 @@ class Odata():
         self.conveyor = conveyor
         self.format = self.param.getVal('output_format')
 
+    def _append(self) -> bool:
+        ''' True when processing the second or following chunks of a
+            prediction run in chunks, which are appended to the output
+            files written for the first chunk '''
+        chunk = self.conveyor.getMeta('chunk')
+        return chunk is not None and chunk > 0
+
+    def _result_keys(self) -> list:
+        ''' keys of the results written in the output files: name, SMILES,
+            main result and every other object result '''
+
+        # label and smiles
+        key_list = ['obj_nam']
+        if self.conveyor.isKey('SMILES'):
+            key_list.append('SMILES')
+
+        # main result
+        key_list += self.conveyor.getMain()
+
+        # add all object type results
+        for item in self.conveyor.objectKeys():
+            if item not in key_list:
+                key_list.append(item)
+
+        # chunks appended to the files use the columns of the first one
+        if self._append() and self.conveyor.getMeta('output_keys'):
+            key_list = self.conveyor.getMeta('output_keys')
+        self.conveyor.addMeta('output_keys', key_list)
+
+        return key_list
+
+    def _output_columns(self):
+        ''' writes the results and, if output_md is set, the descriptors as
+            a part of the columnar output (see flame.util.columnar) '''
+
+        path = 'output_columns'
+        if not self._append():
+            shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+        key_list = self._result_keys()
+        obj_num = int(self.conveyor.getVal('obj_num'))
+
+        columns = {}
+        for key in key_list:
+            columns[key] = columnar.to_array(self.conveyor.getVal(key), obj_num)
+
+        schema = {'columns': [self.conveyor.getManifest(key) for key in key_list],
+                  'endpoint': self.param.getVal('endpoint'),
+                  'version': self.param.getVal('version'),
+                  'obj_offset': self.conveyor.getMeta('obj_offset') or 0}
+
+        if self.param.getVal('output_md') and self.conveyor.isKey('xmatrix'):
+            xmatrix = fingerprints.to_dense(
+                self.conveyor.getVal('xmatrix'), np.uint8)
+            columns['xmatrix'] = np.atleast_2d(xmatrix)
+
+            if self.conveyor.isKey('var_nam'):
+                var_nam = self.conveyor.getVal('var_nam')
+                schema['var_nam'] = [str(nam) for nam in var_nam]
+
+        # one part for every chunk of predictions run in chunks
+        chunk = self.conveyor.getMeta('chunk') or 0
+        ofile = os.path.join(path, f'part-{chunk:05d}{columnar.extension()}')
+        columnar.write(ofile, columns, schema)
+
+        LOG.info(f'Results dumped into columnar file {ofile}')
+
     def _output_md(self):
         ''' dumps the molecular descriptors to a TSV file'''
 
-        with open('output_md.tsv', 'w') as fo:
+        with open('output_md.tsv', 'a' if self._append() else 'w') as fo:
 
             # Make sure the keys 'var_nam', 'obj_nam', 'xmatrix' actualy exist
             # start writting MD
-            if self.conveyor.isKey('var_nam'):
+            if self.conveyor.isKey('var_nam') and not self._append():
                 # header: obj:name + var name
-
-                header = 'name'
                 var_nam = self.conveyor.getVal('var_nam')
-
-                for nam in var_nam:
-                    header += '\t'+nam
-                fo.write(header+'\n')
+                fo.write('\t'.join(['name'] + list(var_nam)) + '\n')
 
             if self.conveyor.isKey('xmatrix') and self.conveyor.isKey('obj_nam'):
                 # extract obj_name and xmatrix
-                xmatrix = self.conveyor.getVal('xmatrix')
+                xmatrix = fingerprints.to_dense(
+                    self.conveyor.getVal('xmatrix'), np.uint8)
                 obj_nam = self.conveyor.getVal('obj_nam')
 
-                # iterate for objects
-                shape = np.shape(xmatrix)
-
-                if len(shape) > 1:  # 2D matrix (num_obj > 1)
-                    for x in range(shape[0]):
-                        line = obj_nam[x]
-                        for y in range(shape[1]):
-                            line += '\t'+str(xmatrix[x, y])
-                        fo.write(line+'\n')
-
-                else:             # 1D matrix (num_obj = 1)
-                    line = obj_nam[0]
-                    for y in range(shape[0]):
-                        line += '\t'+str(xmatrix[y])
-                    fo.write(line+'\n')
+                _write_matrix(fo, obj_nam, xmatrix)
 
         LOG.info('Molecular descriptors dumped into output_md.tsv')
 
@@ -108,6 +251,7 @@ class Odata():
         # 2. console output
         # 3. molecular descriptors file in TSV format [optional]
         # 4. results file in TSV format [optional]
+        # 5. results file in columnar binary format [optional]
         # 
         # (note) no JSON file is produced because this was already
         # implemented in manage.py. Call action_info (model, version, output='JSON')
@@ -123,9 +267,7 @@ class Odata():
 
         results_pkl_path = os.path.join(self.param.getVal('model_path'), 'results.pkl')
         LOG.debug('saving model results to:{}'.format(results_pkl_path))
-        with open(results_pkl_path, 'wb') as handle:
-            self.conveyor.save(handle)
-            #pickle.dump(self.conveyor, handle)
+        self.conveyor.saveFile(results_pkl_path)
 
         ####
         # 2. console output
@@ -151,47 +293,23 @@ class Odata():
         if 'TSV' in self.format:
             LOG.info('writting results to TSV file "output.tsv"')
 
-            # label and smiles
-            key_list = ['obj_nam']
-            if self.conveyor.isKey('SMILES'):
-                key_list.append('SMILES')
-
-            # main result
-            key_list += self.conveyor.getMain()
-
-            # add all object type results
-            for item in self.conveyor.objectKeys():
-                if item not in key_list:
-                    key_list.append(item)
+            key_list = self._result_keys()
 
             with open('output.tsv', 'w') as fo:
-                header = ''
-                for label in key_list:
-                    header += label+'\t'
-                fo.write(header+'\n')
+                fo.write('\t'.join(key_list) + '\t\n')
 
                 obj_num = int(self.conveyor.getVal('obj_num'))
 
-                for i in range(obj_num):
-                    line = ''
-                    for key in key_list:
-
-                        val_array = self.conveyor.getVal(key)
+                # columns retrieved only once
+                columns = [self.conveyor.getVal(key) for key in key_list]
 
-                        if i >= len(val_array):
-                            val = None
-                        else:
-                            val = val_array[i]
+                _write_results(fo, columns, obj_num)
 
-                        if val is None:
-                            line += '-'
-                        else:
-                            if isinstance(val, float):
-                                line += "%.4f" % val
-                            else:
-                                line += str(val)
-                        line += '\t'
-                    fo.write(line+'\n')
+        ###
+        # 5. results file in columnar binary format [optional]
+        ###
+        if 'COLUMNAR' in self.format:
+            self._output_columns()
 
         return True, 'building OK'
 
@@ -201,7 +319,8 @@ class Odata():
             1. console output
             2. molecular descriptors file in TSV format [optional]
             3. results file in TSV format [optional]
-            4. this function return results in JSON format [optional]
+            4. results file in columnar binary format [optional]
+            5. this function return results in JSON format [optional]
         '''
 
         if len(self.conveyor.getMain()) == 0:
@@ -213,7 +332,8 @@ class Odata():
         # 1. console output
         # 2. molecular descriptors file in TSV format [optional]
         # 3. results file in TSV format [optional]
-        # 4. this function return results in JSON format [optional]
+        # 4. results file in columnar binary format [optional]
+        # 5. this function return results in JSON format [optional]
 
         ####
         # 1. console output
@@ -241,57 +361,31 @@ class Odata():
         ### 
         if 'TSV' in self.format:
             LOG.info('writting results to TSV file "output.tsv"')
-            # label and smiles
-            key_list = ['obj_nam']
-            if self.conveyor.isKey('SMILES'):
-                key_list.append('SMILES')
 
-            # main result
-            key_list += self.conveyor.getMain()
+            key_list = self._result_keys()
 
-            # add all object type results
-            # manifest = self.results['manifest']
-            # for item in manifest:
-            #     if item['dimension'] == 'objs' and item['key'] not in key_list:
-            #         key_list.append(item['key'])
-            key_obj = self.conveyor.objectKeys()
+            with open('output.tsv', 'a' if self._append() else 'w') as fo:
+                if not self._append():
+                    fo.write('\t'.join(key_list) + '\t\n')
 
-            for i in key_obj:
-                if i not in key_list:
-                    key_list.append(i)
+                obj_num = int(self.conveyor.getVal('obj_num'))
 
-            with open('output.tsv', 'w') as fo:
-                header = ''
-                for label in key_list:
-                    header += label+'\t'
-                fo.write(header+'\n')
+                # columns retrieved only once (None for missing keys)
+                columns = [self.conveyor.getVal(key) for key in key_list]
 
-                obj_num = int(self.conveyor.getVal('obj_num'))
+                _write_results(fo, columns, obj_num)
 
-                for i in range(obj_num):
-                    line = ''
-                    for key in key_list:
-
-                        if i >= len(self.conveyor.getVal(key)):
-                            val = None
-                        else:
-                            val = self.conveyor.getVal(key)[i]
-
-                        if val is None:
-                            line += '-'
-                        else:
-                            if isinstance(val, float):
-                                line += "%.4f" % val
-                            else:
-                                line += str(val)
-                        line += '\t'
-                    fo.write(line+'\n')
+        ###
+        # 4. results file in columnar binary format [optional]
+        ###
+        if 'COLUMNAR' in self.format:
+            self._output_columns()
 
         # the function returns "True, output". output can be empty or a JSON
         output = ''
 
         ###
-        # 4. this function return results in JSON format [optional]
+        # 5. this function return results in JSON format [optional]
         ###
         # returns a JSON with the prediction results
         if 'JSON' in self.format:
@@ -22,6 +22,11 @@
 
 import os
 import sys
+import copy
+import json
+import shutil
+import hashlib
+import tempfile
 import importlib
 
 from flame.util import utils, get_logger
@@ -30,19 +35,31 @@ from flame.conveyor import Conveyor
 from flame.idata import Idata
 from flame.apply import Apply
 from flame.odata import Odata
+from flame.chem import sdfileutils
 
 LOG = get_logger(__name__)
 
+# parameters used by Idata to generate the model input
+IDATA_KEYS = ['input_type', 'SDFile_name', 'SDFile_activity',
+              'SDFile_experimental', 'TSV_activity', 'TSV_objnames',
+              'TSV_varnames', 'normalize_method', 'ionize_method',
+              'convert3D_method', 'computeMD_method', 'MD_settings']
+
 class Predict:
 
-    def __init__(self, model, version, output_format=None):
+    def __init__(self, model, version, output_format=None, parameters=None):
+        ''' parameters is an optional Parameters object, already loaded
+            for this model and version (e.g. by a resident server), which
+            is used instead of reading the model parameters file '''
         LOG.debug('Starting predict...')
         self.model = model
         self.version = version
         self.param = Parameters()
         self.conveyor = Conveyor()
 
-        if not self.param.loadYaml(model, version):
+        if parameters is not None:
+            self.param = parameters
+        elif not self.param.loadYaml(model, version):
             LOG.critical('Unable to load model parameters. Aborting...')
             sys.exit()
 
@@ -68,58 +85,187 @@ class Predict:
     def run(self, input_source):
         ''' Executes a default predicton workflow '''
 
-        # path to endpoint
+        chunk_size = self.param.getVal('predict_chunk_size')
+        if chunk_size and self._chunkable(input_source):
+            return self.run_chunks(input_source, int(chunk_size))
+
+        return self.run_conveyor(input_source)
+
+    def _chunkable(self, input_source) -> bool:
+        ''' True if the input can be predicted in chunks: an SDFile used
+            as molecular input, with results not returned as JSON '''
+        if self.param.getVal('input_type') != 'molecule':
+            return False
+
+        if self.param.getVal('ext_input'):
+            return False
+
+        if 'JSON' in self.param.getVal('output_format'):
+            LOG.info('Predictions returned as JSON cannot be run in chunks')
+            return False
+
+        return isinstance(input_source, str) and os.path.isfile(input_source)
+
+    def run_chunks(self, input_source, chunk_size):
+        '''
+        Predicts an SDFile in chunks of chunk_size molecules, running the
+        whole workflow for every chunk with a new conveyor and appending
+        the results to the output files. This way, the memory used does not
+        depend on the size of the input file.
+
+        Note that the external validation (if any) is computed for every
+        chunk separately
+        '''
+        index = sdfileutils.SDFIndex.get(input_source)
+        nrec = len(index)
+        if nrec <= chunk_size:
+            return self.run_conveyor(input_source)
+
+        nchunks = (nrec + chunk_size - 1) // chunk_size
+        LOG.info(f'Predicting {nrec} molecules in {nchunks} chunks'
+                 f' of {chunk_size}')
+
+        base, ext = os.path.splitext(os.path.basename(input_source))
+        temp_path = tempfile.mkdtemp()
+
+        obj_offset = 0
+        output_keys = None
+        success, results = False, 'undefined errors'
+
+        try:
+            for ichunk in range(nchunks):
+                start = ichunk * chunk_size
+                stop = min(start + chunk_size, nrec)
+
+                # every chunk in its own folder, so the input data pickle
+                # saved by Idata is never reused for a different chunk
+                chunk_path = os.path.join(temp_path, str(ichunk))
+                os.mkdir(chunk_path)
+                chunk_file = os.path.join(chunk_path, f'{base}{ext}')
+                sdfileutils.write_range(
+                    (index.ifile,) + index.byte_range(start, stop), chunk_file)
+
+                self.conveyor = Conveyor()
+                self.conveyor.addMeta('chunk', ichunk)
+                self.conveyor.addMeta('obj_offset', obj_offset)
+                self.conveyor.addMeta('output_keys', output_keys)
+
+                success, results = self.run_conveyor(chunk_file)
+
+                shutil.rmtree(chunk_path, ignore_errors=True)
+
+                if not success:
+                    LOG.error(f'Prediction of chunk {ichunk+1} of {nchunks}'
+                              f' (molecules {start+1} to {stop}) failed')
+                    break
+
+                obj_read = self.conveyor.getMeta('obj_read')
+                obj_offset += obj_read if obj_read is not None else 0
+                output_keys = self.conveyor.getMeta('output_keys')
+
+                LOG.info(f'Chunk {ichunk+1} of {nchunks} completed')
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+        return success, results
+
+    def _child_module(self, name):
+        ''' imports the child module name (e.g. "idata_child") from the
+            model folder, which allows customizing the processing applied
+            to each model '''
+        modpath = utils.module_path(self.model, self.version)
+        return importlib.import_module(modpath+'.'+name)
+
+    def idata_signature(self) -> str:
+        '''
+        Returns a hash of the parameters defining the model input generated
+        by Idata (e.g. normalization and molecular descriptors) and of the
+        model idata child. Models with the same signature obtain the same
+        input from the same input file
+        '''
+        values = {key: self.param.getVal(key) for key in IDATA_KEYS}
+
+        child_file = os.path.join(str(self.param.getVal('model_path')),
+                                  'idata_child.py')
+        if os.path.isfile(child_file):
+            values['idata_child'] = utils.md5sum(child_file)
+
+        serial = json.dumps(values, sort_keys=True, default=str)
+        return hashlib.md5(serial.encode()).hexdigest()
+
+    def share_input(self, conveyor) -> None:
+        ''' uses a copy of the input generated by Idata for another
+            model with the same idata_signature '''
+        self.conveyor = copy.deepcopy(conveyor)
+        self.conveyor.addMeta('endpoint', self.param.getVal('endpoint'))
+        self.conveyor.addMeta('version', self.param.getVal('version'))
+
+    def run_idata(self, input_source) -> None:
+        ''' runs idata object, in charge of generate model data
+            from input '''
+
         # path to endpoint
         endpoint = utils.model_path(self.model, self.version)
         if not os.path.isdir(endpoint):
             self.conveyor.setError(f'Unable to find model {self.model}, version {self.version}')
-            #LOG.error(f'Unable to find model {self.model}')
-
-
-        if not self.conveyor.getError():
-            # uses the child classes within the 'model' folder,
-            # to allow customization of
-            # the processing applied to each model
-            modpath = utils.module_path(self.model, self.version)
-
-            idata_child = importlib.import_module(modpath+".idata_child")
-            apply_child = importlib.import_module(modpath+".apply_child")
-            odata_child = importlib.import_module(modpath+".odata_child")
-
-            # run idata object, in charge of generate model data from input
-            try:
-                idata = idata_child.IdataChild(self.param, self.conveyor, input_source)
-            except:
-                LOG.warning ('Idata child architecture mismatch, defaulting to Idata parent')
-                idata = Idata(self.param, self.conveyor, input_source)
-
-            idata.run()
-            LOG.debug(f'idata child {type(idata).__name__} completed `run()`')
-
-        if not self.conveyor.getError():
-            # make sure there is X data
-            if not self.conveyor.isKey('xmatrix'):
-                LOG.debug(f'Failed to compute MDs')
-                self.conveyor.setError(f'Failed to compute MDs')
-
-        if not self.conveyor.getError():
-            # run apply object, in charge of generate a prediction from idata
-            try:
-                apply = apply_child.ApplyChild(self.param, self.conveyor)
-            except:
-                LOG.warning ('Apply child architecture mismatch, defaulting to Apply parent')
-                apply = Apply(self.param, self.conveyor)
-
-            apply.run()
-            LOG.debug(f'apply child {type(apply).__name__} completed `run()`')
-
-        # run odata object, in charge of formatting the prediction results
-        # note that if any of the above steps failed, an error has been inserted in the
-        # conveyor and odata will take case of showing an error message
+            return
+
+        idata_child = self._child_module('idata_child')
+
         try:
+            idata = idata_child.IdataChild(self.param, self.conveyor, input_source)
+        except:
+            LOG.warning ('Idata child architecture mismatch, defaulting to Idata parent')
+            idata = Idata(self.param, self.conveyor, input_source)
+
+        idata.run()
+        LOG.debug(f'idata child {type(idata).__name__} completed `run()`')
+
+    def run_apply(self) -> None:
+        ''' runs apply object, in charge of generate a prediction
+            from idata '''
+
+        if self.conveyor.getError():
+            return
+
+        # make sure there is X data
+        if not self.conveyor.isKey('xmatrix'):
+            LOG.debug(f'Failed to compute MDs')
+            self.conveyor.setError(f'Failed to compute MDs')
+            return
+
+        apply_child = self._child_module('apply_child')
+
+        try:
+            apply = apply_child.ApplyChild(self.param, self.conveyor)
+        except:
+            LOG.warning ('Apply child architecture mismatch, defaulting to Apply parent')
+            apply = Apply(self.param, self.conveyor)
+
+        apply.run()
+        LOG.debug(f'apply child {type(apply).__name__} completed `run()`')
+
+    def run_odata(self):
+        ''' runs odata object, in charge of formatting the prediction
+            results
+
+            note that if any of the above steps failed, an error has been
+            inserted in the conveyor and odata will take case of showing
+            an error message '''
+        try:
+            odata_child = self._child_module('odata_child')
             odata = odata_child.OdataChild(self.param, self.conveyor)
         except:
             LOG.warning ('Odata child architecture mismatch, defaulting to Odata parent')
             odata = Odata(self.param, self.conveyor)
 
         return odata.run()
+
+    def run_conveyor(self, input_source):
+        ''' Runs the prediction workflow for input_source, storing the
+            results in the conveyor '''
+
+        self.run_idata(input_source)
+        self.run_apply()
+
+        return self.run_odata()
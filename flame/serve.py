@@ -0,0 +1,386 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame resident prediction server
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2018 Manuel Pastor
+#
+# This file is part of Flame
+#
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Long running prediction server, avoiding the overhead of loading the model
+parameters and estimators for every prediction.
+
+The server listens on a Unix socket or a local TCP port. Every line received
+is a JSON request like
+
+    {"id": 1, "endpoint": "CACO2", "version": 0, "smiles": "CCO"}
+
+where the structures are given as "smiles" (a SMILES string or a list) or
+as "sdf" (the content of an SDFile). Every request is answered with a line
+containing a JSON like
+
+    {"id": 1, "success": true, "results": [{"obj_nam": ..., "values": ...}]}
+
+with one item in results for every structure in the request (an item with
+an "error" key when the structure could not be predicted).
+
+The parameters of the last models used are kept in memory, and the model
+estimators are kept in the estimator cache. Concurrent requests for the
+same model are merged into a single batch before running the prediction,
+waiting no more than batch_wait seconds for more requests.
+
+Models using external input (model_set) are not supported.
+'''
+
+import os
+import copy
+import json
+import shutil
+import socket
+import asyncio
+import tempfile
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from rdkit import Chem
+
+import flame.chem.sdfileutils as sdfutils
+from flame.util import utils, jsonwriter, get_logger
+from flame.parameters import Parameters
+from flame.stats import estimator_cache
+
+LOG = get_logger(__name__)
+
+# name given to the molecules of a batch, used to assign the results
+# to the requests
+BATCH_TAG = 'flame_batch_{}'
+
+
+def request_mols(request: dict) -> list:
+    '''
+    Returns the mols described in a request, as a "smiles" string or list
+    or as the content of an SDFile ("sdf"). Structures which cannot be read
+    are returned as None
+    '''
+    if 'smiles' in request:
+        smiles = request['smiles']
+        if isinstance(smiles, str):
+            smiles = [smiles]
+        return [Chem.MolFromSmiles(s) for s in smiles]
+
+    if 'sdf' in request:
+        suppl = Chem.SDMolSupplier()
+        suppl.SetData(request['sdf'])
+        return [m for m in suppl]
+
+    raise ValueError('requests must contain "smiles" or "sdf"')
+
+
+def split_results(conveyor, tags: list) -> dict:
+    '''
+    Returns a dictionary with the results of every object in the conveyor
+    named as one of the tags, as a dictionary of object values
+    '''
+    obj_nam = conveyor.getVal('obj_nam')
+    if obj_nam is None:
+        return {}
+
+    position = {name: i for i, name in enumerate(obj_nam)}
+    keys = conveyor.objectKeys()
+
+    results = {}
+    for tag in tags:
+        if tag not in position:
+            continue
+
+        i = position[tag]
+        item = {}
+        for key in keys:
+            value = conveyor.getVal(key)
+            if value is not None and i < len(value):
+                item[key] = value[i]
+        results[tag] = item
+
+    return results
+
+
+class ModelServer:
+    '''
+    Answers prediction requests, merging concurrent requests for the same
+    model in batches of up to max_batch structures.
+
+    The predictions are run in a single thread, so the event loop can
+    keep receiving requests (and building the next batches) meanwhile
+    '''
+
+    def __init__(self, max_models=8, max_batch=64, batch_wait=0.01):
+        self.max_models = max_models
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+
+        self.parameters = collections.OrderedDict()
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        estimator_cache.set_size(max_models)
+
+    def _parameters(self, endpoint, version):
+        '''
+        Returns a copy of the parameters of the model, reading the model
+        parameters file only when it is not in memory or was modified
+        '''
+        key = (endpoint, version)
+        param_file = os.path.join(utils.model_path(endpoint, version),
+                                  'parameters.yaml')
+        stamp = os.stat(param_file).st_mtime_ns
+
+        if key in self.parameters and self.parameters[key][0] == stamp:
+            self.parameters.move_to_end(key)
+            return copy.deepcopy(self.parameters[key][1])
+
+        param = Parameters()
+        success, message = param.loadYaml(endpoint, version)
+        if not success:
+            raise ValueError(f'Unable to load parameters of {endpoint}'
+                             f' version {version}: {message}')
+
+        self.parameters[key] = (stamp, param)
+        self.parameters.move_to_end(key)
+        while len(self.parameters) > self.max_models:
+            self.parameters.popitem(last=False)
+
+        return copy.deepcopy(param)
+
+    def predict_batch(self, key, batch: list) -> list:
+        '''
+        Predicts with the model key (endpoint, version) the structures of
+        a batch of requests, given as lists of mols. Returns the list of
+        results for every request
+        '''
+        from flame.predict import Predict
+
+        endpoint, version = key
+        param = self._parameters(endpoint, version)
+
+        if param.getModelSet()[0]:
+            raise ValueError('Models with external input are not supported')
+
+        # names are obtained from the molecule headers, which are
+        # replaced by tags identifying every molecule in the batch
+        name_field = param.getVal('SDFile_name')
+        param.setVal('SDFile_name', None)
+        param.setVal('output_format', [])
+        param.setVal('output_md', False)
+        param.setVal('predict_chunk_size', None)
+
+        tags = []
+        names = {}
+        mols = []
+        for mol in (m for request in batch for m in request):
+            tag = None
+            if mol is not None:
+                tag = BATCH_TAG.format(len(mols))
+                names[tag] = sdfutils.getName(mol, count=len(tags),
+                                              field=name_field)
+                mol = Chem.Mol(mol)
+                mol.SetProp('_Name', tag)
+                mols.append(mol)
+            tags.append(tag)
+
+        results = {}
+        if mols:
+            temp_path = tempfile.mkdtemp()
+            try:
+                ifile = os.path.join(temp_path, 'batch.sdf')
+                sdfutils.write_mols(mols, ifile)
+
+                predict = Predict(endpoint, version, parameters=param)
+                success, message = predict.run(ifile)
+                if not success:
+                    raise ValueError(predict.conveyor.getErrorMessage() or
+                                     message)
+
+                results = split_results(predict.conveyor, tags)
+            finally:
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+        LOG.info(f'{len(mols)} molecules in {len(batch)} requests'
+                 f' predicted with {endpoint} version {version}')
+
+        # return the results of every request, with the original names
+        output = []
+        itag = iter(tags)
+        for request in batch:
+            items = []
+            for _ in request:
+                tag = next(itag)
+                if tag in results:
+                    item = results[tag]
+                    item['obj_nam'] = names[tag]
+                else:
+                    item = {'error': 'unable to predict molecule'}
+                items.append(item)
+            output.append(items)
+
+        return output
+
+    def _flush(self, key, batch=None) -> None:
+        ''' starts the prediction of the pending requests for key. When
+            batch is provided, only if these are still pending '''
+        if key not in self.pending:
+            return
+        if batch is not None and self.pending[key] is not batch:
+            return
+
+        batch = self.pending.pop(key)
+        futures = [future for _, future in batch]
+
+        loop = asyncio.get_event_loop()
+        task = loop.run_in_executor(self.executor, self.predict_batch, key,
+                                    [mols for mols, _ in batch])
+
+        def done(task):
+            for future in futures:
+                if future.done():
+                    continue
+                if task.exception() is not None:
+                    future.set_exception(task.exception())
+            if task.exception() is None:
+                for future, items in zip(futures, task.result()):
+                    if not future.done():
+                        future.set_result(items)
+
+        task.add_done_callback(done)
+
+    async def predict(self, endpoint, version, mols: list) -> list:
+        ''' returns the results of predicting mols, queued in the next
+            batch of the model '''
+        key = (endpoint, version)
+        future = asyncio.get_event_loop().create_future()
+
+        if key not in self.pending:
+            self.pending[key] = []
+            asyncio.get_event_loop().call_later(
+                self.batch_wait, self._flush, key, self.pending[key])
+
+        batch = self.pending[key]
+        batch.append((mols, future))
+
+        if sum(len(m) for m, _ in batch) >= self.max_batch:
+            self._flush(key)
+
+        return await future
+
+    async def handle(self, request: dict) -> dict:
+        ''' answers a single request '''
+        response = {'id': request.get('id')}
+        try:
+            mols = request_mols(request)
+            results = await self.predict(request['endpoint'],
+                                         utils.intver(request.get('version')),
+                                         mols)
+            response['success'] = True
+            response['results'] = results
+        except Exception as e:
+            LOG.error(f'Request {response["id"]} failed: {e}')
+            response['success'] = False
+            response['error'] = str(e)
+
+        return response
+
+    async def _client(self, reader, writer):
+        ''' reads requests from a connection, answering them as soon as
+            they are completed '''
+
+        async def answer(line):
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {'success': False, 'error': f'Wrong request: {e}'}
+            else:
+                response = await self.handle(request)
+
+            # numpy values are encoded by the writer, anything else as str
+            jsonwriter.dump(response, writer, default=str)
+            writer.write(b'\n')
+            await writer.drain()
+
+        tasks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                tasks.append(asyncio.ensure_future(answer(line)))
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        writer.close()
+
+    async def start(self, socket_path=None, port=None, host='127.0.0.1'):
+        ''' starts listening on a Unix socket or a TCP port '''
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self._client,
+                                                     path=socket_path)
+            LOG.info(f'Flame server listening on {socket_path}')
+        else:
+            server = await asyncio.start_server(self._client, host, port)
+            LOG.info(f'Flame server listening on {host}:{port}')
+
+        return server
+
+
+def serve(socket_path=None, port=None, host='127.0.0.1', **kwargs) -> None:
+    ''' runs a ModelServer until the process is interrupted '''
+    server = ModelServer(**kwargs)
+
+    async def run():
+        listener = await server.start(socket_path, port, host)
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        LOG.info('Flame server stopped')
+
+
+def send(requests: list, socket_path=None, port=None,
+         host='127.0.0.1') -> list:
+    '''
+    Client sending a list of requests to a running server through a single
+    connection. Returns the responses in the order of the requests
+    '''
+    if socket_path is not None:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(socket_path)
+    else:
+        conn = socket.create_connection((host, port))
+
+    requests = [dict(request, id=i) for i, request in enumerate(requests)]
+
+    with conn, conn.makefile('rwb') as stream:
+        for request in requests:
+            stream.write(json.dumps(request).encode() + b'\n')
+        stream.flush()
+        conn.shutdown(socket.SHUT_WR)
+
+        responses = [json.loads(line) for line in stream if line.strip()]
+
+    return sorted(responses, key=lambda response: response['id'])
@@ -26,6 +26,7 @@
 from sklearn.naive_bayes import GaussianNB
 from flame.stats.base_model import BaseEstimator
 from flame.stats.base_model import getCrossVal
+from flame.stats import conformal
 from flame.stats.scale import scale, center
 from flame.stats.model_validation import CF_QuanVal
 
@@ -97,12 +98,8 @@ class GNB(BaseEstimator):
         self.estimator.fit(X, Y)
         self.estimator_temp = copy(self.estimator)
         if self.param.getVal('conformal'):
-            self.estimator = AggregatedCp(
-                IcpClassifier(ClassifierNc(
-                    ClassifierAdapter(
-                        self.estimator_temp),
-                    MarginErrFunc())),
-                BootstrapSampler())
+            self.estimator = conformal.AggregatedConformal(
+                self.estimator_temp, False, ncpu=self.ncpu)
             # Fit estimator to the data
             self.estimator.fit(X, Y)
             results.append(
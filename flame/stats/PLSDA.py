@@ -28,6 +28,7 @@
 
 from flame.stats.base_model import BaseEstimator
 from flame.stats.base_model import getCrossVal
+from flame.stats import crossval
 from flame.stats.scale import scale, center
 from flame.stats.model_validation import CF_QuanVal
 
@@ -238,11 +239,14 @@ class PLSDA(BaseEstimator):
         # coefficient for each number of latent variables
         list_latent = []
         try:
+            # the predictions for all the number of latent variables are
+            # obtained fitting a single model per fold
+            y_preds, _ = crossval.pls_cross_val_predict(
+                X, Y, self.cv, latent_variables, estimator.scale)
             for n_comp in latent_variables:
                 mcc0 = 0
                 estimator.set_params(**{"n_components": n_comp})
-                y_pred = cross_val_predict(estimator, X, Y, 
-                                            cv=self.cv, n_jobs=1)
+                y_pred = y_preds[n_comp]
                 estimator1 = ""
                 threshold_1 = 0
                 # Get optimum threshold
@@ -279,6 +283,24 @@ class PLSDA(BaseEstimator):
         LOG.info(f'Estimator best parameters: {self.estimator.get_params()}')
 
 
+    def cross_val_predict(self, X, Y):
+        ''' cross-validation of PLS models fitting a single model per fold
+            for all the latent variables (see crossval.pls_cross_val_predict)
+        '''
+        if not isinstance(self.estimator, PLSRegression):
+            return super(PLSDA, self).cross_val_predict(X, Y)
+
+        n_comp = self.estimator.n_components
+        y_preds, fold_times = crossval.pls_cross_val_predict(
+            X, Y, self.cv, [n_comp], self.estimator.scale)
+        y_pred = y_preds[n_comp]
+
+        threshold = getattr(self.estimator, 'threshold', None)
+        if threshold is not None:
+            y_pred = (y_pred >= threshold).astype(float)
+
+        return y_pred, fold_times
+
 #### Overriding of parent methods
 
     # def CF_quantitative_validation(self):
@@ -24,6 +24,8 @@
 
 from flame.stats.base_model import BaseEstimator
 from flame.stats.base_model import getCrossVal
+from flame.stats import crossval
+from flame.stats import conformal
 from flame.stats.scale import scale, center
 from flame.stats.model_validation import CF_QuanVal
 
@@ -185,16 +187,10 @@ class PLSR(BaseEstimator):
         self.estimator_temp = copy(self.estimator)
         if self.param.getVal('conformal'):
             try:
-                underlying_model = RegressorAdapter(self.estimator_temp)
-                #normalizing_model = RegressorAdapter(
-                    #KNeighborsRegressor(n_neighbors=1))
-                normalizing_model = RegressorAdapter(self.estimator_temp)
-                normalizer = RegressorNormalizer(
-                    underlying_model, normalizing_model, AbsErrorErrFunc())
-                nc = RegressorNc(underlying_model, AbsErrorErrFunc(), 
-                                 normalizer)
-                self.estimator = AggregatedCp(IcpRegressor(nc),
-                                                BootstrapSampler())
+                # normalized with a model of the residuals
+                self.estimator = conformal.AggregatedConformal(
+                    self.estimator_temp, True, normalized=True,
+                    ncpu=self.ncpu)
                 LOG.info('Building PLSR aggregated conformal predictor')
             except Exception as e:
                 LOG.error(f'Error building aggregated PLSR conformal'
@@ -222,26 +218,32 @@ class PLSR(BaseEstimator):
         latent_variables = tune_parameters['n_components']
         # Best r2
         r2 = 0
-        estimator0 = ""
+        best_comp = None
         # List to add r2 for each number of latent variables
         list_latent = []
         try:
+            # the predictions for all the number of latent variables are
+            # obtained fitting a single model per fold
+            y_preds, _ = crossval.pls_cross_val_predict(
+                X, Y, self.cv, latent_variables, estimator.scale)
             for n_comp in latent_variables:
-                r2_0 = 0
-                estimator.set_params(**{"n_components": n_comp})
-                y_pred = cross_val_predict(estimator, X, Y,
-                                             cv=self.cv, n_jobs=1)
-                r2_0 = r2_score(Y, y_pred)
-                # Update estimator0 to best current estimator
+                r2_0 = r2_score(Y, y_preds[n_comp])
+                # Update best_comp to best current number of variables
                 if r2_0 >= r2:
                     r2 = r2_0
-                    estimator0 = copy.copy(estimator)
+                    best_comp = n_comp
 
                 list_latent.append([n_comp, r2_0])
         except Exception as e:
             LOG.error(f'Error optimizing PLSR with exception {e}')
             raise e
 
+        if best_comp is None:
+            LOG.error('No number of latent variables with positive r2')
+            raise ValueError('No number of latent variables with positive r2')
+
+        estimator0 = copy(estimator)
+        estimator0.set_params(**{"n_components": best_comp})
         self.estimator = estimator0
         LOG.debug('Number of latent variables, r2')
         for lv in list_latent:
@@ -249,6 +251,18 @@ class PLSR(BaseEstimator):
         self.estimator.fit(X, Y)
         LOG.info(f'Estimator best parameters: {self.estimator.get_params()}')
 
+    def cross_val_predict(self, X, Y):
+        ''' cross-validation of PLS models fitting a single model per fold
+            for all the latent variables (see crossval.pls_cross_val_predict)
+        '''
+        if not isinstance(self.estimator, PLSRegression):
+            return super(PLSR, self).cross_val_predict(X, Y)
+
+        n_comp = self.estimator.n_components
+        y_preds, fold_times = crossval.pls_cross_val_predict(
+            X, Y, self.cv, [n_comp], self.estimator.scale)
+        return y_preds[n_comp], fold_times
+
 #### Overriding of parent methods
 
     # def CF_quantitative_validation(self):
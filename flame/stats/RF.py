@@ -31,16 +31,75 @@ from nonconformist.nc import ClassifierNc, MarginErrFunc, RegressorNc
 from sklearn.neighbors import KNeighborsRegressor
 from nonconformist.nc import AbsErrorErrFunc, RegressorNormalizer
 from copy import copy
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import r2_score, matthews_corrcoef as mcc
+from sklearn.model_selection import ParameterGrid
 from flame.stats.base_model import BaseEstimator
+from flame.stats import conformal
 from flame.stats.model_validation import getCrossVal
 from flame.stats.scale import scale, center
 from flame.stats.model_validation import CF_QuanVal
-from flame.util import get_logger
+from flame.util import pool, get_logger
 #from flame.parameters import Parameters
 
 LOG = get_logger(__name__)
 
 
+def _grow_forests(task) -> list:
+    ''' grows a forest for every combination of parameters of the chunk,
+        adding trees with warm_start and returning the out-of-bag score
+        for every number of trees '''
+    estimator, X, Y, quantitative, n_estimators, combinations = task
+
+    results = []
+    for icomb, params in combinations:
+        forest = clone(estimator)
+        forest.set_params(warm_start=True, oob_score=True, n_jobs=1,
+                          **params)
+        # unseeded forests are seeded, so that all the combinations are
+        # scored with the same bootstrap samples
+        if forest.get_params()['random_state'] is None:
+            forest.set_params(random_state=46)
+        for ntrees in n_estimators:
+            forest.set_params(n_estimators=ntrees)
+            forest.fit(X, Y)
+            results.append((icomb, ntrees, oob_score(forest, Y,
+                                                     quantitative)))
+
+    return results
+
+
+def oob_predicted(forest, quantitative) -> np.ndarray:
+    '''
+    Returns a boolean array marking the objects with out-of-bag predictions
+    in a forest fitted with oob_score. sklearn predicts 0 (or an all-zero
+    decision) for objects which were in the bootstrap sample of every tree
+    '''
+    if not quantitative:
+        return np.nan_to_num(forest.oob_decision_function_).sum(axis=1) > 0
+
+    in_bag = np.zeros((len(forest.estimators_),
+                       len(forest.oob_prediction_)), dtype=bool)
+    for i, samples in enumerate(forest.estimators_samples_):
+        in_bag[i, samples] = True
+    return (~in_bag).any(axis=0)
+
+
+def oob_score(forest, Y, quantitative) -> float:
+    ''' r2 (quantitative) or MCC (qualitative) of the out-of-bag
+        predictions of a forest fitted with oob_score '''
+    # objects not out-of-bag in any tree are not used
+    predicted = oob_predicted(forest, quantitative)
+
+    if quantitative:
+        return r2_score(Y[predicted], forest.oob_prediction_[predicted])
+
+    decision = np.nan_to_num(forest.oob_decision_function_)
+    y_pred = forest.classes_[np.argmax(decision, axis=1)]
+    return mcc(Y[predicted], y_pred[predicted])
+
+
 class RF(BaseEstimator):
     """
         This class inherits from BaseEstimator and wraps SKLEARN
@@ -140,6 +199,10 @@ class RF(BaseEstimator):
             except Exception as e:
                 LOG.error(f'Exception building RF' 
                           f'estimator with exception {e}')
+        # out-of-bag predictions are needed for validating the model
+        if self.param.getVal('ModelValidationCV') == 'oob':
+            self.estimator.set_params(oob_score=True)
+
         self.estimator.fit(X, Y)
         self.estimator_temp = copy(self.estimator)
         # Create the conformal estimator
@@ -147,36 +210,19 @@ class RF(BaseEstimator):
             try:
                 LOG.info("Building aggregated conformal RF model")
                 if self.param.getVal('quantitative'):
-                    underlying_model = RegressorAdapter(self.estimator_temp)
-                    #normalizing_model = RegressorAdapter(
-                        #KNeighborsRegressor(n_neighbors=5))
-                    normalizing_model = RegressorAdapter(self.estimator_temp)
-                    normalizer = RegressorNormalizer(
-                                    underlying_model,
-                                    normalizing_model,
-                                    AbsErrorErrFunc())
-                    nc = RegressorNc(underlying_model,
-                                         AbsErrorErrFunc(),
-                                         normalizer)
-                    # self.conformal_pred = AggregatedCp(IcpRegressor
-                    # (RegressorNc(RegressorAdapter(self.estimator))),
-                    #                                   BootstrapSampler())
-
-                    self.estimator = AggregatedCp(IcpRegressor(nc),
-                                                    BootstrapSampler())
+                    # normalized with a model of the residuals
+                    self.estimator = conformal.AggregatedConformal(
+                                        self.estimator_temp, True,
+                                        normalized=True, ncpu=self.ncpu)
                     self.estimator.fit(X, Y)
                     # overrides non-conformal
                     results.append(
                         ('model', 'model type', 'conformal RF quantitative'))
                 # Conformal classifier
                 else:
-                    self.estimator = AggregatedCp(
-                                        IcpClassifier(
-                                            ClassifierNc(
-                                                ClassifierAdapter(
-                                                    self.estimator_temp),
-                                                MarginErrFunc())),
-                                        BootstrapSampler())
+                    self.estimator = conformal.AggregatedConformal(
+                                        self.estimator_temp, False,
+                                        ncpu=self.ncpu)
                     # Fit estimator to the data
                     self.estimator.fit(X, Y)
                     results.append(
@@ -187,7 +233,79 @@ class RF(BaseEstimator):
 
         return True, results
 
+    def optimize(self, X, Y, estimator, tune_parameters):
+        '''
+        optimizes the parameters of the forest. When several n_estimators
+        values are given, a single forest is grown for every combination
+        of the other parameters, adding trees with warm_start and scoring
+        the out-of-bag predictions for every number of trees
+        '''
+        tune_method = self.param.getVal('tune_method')
+        n_estimators = tune_parameters.get('n_estimators')
+        if tune_method not in (None, 'grid') or \
+           not isinstance(n_estimators, list) or len(n_estimators) < 2:
+            return super(RF, self).optimize(X, Y, estimator, tune_parameters)
+
+        LOG.info('Optimizing RF growing a forest for every combination '
+                 'of parameters')
+        n_estimators = sorted(n_estimators)
+        others = {key: value if isinstance(value, list) else [value]
+                  for key, value in tune_parameters.items()
+                  if key != 'n_estimators'}
+        combinations = list(enumerate(ParameterGrid(others)))
+
+        quantitative = self.param.getVal('quantitative')
+        nchunks = max(1, min(self.ncpu, len(combinations)))
+        tasks = [(estimator, X, Y, quantitative, n_estimators,
+                  combinations[i::nchunks]) for i in range(nchunks)]
+
+        scores = {}
+        for results in pool.imap(_grow_forests, tasks, nchunks):
+            for icomb, ntrees, score in results:
+                scores[(icomb, ntrees)] = score
+
+        # ties are resolved in grid order, as GridSearchCV
+        best = max(((icomb, ntrees) for icomb, params in combinations
+                    for ntrees in n_estimators),
+                   key=lambda item: scores[item])
+        best_params = dict(combinations[best[0]][1], n_estimators=best[1])
+
+        for icomb, params in combinations:
+            LOG.debug(f'{params}: ' + ', '.join(
+                f'{ntrees} trees {scores[(icomb, ntrees)]:.3f}'
+                for ntrees in n_estimators))
+        LOG.info(f'best parameters: , {best_params}')
+
+        # the random_state of the estimator is not modified
+        self.estimator = clone(estimator)
+        self.estimator.set_params(**best_params)
+
+    def cross_val_predict(self, X, Y):
+        ''' when ModelValidationCV is oob, returns the out-of-bag predictions
+            of the fitted forest instead of refitting it for every fold '''
+        if self.param.getVal('ModelValidationCV') != 'oob':
+            return super(RF, self).cross_val_predict(X, Y)
+
+        if not getattr(self.estimator, 'oob_score', False):
+            raise ValueError('oob validation requires oob_score')
+
+        quantitative = self.param.getVal('quantitative')
+
+        # these objects would be predicted as 0 and bias the quality
+        not_predicted = ~oob_predicted(self.estimator, quantitative)
+        if np.any(not_predicted):
+            raise ValueError(f'{np.sum(not_predicted)} objects were not '
+                             f'out-of-bag in any tree, increase '
+                             f'n_estimators or use another ModelValidationCV')
+
+        if quantitative:
+            y_pred = self.estimator.oob_prediction_
+        else:
+            decision = self.estimator.oob_decision_function_
+            y_pred = self.estimator.classes_[np.argmax(decision, axis=1)]
 
+        # no folds were fitted
+        return np.asarray(y_pred), np.zeros((0, 2))
 
 ## Overriding of parent methods
 
@@ -24,8 +24,10 @@
 
 from flame.stats.base_model import BaseEstimator
 from flame.stats.base_model import getCrossVal
+from flame.stats import conformal
 from flame.stats.scale import scale, center
 from flame.stats.model_validation import CF_QuanVal
+from flame.chem import fingerprints
 
 from sklearn import svm
 from copy import copy
@@ -42,6 +44,46 @@ from flame.util import get_logger
 LOG = get_logger(__name__)
 
 
+class _TanimotoKernel:
+    '''
+    Mixin for sklearn SVMs with kernel='precomputed', fitted and applied
+    to binary fingerprints (PackedFingerprints or 0/1 matrices). The
+    Tanimoto kernel is computed from the packed words, so the
+    fingerprints are never expanded to a dense matrix
+    '''
+
+    def fit(self, X, y, sample_weight=None):
+        if not isinstance(X, fingerprints.PackedFingerprints):
+            X = fingerprints.PackedFingerprints.from_dense(X)
+        # the training fingerprints are needed for computing the kernel
+        # of the objects predicted
+        self.fit_words_ = X.words
+        self.fit_nbits_ = X.nbits
+        return super().fit(fingerprints.tanimoto_similarity(X), y,
+                           sample_weight)
+
+    def _validate_for_predict(self, X):
+        # all the predict methods of sklearn SVMs validate X here
+        train = fingerprints.PackedFingerprints(self.fit_words_,
+                                                self.fit_nbits_)
+        return super()._validate_for_predict(
+            fingerprints.tanimoto_similarity(X, train))
+
+    def __sklearn_tags__(self):
+        tags = super().__sklearn_tags__()
+        # X are the fingerprints, not the kernel, and must be split by rows
+        tags.input_tags.pairwise = False
+        return tags
+
+
+class TanimotoSVC(_TanimotoKernel, svm.SVC):
+    ''' SVC with a Tanimoto kernel computed from packed fingerprints '''
+
+
+class TanimotoSVR(_TanimotoKernel, svm.SVR):
+    ''' SVR with a Tanimoto kernel computed from packed fingerprints '''
+
+
 class SVM(BaseEstimator):
     """
         This class inherits from BaseEstimator and wraps SKLEARN
@@ -96,6 +138,33 @@ class SVM(BaseEstimator):
             self.estimator_parameters.pop("epsilon", None)
             self.name = "SVM-C"
 
+        # Tanimoto kernel for binary fingerprints. When it is the only
+        # kernel the estimator computes it from the packed fingerprints
+        if self.tanimoto_only():
+            self.estimator_parameters['kernel'] = 'precomputed'
+            self.tune_parameters.pop('kernel', None)
+            return
+        if self.estimator_parameters.get('kernel') == 'tanimoto':
+            self.estimator_parameters['kernel'] = fingerprints.tanimoto_kernel
+        if isinstance(self.tune_parameters.get('kernel'), list):
+            self.tune_parameters['kernel'] = [
+                fingerprints.tanimoto_kernel if k == 'tanimoto' else k
+                for k in self.tune_parameters['kernel']]
+
+    def tanimoto_only(self) -> bool:
+        ''' True when the Tanimoto kernel is the only one used, fixed or
+            as the only value tried in the hyperparameter optimization '''
+        kernel = self.param.getDict('SVM_parameters').get('kernel')
+        if self.param.getVal('tune'):
+            kernel = self.param.getDict('SVM_optimize').get('kernel', kernel)
+            if isinstance(kernel, list) and len(kernel) == 1:
+                kernel = kernel[0]
+        return kernel == 'tanimoto'
+
+    def accepts_packed(self) -> bool:
+        ''' the Tanimoto kernel is computed from the packed fingerprints '''
+        return self.tanimoto_only()
+
     def build(self):
         '''Build a new SVM model with the X and Y numpy matrices'''
 
@@ -112,12 +181,12 @@ class SVM(BaseEstimator):
             try:
                 # Check type of model
                 if self.param.getVal('quantitative'):
-                    self.optimize(X, Y, svm.SVR(), self.tune_parameters)
+                    self.optimize(X, Y, self.svr(), self.tune_parameters)
                     results.append(
                         ('model', 'model type', 'SVM quantitative (optimized)'))
 
                 else:
-                    self.optimize(X, Y, svm.SVC(probability=True),
+                    self.optimize(X, Y, self.svc(probability=True),
                                   self.tune_parameters)
                     results.append(
                         ('model', 'model type', 'SVM qualitative (optimized)'))
@@ -130,10 +199,10 @@ class SVM(BaseEstimator):
                 LOG.info("Building  SVM model")
                 if self.param.getVal('quantitative'):
                     LOG.info("Building Quantitative SVM-R model")
-                    self.estimator = svm.SVR(**self.estimator_parameters)
+                    self.estimator = self.svr(**self.estimator_parameters)
                     results.append(('model', 'model type', 'SVM quantitative'))
                 else:
-                    self.estimator = svm.SVC(**self.estimator_parameters)
+                    self.estimator = self.svc(**self.estimator_parameters)
                     results.append(('model', 'model type', 'SVM qualitative'))
             except Exception as e:
                 LOG.error(f'Exception building SVM'
@@ -144,32 +213,18 @@ class SVM(BaseEstimator):
             try:
                 LOG.info("Building aggregated conformal SVM model")
                 if self.param.getVal('quantitative'):
-                    underlying_model = RegressorAdapter(self.estimator_temp)
-                    # normalizing_model = RegressorAdapter(
-                    # KNeighborsRegressor(n_neighbors=5))
-                    normalizing_model = RegressorAdapter(self.estimator_temp)
-                    normalizer = RegressorNormalizer(
-                        underlying_model, normalizing_model, AbsErrorErrFunc())
-                    nc = RegressorNc(underlying_model,
-                                     AbsErrorErrFunc(), normalizer)
-                    # self.conformal_pred = AggregatedCp(IcpRegressor(
-                    # RegressorNc(RegressorAdapter(self.estimator))),
-                    #                                   BootstrapSampler())
-
-                    self.estimator = AggregatedCp(IcpRegressor(nc),
-                                                  BootstrapSampler())
+                    # normalized with a model of the residuals
+                    self.estimator = conformal.AggregatedConformal(
+                        self.estimator_temp, True, normalized=True,
+                        ncpu=self.ncpu)
                     self.estimator.fit(X, Y)
                     # overrides non-conformal
                     results.append(
                         ('model', 'model type', 'conformal SVM quantitative'))
 
                 else:
-                    self.estimator = AggregatedCp(
-                        IcpClassifier(
-                            ClassifierNc(
-                                ClassifierAdapter(self.estimator_temp),
-                                MarginErrFunc())),
-                        BootstrapSampler())
+                    self.estimator = conformal.AggregatedConformal(
+                        self.estimator_temp, False, ncpu=self.ncpu)
                     self.estimator.fit(X, Y)
                     # overrides non-conformal
                     results.append(
@@ -180,6 +235,20 @@ class SVM(BaseEstimator):
         # Fit estimator to the data
         return True, results
 
+    def svr(self, **params):
+        ''' SVR estimator, using the packed Tanimoto kernel if needed '''
+        if self.tanimoto_only():
+            params['kernel'] = 'precomputed'
+            return TanimotoSVR(**params)
+        return svm.SVR(**params)
+
+    def svc(self, **params):
+        ''' SVC estimator, using the packed Tanimoto kernel if needed '''
+        if self.tanimoto_only():
+            params['kernel'] = 'precomputed'
+            return TanimotoSVC(**params)
+        return svm.SVC(**params)
+
 
 # Overriding of parent methods
 
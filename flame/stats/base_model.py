@@ -21,6 +21,12 @@
 # along with Flame.  If not, see <http://www.gnu.org/licenses/>.
 
 from flame.util import utils
+from flame.chem import fingerprints
+from flame.stats import crossval
+from flame.stats import tuning
+from flame.stats import estimator_cache
+from flame.stats import fold_cache
+from flame.stats import persistence
 from flame.stats.imbalance import *  
 from flame.stats.model_validation import *
 from flame.stats.scale import center, scale
@@ -45,7 +51,8 @@ from sklearn.model_selection import KFold
 from sklearn.model_selection import GridSearchCV
 from sklearn.metrics import mean_squared_error, matthews_corrcoef as mcc
 from sklearn.metrics import f1_score
-from sklearn.metrics import make_scorer
+from sklearn.metrics import make_scorer, get_scorer
+from sklearn.base import clone
 from sklearn.metrics import confusion_matrix
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import MinMaxScaler 
@@ -150,7 +157,23 @@ class BaseEstimator:
         self.scaler = None
         self.variable_mask = None
 
+        # max number of CPUs used for cross-validation and optimization
+        self.ncpu = crossval.cpu_budget(parameters)
+
+        # cross-validation results of previous builds (validation_cache)
+        self.fold_cache = None
+        model_path = self.param.getVal('model_path')
+        if self.param.getVal('validation_cache') and model_path is not None:
+            self.fold_cache = fold_cache.FoldCache(
+                os.path.join(model_path, fold_cache.CACHE_DIR))
+
         if X is not None:
+            # packed fingerprints are expanded to a regular float matrix,
+            # unless the learner computes on the packed words
+            packed = isinstance(X, fingerprints.PackedFingerprints)
+            if packed and not self.accepts_packed():
+                X = fingerprints.to_dense(X)
+                packed = False
             self.X_original = X
             self.Y_original = Y
             self.variable_mask = []
@@ -179,8 +202,16 @@ class BaseEstimator:
             if self.param.getVal("imbalance") is not None and \
             not self.param.getVal("quantitative"):
                 try:
-                    self.X, self.Y = run_imbalance(
-                        self.param.getVal('imbalance'), self.X, self.Y, 46)
+                    if packed:
+                        # the rows sampled are selected in the packed matrix
+                        rows, self.Y = run_imbalance(
+                            self.param.getVal('imbalance'),
+                            np.arange(self.nobj).reshape(-1, 1), self.Y, 46)
+                        self.X = self.X[rows.ravel()]
+                    else:
+                        self.X, self.Y = run_imbalance(
+                            self.param.getVal('imbalance'), self.X, self.Y,
+                            46)
                     # This is necessary to avoid inconsistences in methods
                     # using self.nobj
                     LOG.info(f'{self.param.getVal("imbalance")}'
@@ -191,8 +222,15 @@ class BaseEstimator:
                                 f'method with exception: {e}')
                     raise e
 
+            # Scaling and feature selection are not applied to packed
+            # fingerprints, which would require expanding them
+            if packed and (self.param.getVal('modelAutoscaling') or
+                           self.param.getVal('feature_selection')):
+                LOG.warning('Scaling and feature selection are skipped '
+                            'for packed fingerprints')
+
             # Run scaling.
-            if self.param.getVal('modelAutoscaling'):
+            if self.param.getVal('modelAutoscaling') and not packed:
                 try:
                     # self.X, self.mux = center(self.X)
                     # self.X, self.wgx = scale(self.X, 
@@ -219,7 +257,7 @@ class BaseEstimator:
                 #     newX[:, i] = np.array(self.X[:, i] -list_min[i])
 
             # Run feature selection. Move to a instance method.
-            if self.param.getVal("feature_selection"):
+            if self.param.getVal("feature_selection") and not packed:
                 self.run_feature_selection()
         
             # Set the new number of instances/variables
@@ -235,6 +273,11 @@ class BaseEstimator:
                 LOG.error('No activity values')
                 raise ValueError("No activity values (Y)")
 
+    def accepts_packed(self) -> bool:
+        ''' True for learners fitted directly on packed fingerprints
+            (PackedFingerprints), which are unpacked for the rest '''
+        return False
+
     def run_feature_selection(self):
         """Compute the number of variables to be retained.
         """
@@ -290,44 +333,30 @@ class BaseEstimator:
         info = []
         kf = KFold(n_splits=self.param.getVal('ModelValidationN')
                    , shuffle=True, random_state=46)
-        # Copy Y vector to use it as template to assign predictions
-        Y_pred = copy.copy(Y).tolist()
         try:
-            for train_index, test_index in kf.split(X):
-                # Generate training and test sets
-                X_train, X_test = X[train_index], X[test_index]
-                Y_train, Y_test = Y[train_index], Y[test_index]
-                # Generate training a test sets
-                # Create the aggregated conformal regressor.
-                conformal_pred = AggregatedCp(IcpRegressor(
-                                    RegressorNc(RegressorAdapter(
-                                        self.estimator_temp))),
-                                            BootstrapSampler())
-                # Fit conformal regressor to the data
-                conformal_pred.fit(X_train, Y_train)
-
-                # Perform prediction on test set
-                prediction = conformal_pred.predict(
-                    X_test, self.param.getVal('conformalSignificance'))
-                # Assign the prediction its original index
-                for index, el in enumerate(test_index):
-                    Y_pred[el] = prediction[index]
+            # The aggregated conformal regressors of every fold are fitted
+            # in parallel
+            fitted = self.cached_validation(
+                'conformal_quantitative', self.estimator_temp, kf, X, Y,
+                crossval.conformal_fit_folds, self.estimator_temp, True,
+                X, Y, kf, self.ncpu)
+            Y_pred, fold_times = crossval.conformal_aggregate_folds(
+                fitted, True, X, Y,
+                self.param.getVal('conformalSignificance'))
+            # out-of-fold record, for assessing other significances
+            oof = crossval.conformal_oof(fitted, True, X, Y)
 
         except Exception as e:
             LOG.error(f'Quantitative conformal validation'
                         f' failed with exception: {e}')
             raise e
 
-        Y_pred = np.asarray(Y_pred)
         # Add the n validation interval means
         interval_mean = np.mean(np.abs((Y_pred[:, 0]) - 
                         (Y_pred[:, 1])))
         # Get boolean mask of instances
         #  within the applicability domain.
-        inside_interval = ((Y_pred[:, 0].reshape(-1, 1)
-                                < Y) & 
-                                (Y_pred[:, 1].reshape(-1, 1) 
-                                > Y))
+        inside_interval = (Y_pred[:, 0] < Y) & (Y_pred[:, 1] > Y)
         # Compute the accuracy (number of instances within the AD).
         accuracy = np.sum(inside_interval)/len(Y)
 
@@ -351,9 +380,11 @@ class BaseEstimator:
             ('Conformal_prediction_ranges',
              'Conformal prediction ranges', 
              Y_pred))
+        info += crossval.fold_info(fold_times)
 
         results = {}
         results ['quality'] = info
+        results ['conformal_oof'] = oof
         return True, results
 
     def CF_qualitative_validation(self):
@@ -363,56 +394,31 @@ class BaseEstimator:
         X = self.X.copy()
         Y = self.Y.copy()
 
-        # Total number of class 0 correct predictions.
-        c0_correct_all = 0
-        # Total number of class 0 incorrect predictions.
-        c0_incorrect_all = 0
-        # Total number of class 1 correct predictions.
-        c1_correct_all = 0
-        # Total number of class 1 incorrect predictions
-        c1_incorrect_all = 0
-        # Total number of instances out of the applicability domain.
-        not_predicted_all = 0
-
         info = []
 
         kf = KFold(n_splits=5, shuffle=True, random_state=46)
-        # Copy Y vector to use it as template to assign predictions
-        Y_pred = copy.copy(Y).tolist()
         try:
-            for train_index, test_index in kf.split(X):
-                # Generate training and test sets
-                X_train, X_test = X[train_index], X[test_index]
-                Y_train, Y_test = Y[train_index], Y[test_index]
-                # Create the aggregated conformal classifier.
-                conformal_pred = AggregatedCp(IcpClassifier(
-                                            ClassifierNc(ClassifierAdapter(
-                                                            self.estimator_temp),
-                                                MarginErrFunc())),
-                                            BootstrapSampler())
-                # Fit the conformal classifier to the data
-                conformal_pred.fit(X_train, Y_train)
-                # Perform prediction on test set
-                prediction = conformal_pred.predict(
-                            X_test, self.param.getVal('conformalSignificance'))
-                # Assign the prediction the correct index. 
-                for index, el in enumerate(test_index):
-                    Y_pred[el] = prediction[index]
-            # Iterate over the prediction and check the result
-            for i in range(len(Y_pred)):
-                real = float(Y[i])
-                predicted = Y_pred[i]
-                if predicted[0] != predicted[1]:
-                    if real == 0 and predicted[0] == True:
-                        c0_correct_all += 1
-                    if real == 0 and predicted[1] == True:
-                        c0_incorrect_all += 1
-                    if real == 1 and predicted[1] == True:
-                        c1_correct_all += 1
-                    if real == 1 and predicted[0] == True:
-                        c1_incorrect_all += 1
-                else:
-                    not_predicted_all += 1
+            # The aggregated conformal classifiers of every fold are fitted
+            # in parallel
+            fitted = self.cached_validation(
+                'conformal_qualitative', self.estimator_temp, kf, X, Y,
+                crossval.conformal_fit_folds, self.estimator_temp, False,
+                X, Y, kf, self.ncpu)
+            Y_pred, fold_times = crossval.conformal_aggregate_folds(
+                fitted, False, X, Y,
+                self.param.getVal('conformalSignificance'))
+            # out-of-fold record, for assessing other significances
+            oof = crossval.conformal_oof(fitted, False, X, Y)
+
+            # Only the objects assigned to a single class are predicted
+            single = Y_pred[:, 0] != Y_pred[:, 1]
+            real0 = single & (Y == 0)
+            real1 = single & (Y == 1)
+            c0_correct_all = int(np.sum(real0 & Y_pred[:, 0]))
+            c0_incorrect_all = int(np.sum(real0 & Y_pred[:, 1]))
+            c1_correct_all = int(np.sum(real1 & Y_pred[:, 1]))
+            c1_incorrect_all = int(np.sum(real1 & Y_pred[:, 0]))
+            not_predicted_all = int(np.sum(~single))
 
         except Exception as e:
             LOG.error(f'Qualitative conformal validation'
@@ -489,12 +495,41 @@ class BaseEstimator:
         info.append(
             ('Conformal_accuracy', 'Conformal accuracy', 
                 self.conformal_accuracy))
+        info += crossval.fold_info(fold_times)
 
         results = {}
         results ['quality'] = info
+        results ['conformal_oof'] = oof
         #results ['classes'] = prediction
         return True, results
 
+    def cross_val_predict(self, X, Y):
+        ''' returns the cross-validated predictions of the estimator and the
+            times of every fold. Can be overriden by estimators having a
+            faster method than refitting the model for every fold '''
+        if getattr(self, 'cv', None) is None:
+            raise ValueError(f'cross-validation method '
+                             f'{self.param.getVal("ModelValidationCV")} '
+                             f'not supported by this estimator')
+        return crossval.cross_val_predict(self.estimator, X, Y, self.cv,
+                                          self.ncpu)
+
+    def cached_validation(self, kind, estimator, cv, X, Y, function, *args):
+        ''' returns function(*args), recycling the results stored in the fold
+            cache by a previous build with the same X, Y, estimator and
+            cross-validator '''
+        params = estimator.get_params()
+        # results of unseeded estimators cannot be reproduced
+        if self.fold_cache is None or \
+           ('random_state' in params and params['random_state'] is None):
+            return function(*args)
+
+        params.pop('n_jobs', None)
+        key = fold_cache.signature(
+            kind, type(self).__name__, type(estimator).__name__, params,
+            repr(cv), self.param.getVal('ModelValidationCV'), X, Y)
+        return self.fold_cache.cached(key, function, *args)
+
     def quantitativeValidation(self):
         ''' performs validation for quantitative models '''
 
@@ -532,10 +567,9 @@ class BaseEstimator:
         # Compute Cross-validation quality metrics
         try:
             # Get predicted Y
-            y_pred = cross_val_predict(copy.copy(self.estimator),
-                            copy.copy(X), copy.copy(Y),
-                                cv=self.cv,
-                                    n_jobs=1)
+            y_pred, fold_times = self.cached_validation(
+                'cross_val_predict', self.estimator, getattr(self, 'cv', None),
+                X, Y, self.cross_val_predict, X, Y)
             SSY0_out = np.sum(np.square(Ym - Y))
             SSY_out = np.sum(np.square(Y - y_pred))
             self.scoringP = mean_squared_error(Y, y_pred)
@@ -549,6 +583,7 @@ class BaseEstimator:
             info.append(
                 ('SDEP', 'Standard Deviation Error of the Predictions',
                      self.SDEP))
+            info += crossval.fold_info(fold_times)
 
             # newy.append (
             #     ('Y_adj', 'Recalculated Y values', Yp) )          
@@ -611,9 +646,9 @@ class BaseEstimator:
 
         # Get cross-validated Y 
         try:
-            y_pred = cross_val_predict(self.estimator, X, Y,
-                    cv=self.cv,
-                             n_jobs=-1)
+            y_pred, fold_times = self.cached_validation(
+                'cross_val_predict', self.estimator, getattr(self, 'cv', None),
+                X, Y, self.cross_val_predict, X, Y)
         except Exception as e:
             LOG.error(f'Cross-validation failed with exception' 
                         f'exception {e}')
@@ -667,6 +702,7 @@ class BaseEstimator:
         info.append(
             ('MCC', 'Matthews Correlation Coefficient in cross-validation',
                 self.mcc))
+        info += crossval.fold_info(fold_times)
         info.append (
             ('Y_adj', 'Adjusted Y values', Y) ) 
         info.append (
@@ -715,6 +751,26 @@ class BaseEstimator:
         else:
             metric = make_scorer(mcc)
 
+        # Budgeted search (random or successive halving)
+        tune_method = self.param.getVal('tune_method')
+        if tune_method not in (None, 'grid'):
+            try:
+                search = tuning.Search(estimator, tune_parameters,
+                                       get_scorer(metric),
+                                       method=tune_method, cv=3,
+                                       budget=self.param.getVal('tune_budget'),
+                                       max_time=self.param.getVal('tune_time'),
+                                       ncpu=self.ncpu)
+                search.fit(X, Y)
+                self.estimator = clone(estimator)
+                self.estimator.set_params(**search.best_params_)
+            except Exception as e:
+                LOG.error(f'Error optimizing hyperparameters with'
+                f'exception {e}')
+                raise e
+            LOG.info(f'best parameters: , {search.best_params_}')
+            return
+
         tune_parameters = [tune_parameters]
         # Count computation time
         LOG.debug("Hyperparameter optimization ")
@@ -723,7 +779,7 @@ class BaseEstimator:
         # constant.
         try:
             tclf = GridSearchCV(estimator, tune_parameters,
-                                scoring=metric, cv=3, n_jobs=4)
+                                scoring=metric, cv=3, n_jobs=self.ncpu)
             tclf.fit(X, Y)
             self.estimator = copy.copy(tclf.best_estimator_)
         except Exception as e:
@@ -785,17 +841,51 @@ class BaseEstimator:
                                 'Conformal class assignment',
                                  'main')
 
+        # predictions at other significances, obtained in a single pass
+        levels = self.param.getVal('conformalSignificanceLevels')
+        if not levels:
+            return
+
+        predictions = self.estimator.predict_levels(Xb, levels)
+        for significance, prediction in zip(levels, predictions):
+            if self.param.getVal('quantitative'):
+                conveyor.addVal(prediction[:, 0],
+                                f'lower_limit_{significance:g}',
+                                f'Lower limit ({significance:g})',
+                                'confidence', 'objs',
+                                f'Lower limit of the conformal prediction '
+                                f'at significance {significance:g}')
+                conveyor.addVal(prediction[:, 1],
+                                f'upper_limit_{significance:g}',
+                                f'Upper limit ({significance:g})',
+                                'confidence', 'objs',
+                                f'Upper limit of the conformal prediction '
+                                f'at significance {significance:g}')
+            else:
+                for i in range(prediction.shape[1]):
+                    conveyor.addVal(prediction[:, i].tolist(),
+                                    f'c{i}_{significance:g}',
+                                    f'Class {i} ({significance:g})',
+                                    'confidence', 'objs',
+                                    f'Conformal class assignment at '
+                                    f'significance {significance:g}')
+
     def project(self, Xb, conveyor):
         ''' Uses the X matrix provided as argument to predict Y'''
 
         if self.estimator == None:
             conveyor.setError('failed to load classifier')
             return
+        # packed fingerprints are neither masked nor scaled (see __init__)
+        packed = isinstance(Xb, fingerprints.PackedFingerprints) and \
+            self.accepts_packed()
+        if not packed:
+            Xb = fingerprints.to_dense(Xb)
         # Apply variable mask to prediction vector/matrix
-        if self.param.getVal("feature_selection"):
+        if self.param.getVal("feature_selection") and not packed:
             Xb = Xb[:, self.variable_mask]
         # Scale prediction vector/matrix
-        if self.param.getVal('modelAutoscaling'):
+        if self.param.getVal('modelAutoscaling') and not packed:
             # Xb = Xb-self.mux
             # Xb = Xb*self.wgx
             Xb = self.scaler.transform(Xb)
@@ -806,33 +896,40 @@ class BaseEstimator:
             self.conformalProject(Xb, conveyor)
     
     def save_model(self):
-        ''' This function saves estimator and scaler in a pickle file '''
+        ''' This function saves estimator and scaler in the estimator
+            directory, with the large arrays in memory-mapped files '''
 
         # This dictionary contain all the objects which will be needed
         # for prediction
         dict_estimator = {'estimator' : self.estimator,\
                             'scaler' : self.scaler,\
                             'variable_mask' : self.variable_mask,\
-                            'version' : 1}
+                            'version' : persistence.FORMAT_VERSION}
 
-        model_pkl_path = os.path.join(self.param.getVal('model_path'),
-                                      'estimator.pkl')
-        
-        with open(model_pkl_path, 'wb') as handle:
-            pickle.dump(dict_estimator, handle, 
-                        protocol=pickle.HIGHEST_PROTOCOL)
-        LOG.debug('Model saved as:{}'.format(model_pkl_path))
+        model_path = self.param.getVal('model_path')
+        model_dir = os.path.join(model_path, 'estimator')
+        persistence.save(dict_estimator, model_dir)
+
+        # remove the estimator saved in the previous format
+        model_pkl_path = os.path.join(model_path, 'estimator.pkl')
+        if os.path.isfile(model_pkl_path):
+            os.remove(model_pkl_path)
+        LOG.debug('Model saved as:{}'.format(model_dir))
 
         return
 
     def load_model(self):
-        ''' This function loads estimator and scaler in a pickle file '''
-
-        model_file = os.path.join(self.param.getVal('model_path'),'estimator.pkl')
-        LOG.debug(f'Loading model from pickle file, path: {model_file}')
+        ''' This function loads estimator and scaler from the estimator
+            directory or, for models built with older versions, from a
+            pickle file '''
+
+        model_file = os.path.join(self.param.getVal('model_path'),
+                                  'estimator')
+        if not os.path.isdir(model_file):
+            model_file += '.pkl'
+        LOG.debug(f'Loading model from: {model_file}')
         try:
-            with open(model_file, "rb") as input_file:
-                dict_estimator = pickle.load(input_file)
+            dict_estimator = estimator_cache.load(model_file)
         except FileNotFoundError:
             LOG.error(f'No valid model estimator found at: {model_file}')
             raise FileNotFoundError
@@ -841,8 +938,8 @@ class BaseEstimator:
         self.version = dict_estimator['version']
 
         # check if the pickle was created with a compatible version
-        # currently 1
-        if self.version is not 1:
+        # 1 (single pickle) or 2 (see persistence)
+        if self.version not in (1, persistence.FORMAT_VERSION):
             raise Exception ('Incompatible model version')
 
         self.estimator = dict_estimator['estimator']
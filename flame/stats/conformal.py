@@ -0,0 +1,354 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame aggregated conformal predictor
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2018 Manuel Pastor
+#
+# This file is part of Flame
+#
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Aggregated conformal predictor, equivalent to nonconformist AggregatedCp
+with BootstrapSampler, IcpRegressor (absolute error, optionally normalized)
+and IcpClassifier (margin error).
+
+The inductive conformal predictors (members) are fitted in parallel in the
+shared process pool. Every member stores only its fitted estimators and
+the sorted nonconformity scores of its calibration objects, as float32,
+so the p-values and intervals of a batch of objects are obtained with a
+single np.searchsorted per member.
+'''
+
+import time
+
+import numpy as np
+from sklearn.base import clone
+
+from flame.chem import fingerprints
+from flame.util import pool, get_logger
+
+LOG = get_logger(__name__)
+
+
+def _clone(estimator):
+    ''' returns an unfitted copy of the estimator, using a single thread
+        since the members are already fitted in parallel '''
+    estimator = clone(estimator)
+    try:
+        if 'n_jobs' in estimator.get_params():
+            estimator.set_params(n_jobs=1)
+    except Exception:
+        pass
+    return estimator
+
+
+def _matrix(X):
+    ''' X as a numpy array, keeping packed fingerprints packed '''
+    if isinstance(X, fingerprints.PackedFingerprints):
+        return X
+    return np.asarray(X)
+
+
+def margin_scores(proba, classes, labels) -> np.ndarray:
+    ''' margin nonconformity of the objects for the labels given, using
+        the class probabilities of the estimator, fitted with classes '''
+    rows = np.arange(len(proba))
+    column = np.minimum(np.searchsorted(classes, labels), len(classes) - 1)
+    # labels not present in the training objects have probability 0
+    known = classes[column] == labels
+    prob = np.where(known, proba[rows, column], 0.0)
+    others = proba.copy()
+    others[rows[known], column[known]] = -np.inf
+    return 0.5 - (prob - others.max(axis=1)) / 2
+
+
+def errors(scores, significances) -> np.ndarray:
+    ''' calibration scores (sorted) bordering every significance, which are
+        the unnormalized half widths of the prediction intervals '''
+    ncal = len(scores)
+    # same border as nonconformist AbsErrorErrFunc.apply_inverse, which
+    # uses the scores sorted in decreasing order
+    border = np.floor(np.asarray(significances, dtype=float) *
+                      (ncal + 1)).astype(int) - 1
+    border = np.clip(border, 0, ncal - 1)
+    return scores[ncal - 1 - border].astype(np.float64)
+
+
+class ConformalMember:
+    '''
+    Inductive conformal predictor, fitted with a bootstrap sample of the
+    training objects and calibrated with the objects not sampled
+    '''
+
+    def __init__(self, estimator, quantitative, normalized=False):
+        self.estimator = _clone(estimator)
+        self.quantitative = quantitative
+        self.normalizer = _clone(estimator) if normalized else None
+        self.scores = None
+
+    def fit(self, X, Y, train, calibration):
+        ''' fits the estimator (and normalizer) with the train objects and
+            stores the sorted nonconformity scores of the calibration ones '''
+        self.estimator.fit(X[train], Y[train])
+
+        if self.normalizer is not None:
+            error = np.abs(self.estimator.predict(X[train]) - Y[train])
+            # small term added to avoid log(0), as nonconformist
+            self.normalizer.fit(X[train], np.log(error + 0.00001))
+
+        Xc = X[calibration]
+        Yc = Y[calibration]
+        if self.quantitative:
+            scores = np.abs(self.estimator.predict(Xc) - Yc) / self.norm(Xc)
+        else:
+            self.classes = np.unique(Y)
+            scores = margin_scores(self.estimator.predict_proba(Xc),
+                                   self.estimator.classes_, Yc)
+
+        self.scores = np.sort(scores).astype(np.float32)
+
+    def norm(self, X) -> np.ndarray:
+        ''' normalization of the nonconformity of the objects '''
+        if self.normalizer is None:
+            return np.ones(len(X))
+        return np.exp(self.normalizer.predict(X))
+
+    def interval(self, X, significance) -> np.ndarray:
+        ''' prediction intervals of the objects at the given significance '''
+        error = errors(self.scores, [significance])[0] * self.norm(X)
+
+        prediction = self.estimator.predict(X)
+        return np.column_stack((prediction - error, prediction + error))
+
+    def pvalues(self, X, rng=None) -> np.ndarray:
+        ''' p-values of the objects for every class. When a random generator
+            is given, the ties are smoothed as in nonconformist '''
+        proba = self.estimator.predict_proba(X)
+        ncal = len(self.scores)
+
+        p = np.zeros((len(X), len(self.classes)))
+        for i, label in enumerate(self.classes):
+            scores = margin_scores(proba, self.estimator.classes_,
+                                   np.full(len(X), label)).astype(np.float32)
+            left = np.searchsorted(self.scores, scores, 'left')
+            right = np.searchsorted(self.scores, scores, 'right')
+            ties = right - left + 1
+            if rng is not None:
+                ties = ties * rng.uniform(0, 1, len(X))
+            p[:, i] = (ncal - right + ties) / (ncal + 1)
+
+        return p
+
+
+def _fit_members(task) -> list:
+    ''' fits the members of a chunk, returning them with their fit time '''
+    estimator, quantitative, normalized, X, Y, members = task
+
+    results = []
+    for index, train, seed in members:
+        # bootstrap sample of the training objects, the objects not
+        # selected are used for calibration
+        rng = np.random.RandomState(seed)
+        sample = rng.choice(len(train), len(train), replace=True)
+        calibration = np.ones(len(train), dtype=bool)
+        calibration[sample] = False
+
+        start = time.perf_counter()
+        member = ConformalMember(estimator, quantitative, normalized)
+        member.fit(X, Y, train[sample], train[calibration])
+        results.append((index, member, time.perf_counter() - start))
+
+    return results
+
+
+def fit_members(estimator, quantitative, X, Y, trains, n_models=10,
+                normalized=False, ncpu=1, random_state=46) -> tuple:
+    '''
+    Fits n_models members for every array of training objects indexes in
+    trains, using up to ncpu processes
+
+    Returns a list with the members of every array and the total fitting
+    time of each one
+    '''
+    rng = np.random.RandomState(random_state)
+    members = [((itrain, imember), train, seed)
+               for itrain, train in enumerate(trains)
+               for imember, seed in enumerate(
+                   rng.randint(np.iinfo(np.int32).max, size=n_models))]
+
+    nchunks = max(1, min(ncpu, len(members)))
+    tasks = [(estimator, quantitative, normalized, X, Y, members[i::nchunks])
+             for i in range(nchunks)]
+
+    fitted = [[None] * n_models for train in trains]
+    fit_times = np.zeros(len(trains))
+    for results in pool.imap(_fit_members, tasks, nchunks):
+        for (itrain, imember), member, fit_time in results:
+            fitted[itrain][imember] = member
+            fit_times[itrain] += fit_time
+
+    return fitted, fit_times
+
+
+def aggregate(members, X, significance, quantitative, random_state=46):
+    ''' aggregated prediction of the members, averaging their intervals
+        (quantitative) or p-values (qualitative) as AggregatedCp '''
+    if quantitative:
+        return np.mean([m.interval(X, significance) for m in members],
+                       axis=0)
+
+    rng = np.random.RandomState(random_state)
+    pvalues = np.mean([m.pvalues(X, rng) for m in members], axis=0)
+    if significance is None:
+        return pvalues
+    return pvalues >= significance
+
+
+def aggregate_levels(members, X, significances, quantitative,
+                     random_state=46) -> np.ndarray:
+    '''
+    Aggregated prediction of the members at every significance, predicting
+    the objects only once
+
+    Returns an array with the intervals (quantitative) or the boolean
+    matrix of predicted classes (qualitative) for every significance
+    '''
+    significances = np.asarray(significances, dtype=float)
+    if quantitative:
+        intervals = np.zeros((len(significances), len(X), 2))
+        for member in members:
+            prediction = member.estimator.predict(X)
+            error = np.outer(errors(member.scores, significances),
+                             member.norm(X))
+            intervals[:, :, 0] += prediction - error
+            intervals[:, :, 1] += prediction + error
+        return intervals / len(members)
+
+    pvalues = aggregate(members, X, None, False, random_state)
+    return pvalues[np.newaxis] >= significances[:, np.newaxis, np.newaxis]
+
+
+def oof_levels(oof, significances) -> np.ndarray:
+    '''
+    Cross-validation predictions at every significance, obtained from the
+    out-of-fold record of the validation (see crossval.conformal_oof)
+    without refitting the models. Returns the same array as
+    aggregate_levels
+    '''
+    significances = np.asarray(significances, dtype=float)
+    if 'pvalues' in oof:
+        return oof['pvalues'][np.newaxis] >= \
+               significances[:, np.newaxis, np.newaxis]
+
+    prediction = oof['prediction']
+    intervals = np.zeros((len(significances), len(prediction), 2))
+    for ifold, members in enumerate(oof['scores']):
+        rows = oof['fold'] == ifold
+        for imember, scores in enumerate(members):
+            error = np.outer(errors(scores, significances),
+                             oof['norm'][rows, imember])
+            intervals[:, rows, 0] += prediction[rows, imember] - error
+            intervals[:, rows, 1] += prediction[rows, imember] + error
+
+    return intervals / prediction.shape[1]
+
+
+def oof_quality(oof, significances) -> list:
+    '''
+    Quality of the cross-validation predictions at every significance,
+    as model_valid_info items
+    '''
+    Y = oof['Y']
+    info = []
+    for significance, prediction in zip(significances,
+                                        oof_levels(oof, significances)):
+        if 'pvalues' in oof:
+            # only the objects assigned to a single class are predicted
+            single = prediction.sum(axis=1) == 1
+            correct = single & prediction[np.arange(len(Y)),
+                                          np.searchsorted(oof['classes'], Y)]
+            coverage = float(np.mean(single))
+            accuracy = float(np.sum(correct) / max(np.sum(single), 1))
+            info.append((f'Conformal_coverage_{significance:g}',
+                         f'Conformal coverage at significance '
+                         f'{significance:g}', coverage))
+        else:
+            inside = (prediction[:, 0] < Y) & (prediction[:, 1] > Y)
+            accuracy = float(np.mean(inside))
+            info.append((f'Conformal_mean_interval_{significance:g}',
+                         f'Conformal mean interval at significance '
+                         f'{significance:g}',
+                         float(np.mean(prediction[:, 1] - prediction[:, 0]))))
+
+        info.append((f'Conformal_accuracy_{significance:g}',
+                     f'Conformal accuracy at significance {significance:g}',
+                     accuracy))
+
+    return info
+
+
+class AggregatedConformal:
+    '''
+    Aggregated conformal predictor of a scikit-learn estimator
+
+    Parameters
+    ----------
+    estimator : unfitted or fitted estimator, cloned for every member
+    quantitative : build a regressor (True) or a classifier (False)
+    n_models : number of members
+    normalized : normalize the nonconformity of regressors with a model of
+        the log residuals, of the same type as the estimator
+    ncpu : max number of processes used for fitting the members
+    '''
+
+    def __init__(self, estimator, quantitative, n_models=10,
+                 normalized=False, ncpu=1, random_state=46):
+        self.estimator = estimator
+        self.quantitative = quantitative
+        self.n_models = n_models
+        self.normalized = normalized
+        self.ncpu = ncpu
+        self.random_state = random_state
+        self.members = []
+
+    def fit(self, X, Y):
+        X = _matrix(X)
+        Y = np.asarray(Y)
+        fitted, fit_times = fit_members(
+            self.estimator, self.quantitative, X, Y, [np.arange(len(Y))],
+            self.n_models, self.normalized, self.ncpu, self.random_state)
+        self.members = fitted[0]
+        if not self.quantitative:
+            self.classes = self.members[0].classes
+
+        LOG.debug(f'{self.n_models} conformal members fitted in '
+                  f'{fit_times[0]:.2f} s')
+        return self
+
+    def predict(self, X, significance=None):
+        '''
+        Returns the prediction intervals (quantitative) or a boolean matrix
+        with the classes predicted for every object (qualitative). For
+        qualitative models, the p-values are returned when significance is
+        None
+        '''
+        return aggregate(self.members, _matrix(X), significance,
+                         self.quantitative, self.random_state)
+
+    def predict_levels(self, X, significances):
+        ''' predictions at every significance (see aggregate_levels) '''
+        return aggregate_levels(self.members, _matrix(X), significances,
+                                self.quantitative, self.random_state)
@@ -0,0 +1,406 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame parallel cross-validation engine
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2018 Manuel Pastor
+#
+# This file is part of Flame
+#
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Cross-validation engine used by the model validation and optimization
+methods.
+
+The folds are fitted in parallel in the shared process pool (see
+flame.util.pool), using no more than the CPUs allowed by the numCPUs
+parameter. The folds are distributed among the processes in chunks, so
+the X and Y matrices are sent to every process only once.
+'''
+
+import copy
+import time
+
+import numpy as np
+from sklearn.base import clone
+
+from flame.util import pool, get_logger
+from flame.stats import conformal
+
+LOG = get_logger(__name__)
+
+
+def cpu_budget(param) -> int:
+    ''' returns the number of CPUs that can be used by the model building
+        tasks, as defined by the numCPUs parameter '''
+    ncpu = param.getVal('numCPUs')
+    try:
+        ncpu = int(ncpu)
+    except (TypeError, ValueError):
+        return 1
+
+    return max(1, min(ncpu, pool.cpu_count()))
+
+
+def clone_estimator(estimator):
+    ''' returns an unfitted copy of the estimator '''
+    try:
+        return clone(estimator)
+    except Exception:
+        return copy.deepcopy(estimator)
+
+
+def _single_threaded(estimator):
+    ''' avoids using several threads per estimator when the folds are
+        already run in parallel '''
+    try:
+        if 'n_jobs' in estimator.get_params():
+            estimator = clone_estimator(estimator)
+            estimator.set_params(n_jobs=1)
+    except Exception:
+        pass
+    return estimator
+
+
+def _fit_folds(task) -> list:
+    ''' fits the estimator for a chunk of folds, returning the predictions
+        of the test objects and the fit and prediction times '''
+    estimator, X, Y, folds, method = task
+
+    results = []
+    for ifold, train, test in folds:
+        fold_estimator = clone_estimator(estimator)
+
+        start = time.perf_counter()
+        fold_estimator.fit(X[train], Y[train])
+        fit_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        prediction = getattr(fold_estimator, method)(X[test])
+        predict_time = time.perf_counter() - start
+
+        results.append((ifold, test, np.asarray(prediction),
+                        fit_time, predict_time))
+
+    return results
+
+
+def cross_val_predict(estimator, X, Y, cv, ncpu=1, method='predict'):
+    '''
+    Equivalent to sklearn cross_val_predict, running the folds defined by
+    the cross-validator cv in up to ncpu processes
+
+    Returns the predictions for every object and an array with the fit
+    and prediction times of every fold (in seconds)
+    '''
+    folds = [(ifold, train, test) for ifold, (train, test)
+             in enumerate(cv.split(X, Y))]
+
+    nchunks = max(1, min(ncpu, len(folds)))
+    if nchunks > 1:
+        estimator = _single_threaded(estimator)
+
+    tasks = [(estimator, X, Y, folds[i::nchunks], method)
+             for i in range(nchunks)]
+
+    y_pred = None
+    predicted = np.zeros(len(Y), dtype=bool)
+    fold_times = np.zeros((len(folds), 2))
+
+    for results in pool.imap(_fit_folds, tasks, nchunks):
+        for ifold, test, prediction, fit_time, predict_time in results:
+            if y_pred is None:
+                y_pred = np.zeros((len(Y),) + prediction.shape[1:],
+                                  dtype=prediction.dtype)
+            y_pred[test] = prediction
+            predicted[test] = True
+            fold_times[ifold] = fit_time, predict_time
+
+    if not np.all(predicted):
+        raise ValueError('cross_val_predict only works for partitions')
+
+    LOG.debug(f'{len(folds)} folds cross-validated using {nchunks} CPUs in '
+              f'{np.sum(fold_times):.2f} s')
+
+    return y_pred, fold_times
+
+
+def fold_info(fold_times) -> list:
+    ''' returns model_valid_info items describing the fold times '''
+    return [('CV_folds', 'Number of cross-validation folds',
+             len(fold_times)),
+            ('CV_fit_time', 'Total fitting time in cross-validation (s)',
+             float(np.sum(fold_times[:, 0]))),
+            ('CV_fold_times', 'Fit and prediction time of every '
+             'cross-validation fold (s)', fold_times)]
+
+
+def _pls_kernel(XtX, Xty, ncomp) -> np.ndarray:
+    '''
+    PLS1 kernel algorithm (Dayal & MacGregor, 1997) using the cross
+    products of the centered (and scaled) X and y
+
+    Returns a matrix with the regression coefficients of the models with
+    1 to ncomp components in its columns
+    '''
+    nvar = len(Xty)
+    R = np.zeros((nvar, ncomp))
+    P = np.zeros((nvar, ncomp))
+    B = np.zeros((nvar, ncomp))
+    Xty = Xty.copy()
+    coef = np.zeros(nvar)
+
+    for a in range(ncomp):
+        norm = np.linalg.norm(Xty)
+        if norm > 0:
+            w = Xty / norm
+            r = w - R[:, :a] @ (P[:, :a].T @ w)
+            tt = r @ XtX @ r
+            if tt > 0:
+                R[:, a] = r
+                P[:, a] = XtX @ r / tt
+                q = (r @ Xty) / tt
+                Xty -= P[:, a] * q * tt
+                coef = coef + r * q
+        B[:, a] = coef
+
+    return B
+
+
+def _pls_nipals(X, y, ncomp) -> np.ndarray:
+    '''
+    PLS1 NIPALS algorithm for centered (and scaled) X and y, more efficient
+    than the kernel algorithm when there are more variables than objects
+
+    Returns the same matrix of coefficients as _pls_kernel
+    '''
+    nvar = X.shape[1]
+    W = np.zeros((nvar, ncomp))
+    P = np.zeros((nvar, ncomp))
+    q = np.zeros(ncomp)
+    X = X.copy()
+
+    a = 0
+    for a in range(ncomp):
+        w = X.T @ y
+        norm = np.linalg.norm(w)
+        if norm == 0:
+            break
+        w /= norm
+        t = X @ w
+        tt = t @ t
+        if tt == 0:
+            break
+        W[:, a] = w
+        P[:, a] = X.T @ t / tt
+        q[a] = (y @ t) / tt
+        X -= np.outer(t, P[:, a])
+    else:
+        a = ncomp
+
+    # the first a columns of the weights W(P'W)^-1 do not depend on
+    # the following components, since P'W is upper triangular
+    B = np.zeros((nvar, ncomp))
+    if a > 0:
+        R = W[:, :a] @ np.linalg.inv(P[:, :a].T @ W[:, :a])
+        B[:, :a] = np.cumsum(R * q[:a], axis=1)
+        B[:, a:] = B[:, [a-1]]
+
+    return B
+
+
+def _center_scale(mean, var, scale):
+    ''' returns the std used to scale the variables, as sklearn PLS '''
+    if not scale:
+        return np.ones_like(mean)
+    std = np.sqrt(np.maximum(var, 0))
+    std[std == 0] = 1.0
+    return std
+
+
+def pls_cross_val_predict(X, Y, cv, n_components: list, scale=False):
+    '''
+    Cross-validated predictions of PLS regression models (equivalent to
+    sklearn PLSRegression) with every number of components listed in
+    n_components, fitting a single model per fold
+
+    When there are more objects than variables, the cross products of the
+    training objects are obtained by removing the test objects from the
+    cross products of the whole series (downdating), which avoids
+    processing the whole matrix for every fold (e.g. in leave-one-out)
+
+    Returns a dictionary with the predictions for every number of
+    components and an array with the fit and prediction times of every fold
+    '''
+    # centered with the mean of the whole series, to reduce the round off
+    # errors of the downdated cross products
+    X = np.asarray(X, dtype=np.float64)
+    X = X - X.mean(axis=0)
+    y = np.asarray(Y, dtype=np.float64).ravel()
+    offset_y = y.mean()
+    y = y - offset_y
+    nobj, nvar = X.shape
+
+    ncomp = max(n_components)
+    downdate = nobj > nvar
+
+    if downdate:
+        sum_x = X.sum(axis=0)
+        sum_y = y.sum()
+        XtX = X.T @ X
+        Xty = X.T @ y
+
+    folds = list(cv.split(X, y))
+    y_pred = np.zeros((nobj, ncomp))
+    predicted = np.zeros(nobj, dtype=bool)
+    fold_times = np.zeros((len(folds), 2))
+
+    for ifold, (train, test) in enumerate(folds):
+        start = time.perf_counter()
+        ntrain = len(train)
+        if downdate:
+            Xtest = X[test]
+            ytest = y[test]
+            mean_x = (sum_x - Xtest.sum(axis=0)) / ntrain
+            mean_y = (sum_y - ytest.sum()) / ntrain
+            C = XtX - Xtest.T @ Xtest - ntrain * np.outer(mean_x, mean_x)
+            c = Xty - Xtest.T @ ytest - ntrain * mean_x * mean_y
+            std_x = _center_scale(mean_x, np.diag(C) / (ntrain - 1), scale)
+            B = _pls_kernel(C / np.outer(std_x, std_x), c / std_x, ncomp)
+        else:
+            Xtrain = X[train]
+            ytrain = y[train]
+            mean_x = Xtrain.mean(axis=0)
+            mean_y = ytrain.mean()
+            std_x = _center_scale(mean_x, Xtrain.var(axis=0, ddof=1), scale)
+            B = _pls_nipals((Xtrain - mean_x) / std_x, ytrain - mean_y,
+                            ncomp)
+        fit_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        y_pred[test] = ((X[test] - mean_x) / std_x) @ B + mean_y
+        predicted[test] = True
+        fold_times[ifold] = fit_time, time.perf_counter() - start
+
+    if not np.all(predicted):
+        raise ValueError('cross_val_predict only works for partitions')
+
+    y_pred += offset_y
+
+    return {n: y_pred[:, n-1] for n in n_components}, fold_times
+
+
+def conformal_fit_folds(estimator, quantitative, X, Y, cv, ncpu=1,
+                        n_models=10, random_state=46) -> tuple:
+    '''
+    Fits the members of the aggregated conformal predictor (see
+    flame.stats.conformal) of every fold defined by cv, in parallel in up
+    to ncpu processes
+
+    Returns the list of (train, test) folds, the members of every fold and
+    their fitting times. They do not depend on the significance, so they
+    can be reused by conformal_aggregate_folds with any significance
+    '''
+    folds = list(cv.split(X, Y))
+    members, fit_times = conformal.fit_members(
+        estimator, quantitative, X, Y, [train for train, test in folds],
+        n_models, ncpu=ncpu, random_state=random_state)
+
+    return folds, members, fit_times
+
+
+def conformal_aggregate_folds(fitted, quantitative, X, Y, significance,
+                              random_state=46):
+    '''
+    Predicts the test objects of every fold with the members returned by
+    conformal_fit_folds
+
+    Returns the prediction intervals (quantitative) or the boolean matrix of
+    predicted classes (qualitative) for every object and an array with the
+    fit and prediction times of every fold (in seconds)
+    '''
+    folds, members, fit_times = fitted
+
+    y_pred = None
+    fold_times = np.zeros((len(folds), 2))
+    for ifold, (train, test) in enumerate(folds):
+        start = time.perf_counter()
+        prediction = conformal.aggregate(members[ifold], X[test],
+                                         significance, quantitative,
+                                         random_state)
+        fold_times[ifold] = fit_times[ifold], time.perf_counter() - start
+
+        if y_pred is None:
+            y_pred = np.zeros((len(Y),) + prediction.shape[1:],
+                              dtype=prediction.dtype)
+        y_pred[test] = prediction
+
+    LOG.debug(f'{len(folds)} conformal folds of {len(members[0])} models '
+              f'cross-validated in {np.sum(fold_times):.2f} s')
+
+    return y_pred, fold_times
+
+
+def conformal_oof(fitted, quantitative, X, Y, random_state=46) -> dict:
+    '''
+    Out-of-fold record of the members returned by conformal_fit_folds,
+    from which the cross-validation predictions at any significance are
+    obtained without refitting (see conformal.oof_levels)
+
+    Quantitative models keep the prediction and normalization of every
+    member for the test objects and the calibration scores of the members.
+    Qualitative models keep the aggregated p-values of every class
+    '''
+    folds, members, fit_times = fitted
+
+    fold = np.zeros(len(Y), dtype=int)
+    oof = {'Y': np.asarray(Y), 'fold': fold}
+    if quantitative:
+        oof['prediction'] = np.zeros((len(Y), len(members[0])))
+        oof['norm'] = np.zeros((len(Y), len(members[0])))
+        oof['scores'] = [[m.scores for m in fold_members]
+                         for fold_members in members]
+    else:
+        oof['pvalues'] = np.zeros((len(Y), len(members[0][0].classes)))
+        oof['classes'] = members[0][0].classes
+
+    for ifold, (train, test) in enumerate(folds):
+        fold[test] = ifold
+        if quantitative:
+            for imember, member in enumerate(members[ifold]):
+                oof['prediction'][test, imember] = \
+                    member.estimator.predict(X[test])
+                oof['norm'][test, imember] = member.norm(X[test])
+        else:
+            oof['pvalues'][test] = conformal.aggregate(
+                members[ifold], X[test], None, False, random_state)
+
+    return oof
+
+
+def conformal_cross_val_predict(estimator, quantitative, X, Y, cv,
+                                significance, ncpu=1, n_models=10,
+                                random_state=46):
+    '''
+    Cross-validated predictions of the aggregated conformal predictor of
+    the estimator given as argument, fitting the members of all the folds
+    in parallel in up to ncpu processes
+
+    Returns the same results as conformal_aggregate_folds
+    '''
+    fitted = conformal_fit_folds(estimator, quantitative, X, Y, cv, ncpu,
+                                 n_models, random_state)
+    return conformal_aggregate_folds(fitted, quantitative, X, Y,
+                                     significance, random_state)
@@ -0,0 +1,102 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame cache of loaded model estimators
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2018 Manuel Pastor
+#
+# This file is part of Flame
+#
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+In-process cache of the estimator pickles (estimator, scaler and variable
+mask) used by base_model.load_model.
+
+The cache is disabled by default (size 0), since a single prediction loads
+every estimator only once. Long running processes, like the model server,
+can enable it with set_size to avoid unpickling the estimators for every
+prediction. The least recently used estimators are removed when the number
+of cached estimators exceeds the size.
+
+The entries are identified by the path of the pickle file (or of the
+estimator directory, see flame.stats.persistence), and reloaded when the
+file is modified (e.g. when the model is rebuilt).
+'''
+
+import os
+import pickle
+import threading
+import collections
+
+from flame.util import get_logger
+from flame.stats import persistence
+
+LOG = get_logger(__name__)
+
+_cache = collections.OrderedDict()
+_max_size = 0
+_lock = threading.Lock()
+
+
+def set_size(size: int) -> None:
+    ''' sets the max number of estimators kept in the cache '''
+    global _max_size
+    with _lock:
+        _max_size = size
+        _evict()
+
+
+def clear() -> None:
+    with _lock:
+        _cache.clear()
+
+
+def _evict() -> None:
+    while len(_cache) > _max_size:
+        model_file, _ = _cache.popitem(last=False)
+        LOG.debug(f'Estimator {model_file} removed from cache')
+
+
+def load(model_file: str) -> dict:
+    '''
+    Returns the dictionary stored in the estimator pickle or directory
+    model_file, from the cache when possible. Raises FileNotFoundError if
+    the file does not exist
+    '''
+    directory = os.path.isdir(model_file)
+    if directory:
+        stat = os.stat(os.path.join(model_file, persistence.PICKLE_FILE))
+    else:
+        stat = os.stat(model_file)
+    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    with _lock:
+        if model_file in _cache and _cache[model_file][0] == stamp:
+            _cache.move_to_end(model_file)
+            return _cache[model_file][1]
+
+    if directory:
+        dict_estimator = persistence.load(model_file)
+    else:
+        with open(model_file, 'rb') as input_file:
+            dict_estimator = pickle.load(input_file)
+
+    with _lock:
+        if _max_size > 0:
+            _cache[model_file] = (stamp, dict_estimator)
+            _cache.move_to_end(model_file)
+            _evict()
+
+    return dict_estimator
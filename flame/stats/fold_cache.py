@@ -0,0 +1,134 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame cache of cross-validation results
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2018 Manuel Pastor
+#
+# This file is part of Flame
+#
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Persistent cache of the cross-validation results of a model (out-of-fold
+predictions, or the fitted members of the conformal folds), stored in the
+model directory.
+
+Every entry is identified by a hash of everything the results depend on:
+the X and Y matrices, the estimator type and parameters and the
+cross-validation splitter. A model rebuilt with the same data and learning
+parameters (e.g. after changing only output parameters) reuses them
+instead of fitting every fold again.
+
+Errors accessing the cache are logged and reported as cache misses.
+'''
+
+import os
+import json
+import pickle
+import hashlib
+
+import numpy as np
+import sklearn
+
+from flame.chem import fingerprints
+from flame.util import get_logger
+
+LOG = get_logger(__name__)
+
+# increase when the format of the stored results changes
+CACHE_FORMAT = 1
+
+CACHE_DIR = 'fold_cache'
+
+# max number of entries kept for every model
+MAX_ENTRIES = 8
+
+
+def signature(*items) -> str:
+    ''' returns a hash of the items, which can be numpy arrays or any
+        object with a stable string representation '''
+    md5 = hashlib.md5()
+    md5.update(f'{CACHE_FORMAT} {sklearn.__version__}'.encode())
+    for item in items:
+        if isinstance(item, fingerprints.PackedFingerprints):
+            md5.update(f'packed {item.nbits}'.encode())
+            item = item.words
+        if isinstance(item, np.ndarray):
+            item = np.ascontiguousarray(item)
+            md5.update(f'{item.dtype.str} {item.shape}'.encode())
+            md5.update(item.tobytes())
+        else:
+            md5.update(json.dumps(item, sort_keys=True,
+                                  default=repr).encode())
+    return md5.hexdigest()
+
+
+class FoldCache:
+    '''
+    Cross-validation results saved as pickle files in path. The least
+    recently used files are removed when there are more than max_entries
+    '''
+
+    def __init__(self, path: str, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + '.pkl')
+
+    def get(self, key: str):
+        ''' returns the results stored for key or None if not found '''
+        cache_file = self._file(key)
+        if not os.path.isfile(cache_file):
+            return None
+
+        try:
+            with open(cache_file, 'rb') as handle:
+                results = pickle.load(handle)
+            # the access time is not reliable in all file systems
+            os.utime(cache_file)
+        except Exception as e:
+            LOG.warning(f'Unable to read fold cache {cache_file}: {e}')
+            return None
+
+        LOG.info('Cross-validation results recycled from the fold cache')
+        return results
+
+    def put(self, key: str, results) -> None:
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_file = self._file(key) + '.tmp'
+            with open(tmp_file, 'wb') as handle:
+                pickle.dump(results, handle,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self._file(key))
+            self._evict()
+        except Exception as e:
+            LOG.warning(f'Unable to write fold cache {self.path}: {e}')
+
+    def _evict(self) -> None:
+        files = [os.path.join(self.path, f) for f in os.listdir(self.path)
+                 if f.endswith('.pkl')]
+        files.sort(key=os.path.getmtime)
+        for cache_file in files[:max(0, len(files) - self.max_entries)]:
+            os.remove(cache_file)
+
+    def cached(self, key: str, function, *args):
+        ''' returns the results of function(*args), stored under key '''
+        results = self.get(key)
+        if results is None:
+            results = function(*args)
+            self.put(key, results)
+        return results
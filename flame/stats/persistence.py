@@ -0,0 +1,180 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame memory-mapped estimator persistence
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2018 Manuel Pastor
+#
+# This file is part of Flame
+#
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+On-disk format of the model estimators (version 2), used by
+BaseEstimator.save_model and load_model.
+
+The estimator is stored in a directory containing a pickle (estimator.pkl)
+and a .npy file for every large numeric array (e.g. support vectors, PLS
+loadings or training matrices), which are referenced from the pickle. On load,
+the arrays are memory-mapped (copy-on-write), so loading is almost
+immediate and the processes using the same model share the pages of the
+arrays in the OS page cache.
+
+The arrays of sklearn trees are kept in the pickle, since the trees copy
+them when they are unpickled and memory-mapping them would only add the
+cost of opening a file per array.
+
+Every save writes a new data directory (e.g. estimator-<hex>) and then
+replaces atomically a relative symbolic link (estimator) pointing to it, so
+readers always find a complete estimator. load resolves the link once, so
+it never mixes the files of two saves. Where symbolic links cannot be
+created, the old directory is renamed aside, the new one renamed in its
+place and the old one deleted, leaving a short window without directory.
+'''
+
+import os
+import uuid
+import pickle
+import shutil
+
+import numpy as np
+from sklearn.tree._tree import Tree
+
+from flame.util import get_logger
+
+LOG = get_logger(__name__)
+
+FORMAT_VERSION = 2
+
+PICKLE_FILE = 'estimator.pkl'
+
+# arrays smaller than this are stored in the pickle
+MIN_BYTES = 65536
+
+
+class _ArrayPickler(pickle.Pickler):
+    ''' pickler storing large numeric arrays in separate .npy files '''
+
+    def __init__(self, handle, path):
+        super().__init__(handle, protocol=pickle.HIGHEST_PROTOCOL)
+        self.path = path
+        self.narrays = 0
+        # arrays stored in the pickle, kept alive so their ids are unique
+        self.inline = {}
+
+    def reducer_override(self, obj):
+        if type(obj) is not Tree:
+            return NotImplemented
+
+        reduced = obj.__reduce__()
+        for value in reduced[2].values():
+            if isinstance(value, np.ndarray):
+                self.inline[id(value)] = value
+        return reduced
+
+    def persistent_id(self, obj):
+        if type(obj) is not np.ndarray and not isinstance(obj, np.memmap):
+            return None
+        if obj.dtype.hasobject or obj.nbytes < MIN_BYTES or \
+           id(obj) in self.inline:
+            return None
+
+        name = f'{self.narrays:06d}.npy'
+        np.save(os.path.join(self.path, name), obj, allow_pickle=False)
+        self.narrays += 1
+        return name
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    ''' unpickler memory-mapping the arrays stored by _ArrayPickler '''
+
+    def __init__(self, handle, path, mmap_mode):
+        super().__init__(handle)
+        self.path = path
+        self.mmap_mode = mmap_mode
+
+    def persistent_load(self, name):
+        return np.load(os.path.join(self.path, name),
+                       mmap_mode=self.mmap_mode, allow_pickle=False)
+
+
+def _swap_link(data_path: str, path: str) -> None:
+    ''' points the symbolic link path to data_path, replacing it
+        atomically '''
+    link_path = path + '.link'
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.basename(data_path), link_path)
+
+    # directories saved by previous versions cannot be replaced by a link
+    if os.path.isdir(path) and not os.path.islink(path):
+        os.rename(path, path + '.old')
+
+    os.replace(link_path, path)
+
+
+def _swap_rename(data_path: str, path: str) -> None:
+    ''' replaces the directory path by data_path, without links '''
+    if os.path.lexists(path):
+        os.rename(path, path + '.old')
+    os.rename(data_path, path)
+
+
+def save(obj, path: str) -> int:
+    '''
+    Stores obj in the directory path, replacing its previous content.
+    Returns the number of arrays stored in separate files
+    '''
+    dirname, basename = os.path.split(os.path.abspath(path))
+    data_path = os.path.join(dirname, f'{basename}-{uuid.uuid4().hex[:12]}')
+    os.makedirs(data_path)
+
+    with open(os.path.join(data_path, PICKLE_FILE), 'wb') as handle:
+        pickler = _ArrayPickler(handle, data_path)
+        pickler.dump(obj)
+
+    old_path = path + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    try:
+        _swap_link(data_path, path)
+    except (OSError, NotImplementedError) as e:
+        LOG.debug(f'Unable to link {path}, renaming it: {e}')
+        if os.path.lexists(path + '.link'):
+            os.remove(path + '.link')
+        _swap_rename(data_path, path)
+
+    # data of previous saves, unused now. Processes using the old
+    # arrays keep them until they are unmapped
+    shutil.rmtree(old_path, ignore_errors=True)
+    current = os.readlink(path) if os.path.islink(path) else None
+    for name in os.listdir(dirname):
+        old_data = os.path.join(dirname, name)
+        if name.startswith(basename + '-') and name != current and \
+           os.path.isdir(old_data) and not os.path.islink(old_data):
+            shutil.rmtree(old_data, ignore_errors=True)
+
+    LOG.debug(f'{pickler.narrays} arrays saved in {path}')
+    return pickler.narrays
+
+
+def load(path: str, mmap_mode='c'):
+    '''
+    Returns the object stored in the directory path. The arrays are
+    memory-mapped with the given mode (None for reading them in memory).
+    Raises FileNotFoundError if the directory does not exist
+    '''
+    # the files of a single save, even if path is replaced meanwhile
+    path = os.path.realpath(path)
+    with open(os.path.join(path, PICKLE_FILE), 'rb') as handle:
+        return _ArrayUnpickler(handle, path, mmap_mode).load()
@@ -0,0 +1,221 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame budgeted hyperparameter search
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2018 Manuel Pastor
+#
+# This file is part of Flame
+#
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Hyperparameter search used by BaseEstimator.optimize when tune_method is
+not 'grid':
+
+    random   evaluates a random sample of the parameter grid
+    halving  successive halving: all the candidates are evaluated with a
+             small resource (training objects or n_estimators) and only the
+             best 1/3 are evaluated again with three times more resource
+
+The fits of every round are run in parallel in the shared process pool,
+in waves of ncpu candidates. No new wave is started when the number of
+fits (tune_budget) or the time (tune_time) allowed is exceeded, and the
+best candidate evaluated with the largest resource is returned.
+'''
+
+import time
+
+import numpy as np
+from sklearn.base import clone, is_classifier
+from sklearn.model_selection import ParameterGrid, check_cv
+
+from flame.util import pool, get_logger
+
+LOG = get_logger(__name__)
+
+# fraction of candidates discarded at every round of successive halving
+ETA = 3
+
+# minimum number of training objects used in successive halving
+MIN_OBJECTS = 20
+
+
+def _fit_candidates(task) -> list:
+    ''' fits and scores a chunk of (candidate, fold) pairs '''
+    estimator, X, Y, scorer, fits = task
+
+    results = []
+    for icand, params, train, test in fits:
+        candidate = clone(estimator)
+        candidate.set_params(**params)
+        candidate.fit(X[train], Y[train])
+        results.append((icand, scorer(candidate, X[test], Y[test])))
+
+    return results
+
+
+class Search:
+    '''
+    Budgeted search of the parameters of estimator
+
+    Parameters
+    ----------
+    tune_parameters : dict of lists of values, as the *_optimize parameters
+    scorer : callable(estimator, X, Y), as sklearn scorers
+    method : 'random' or 'halving'
+    budget : max number of fits (None for no limit)
+    max_time : max time in seconds (None for no limit)
+    n_iter : number of candidates of the random search (by default, those
+        allowed by the budget or 10)
+    '''
+
+    def __init__(self, estimator, tune_parameters, scorer, method='halving',
+                 cv=3, budget=None, max_time=None, n_iter=None, ncpu=1,
+                 random_state=46):
+        self.estimator = estimator
+        # single values (e.g. class_weight: null) are not optimized
+        self.grid = ParameterGrid(
+            {key: value if isinstance(value, (list, tuple)) else [value]
+             for key, value in tune_parameters.items()})
+        self.scorer = scorer
+        self.method = method
+        self.cv = cv
+        self.budget = budget
+        self.max_time = max_time
+        self.n_iter = n_iter
+        self.ncpu = ncpu
+        self.rng = np.random.RandomState(random_state)
+
+        self.fits = 0
+        self.history = []
+
+    def _exhausted(self) -> bool:
+        if self.budget is not None and self.fits >= self.budget:
+            return True
+        if self.max_time is not None and \
+           time.perf_counter() - self.start >= self.max_time:
+            return True
+        return False
+
+    def _candidates(self, nfolds) -> list:
+        ''' returns the list of candidate parameters '''
+        ncand = len(self.grid)
+        if self.method == 'random':
+            n_iter = self.n_iter
+            if n_iter is None:
+                n_iter = 10 if self.budget is None else \
+                         max(1, self.budget // nfolds)
+            ncand = min(ncand, n_iter)
+
+        indexes = self.rng.permutation(len(self.grid))[:ncand]
+        return [self.grid[int(i)] for i in indexes]
+
+    def _resources(self, ncand, ntrain) -> tuple:
+        ''' returns the resource used by successive halving and its values
+            at every round '''
+        nrounds = 1
+        while ncand > 1:
+            ncand //= ETA
+            nrounds += 1
+
+        params = self.estimator.get_params()
+        tuned = set(k for c in self.grid for k in c)
+        if 'n_estimators' in params and 'n_estimators' not in tuned:
+            resource, max_resource, min_resource = \
+                'n_estimators', params['n_estimators'], 10
+        else:
+            resource, max_resource, min_resource = \
+                'n_samples', ntrain, MIN_OBJECTS
+
+        values = [max(min_resource, max_resource // ETA ** (nrounds - i - 1))
+                  for i in range(nrounds)]
+        return resource, [min(v, max_resource) for v in values]
+
+    def _evaluate(self, candidates, folds, resource=None, value=None) -> list:
+        ''' returns the mean score of the candidates, or None for those not
+            evaluated because the budget was exhausted '''
+        scores = [[] for c in candidates]
+
+        for first in range(0, len(candidates), self.ncpu):
+            if self._exhausted():
+                break
+
+            fits = []
+            for icand in range(first, min(first + self.ncpu,
+                                          len(candidates))):
+                params = dict(candidates[icand])
+                for train, test in folds:
+                    if resource == 'n_estimators':
+                        params['n_estimators'] = value
+                    elif resource == 'n_samples':
+                        train = train[:value]
+                    fits.append((icand, params, train, test))
+
+            nchunks = max(1, min(self.ncpu, len(fits)))
+            tasks = [(self.estimator, self.X, self.Y, self.scorer,
+                      fits[i::nchunks]) for i in range(nchunks)]
+            for results in pool.imap(_fit_candidates, tasks, nchunks):
+                for icand, score in results:
+                    scores[icand].append(score)
+            self.fits += len(fits)
+
+        return [np.mean(s) if s else None for s in scores]
+
+    def fit(self, X, Y):
+        ''' runs the search, storing the best parameters in best_params_ '''
+        self.start = time.perf_counter()
+        self.X = X
+        self.Y = Y
+
+        cv = check_cv(self.cv, Y, classifier=is_classifier(self.estimator))
+        folds = list(cv.split(X, Y))
+        candidates = self._candidates(len(folds))
+
+        if self.method == 'halving':
+            # training objects are taken in random order
+            folds = [(self.rng.permutation(train), test)
+                     for train, test in folds]
+            ntrain = min(len(train) for train, test in folds)
+            resource, values = self._resources(len(candidates), ntrain)
+        else:
+            resource, values = None, [None]
+
+        best = None
+        for value in values:
+            scores = self._evaluate(candidates, folds, resource, value)
+            evaluated = [(s, c) for s, c in zip(scores, candidates)
+                         if s is not None]
+            if not evaluated:
+                break
+
+            evaluated.sort(key=lambda item: item[0], reverse=True)
+            best = evaluated[0]
+            self.history.append((resource, value, evaluated))
+            LOG.debug(f'{len(evaluated)} candidates evaluated with {resource}'
+                      f'={value}, best score {best[0]:.3f}')
+
+            if len(evaluated) < len(candidates):
+                break
+            candidates = [c for s, c in
+                          evaluated[:max(1, len(evaluated) // ETA)]]
+
+        if best is None:
+            raise ValueError('no candidate could be evaluated within the '
+                             'tuning budget')
+
+        self.best_score_, self.best_params_ = best
+        LOG.info(f'{self.fits} fits run in '
+                 f'{time.perf_counter() - self.start:.2f} s')
+        return self
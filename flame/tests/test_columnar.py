@@ -0,0 +1,65 @@
+import pytest
+
+import os
+
+import numpy as np
+
+from flame.util import columnar
+
+
+def _columns():
+    return {"obj_nam": np.array(["a", "b", "c"]),
+            "values": np.array([1.5, np.nan, 2.0]),
+            "c0": np.array([True, False, True]),
+            "mixed": columnar.to_array(
+                np.array([None, 1.5, "x"], dtype=object), 3),
+            "missing": columnar.to_array(None, 3),
+            "xmatrix": np.arange(300, dtype=np.uint8).reshape(3, 100)}
+
+
+def test_to_array():
+    assert columnar.to_array([None, 1, 2.5], 4).tolist()[1:3] == [1.0, 2.5]
+    assert np.isnan(columnar.to_array([None, 1, 2.5], 4)[3])
+    assert columnar.to_array([None, "x"], 2).tolist() == ["", "x"]
+    assert columnar.to_array([True, False], 2).tolist() == ["True", "False"]
+    assert np.isnan(columnar.to_array(None, 2)).all()
+
+
+def _check(path):
+    columns = _columns()
+
+    loaded = columnar.read(path)
+    assert list(loaded) == list(columns)
+    for key, values in columns.items():
+        assert loaded[key].dtype == values.dtype
+        assert np.array_equal(loaded[key], values,
+                              equal_nan=values.dtype.kind == "f")
+
+    assert columnar.read_schema(path)["var_nam"] == ["v0", "v1"]
+    assert columnar.read_schema(path)["format"] == columnar.COLUMNAR_VER
+
+
+def test_npz(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar, "pa", None)
+    path = str(tmp_path / ("part-00000" + columnar.extension()))
+    columnar.write(path, _columns(), {"var_nam": ["v0", "v1"]})
+
+    assert path.endswith(".npz")
+    assert isinstance(columnar.read(path, ["values"])["values"], np.memmap)
+    _check(path)
+
+    # several parts are concatenated
+    columnar.write(str(tmp_path / "part-00001.npz"), _columns(),
+                   {"var_nam": ["v0", "v1"]})
+    loaded = columnar.read(str(tmp_path), ["obj_nam", "xmatrix"])
+    assert loaded["obj_nam"].tolist() == ["a", "b", "c"] * 2
+    assert loaded["xmatrix"].shape == (6, 100)
+
+
+def test_arrow(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "part-00000.arrow")
+    columnar.write(path, _columns(), {"var_nam": ["v0", "v1"]})
+
+    _check(str(tmp_path))
+    assert not os.path.exists(path + ".tmp")
@@ -0,0 +1,130 @@
+import pytest
+
+import shutil
+from pathlib import Path
+
+import yaml
+import numpy as np
+
+from flame.chem import compute_md
+from flame.idata import Idata
+from flame.conveyor import Conveyor
+from flame.parameters import Parameters
+
+current = Path(__file__).parent.resolve()
+SDF_FILE_NAME = str(current / "data" / "minicaco.sdf")
+TEMPLATE = current.parent / "children" / "parameters.yaml"
+NUM_MOLS = 10
+
+
+@pytest.fixture
+def params():
+    """ parameters of a new model, read from the template """
+    param = Parameters()
+    with open(TEMPLATE) as f:
+        param.p = yaml.safe_load(f)
+    param.extended = True
+    param.setVal("computeMD_method", ["RDKit_properties", "morganFP"])
+    return param
+
+
+def _check_full_form(success, results, dtype=np.float64):
+    assert success is True
+    matrix = results["matrix"]
+    assert matrix.shape == (NUM_MOLS, len(results["names"]))
+    assert matrix.dtype == dtype
+    assert results["success_arr"].dtype == np.bool_
+    assert len(results["success_arr"]) == NUM_MOLS
+
+
+def test_rdkit_descriptors():
+    success, results = compute_md._RDKit_descriptors(SDF_FILE_NAME)
+    _check_full_form(success, results)
+    ok = results["success_arr"]
+    assert not np.isnan(results["matrix"][ok]).any()
+
+
+def test_rdkit_properties():
+    success, results = compute_md._RDKit_properties(SDF_FILE_NAME)
+    _check_full_form(success, results)
+
+
+def test_morgan_fingerprints():
+    success, results = compute_md._RDKit_morganFPS(
+        SDF_FILE_NAME, morgan_nbits=1024)
+    _check_full_form(success, results, dtype=np.uint8)
+    assert results["matrix"].shape[1] == 1024
+    assert set(np.unique(results["matrix"])) <= {0, 1}
+
+
+def test_missing_file():
+    success, _ = compute_md._RDKit_properties("not_existing.sdf")
+    assert success is False
+
+
+def test_idata_combines_methods():
+    """ combined matrix only contains rows successful in every method """
+    _, prop = compute_md._RDKit_properties(SDF_FILE_NAME)
+    _, morgan = compute_md._RDKit_morganFPS(SDF_FILE_NAME)
+
+    masks = [prop["success_arr"], morgan["success_arr"]]
+    matrix = Idata._concat_descriptors_matrix([prop["matrix"],
+                                               morgan["matrix"]])
+    filtered, success_list = Idata._filter_matrix(matrix, masks)
+
+    assert isinstance(success_list, list)
+    assert filtered.shape == (sum(success_list),
+                              len(prop["names"]) + len(morgan["names"]))
+
+
+def test_full_form_legacy_tuple():
+    """ legacy (xmatrix, names, success_list) returns are expanded """
+    xmatrix = np.array([[1.0, 2.0], [3.0, 4.0]])
+    results = Idata._full_form((xmatrix, ["a", "b"], [True, False, True]))
+
+    assert results["matrix"].shape == (3, 2)
+    assert np.isnan(results["matrix"][1]).all()
+    np.testing.assert_array_equal(results["matrix"][2], [3.0, 4.0])
+
+
+def test_memory_pipeline(params, tmp_path):
+    """ in memory pipeline produces the same results as the SDFile one """
+    results = {}
+    for mode in ("files", "memory"):
+        ifile = str(tmp_path / f"{mode}.sdf")
+        shutil.copy(SDF_FILE_NAME, ifile)
+
+        params.setVal("mol_pipeline", mode)
+        idata = Idata(params, Conveyor(), ifile)
+        success, results[mode] = idata.workflow_series(ifile)
+        assert success is True
+
+    files, memory = results["files"], results["memory"]
+    assert memory[1] == files[1]
+    assert memory[2] == files[2]
+    np.testing.assert_allclose(memory[0], files[0])
+
+    # no intermediate files unless requested
+    assert sorted(p.name for p in tmp_path.glob("memory*")) == ["memory.sdf"]
+
+
+@pytest.mark.parametrize("mode", ["files", "memory"])
+@pytest.mark.parametrize("batch", ["series", "objects"])
+def test_parallel_ranges(params, tmp_path, mode, batch):
+    """ splitting the input in byte ranges keeps the order of the objects """
+    params.setVal("mol_pipeline", mode)
+    params.setVal("mol_batch", batch)
+
+    xmatrix = {}
+    for ncpu in (1, 3):
+        ifile = str(tmp_path / f"cpu{ncpu}.sdf")
+        shutil.copy(SDF_FILE_NAME, ifile)
+        params.setVal("numCPUs", ncpu)
+
+        conveyor = Conveyor()
+        Idata(params, conveyor, ifile).run()
+        assert not conveyor.getError()
+        xmatrix[ncpu] = conveyor.getVal("xmatrix")
+
+    assert xmatrix[1].shape == (NUM_MOLS, 43 + 2048)
+    np.testing.assert_allclose(xmatrix[3], xmatrix[1])
@@ -0,0 +1,123 @@
+import pytest
+
+import pickle
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from nonconformist.base import ClassifierAdapter, RegressorAdapter
+from nonconformist.icp import IcpClassifier, IcpRegressor
+from nonconformist.nc import (AbsErrorErrFunc, ClassifierNc, MarginErrFunc,
+                              RegressorNc, RegressorNormalizer)
+
+from flame.stats import conformal
+
+TRAIN, CAL, TEST = np.arange(40), np.arange(40, 65), np.arange(65, 80)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(0)
+    X = rng.rand(80, 6)
+    Y = X @ rng.rand(6) + rng.normal(scale=0.1, size=80)
+    return X, Y
+
+
+def _rf(quantitative):
+    if quantitative:
+        return RandomForestRegressor(n_estimators=20, random_state=1)
+    return RandomForestClassifier(n_estimators=20, random_state=1)
+
+
+@pytest.mark.parametrize("significance", [0.1, 0.2, 0.5])
+def test_member_interval(data, significance):
+    X, Y = data
+    member = conformal.ConformalMember(_rf(True), True, normalized=True)
+    member.fit(X, Y, TRAIN, CAL)
+
+    model = RegressorAdapter(_rf(True))
+    normalizer = RegressorNormalizer(model, RegressorAdapter(_rf(True)),
+                                     AbsErrorErrFunc())
+    icp = IcpRegressor(RegressorNc(model, AbsErrorErrFunc(), normalizer))
+    icp.fit(X[TRAIN], Y[TRAIN])
+    icp.calibrate(X[CAL], Y[CAL])
+
+    np.testing.assert_allclose(member.interval(X[TEST], significance),
+                               icp.predict(X[TEST], significance), rtol=1e-6)
+    assert member.scores.dtype == np.float32
+
+
+def test_member_pvalues(data):
+    X, Y = data
+    Y = (Y > np.median(Y)).astype(float)
+    member = conformal.ConformalMember(_rf(False), False)
+    member.fit(X, Y, TRAIN, CAL)
+
+    icp = IcpClassifier(ClassifierNc(ClassifierAdapter(_rf(False)),
+                                     MarginErrFunc()), smoothing=False)
+    icp.fit(X[TRAIN], Y[TRAIN])
+    icp.calibrate(X[CAL], Y[CAL])
+
+    np.testing.assert_allclose(member.pvalues(X[TEST]), icp.predict(X[TEST]))
+
+
+@pytest.mark.parametrize("quantitative", [True, False])
+def test_aggregated(data, quantitative):
+    X, Y = data
+    if not quantitative:
+        Y = (Y > np.median(Y)).astype(float)
+
+    acp = conformal.AggregatedConformal(_rf(quantitative), quantitative,
+                                        n_models=4).fit(X, Y)
+    prediction = acp.predict(X[TEST], 0.2)
+    assert prediction.shape == (len(TEST), 2)
+
+    parallel = conformal.AggregatedConformal(_rf(quantitative), quantitative,
+                                             n_models=4, ncpu=2).fit(X, Y)
+    np.testing.assert_array_equal(parallel.predict(X[TEST], 0.2), prediction)
+
+    loaded = pickle.loads(pickle.dumps(acp))
+    np.testing.assert_array_equal(loaded.predict(X[TEST], 0.2), prediction)
+
+    if not quantitative:
+        assert prediction.dtype == bool
+        assert acp.predict(X[TEST]).max() <= 1
+
+
+@pytest.mark.parametrize("quantitative", [True, False])
+def test_levels(data, quantitative):
+    X, Y = data
+    if not quantitative:
+        Y = (Y > np.median(Y)).astype(float)
+    levels = [0.1, 0.2, 0.3]
+
+    acp = conformal.AggregatedConformal(_rf(quantitative), quantitative,
+                                        n_models=4).fit(X, Y)
+    predictions = acp.predict_levels(X[TEST], levels)
+    for significance, prediction in zip(levels, predictions):
+        np.testing.assert_allclose(prediction,
+                                   acp.predict(X[TEST], significance))
+
+
+@pytest.mark.parametrize("quantitative", [True, False])
+def test_oof_levels(data, quantitative):
+    from sklearn.model_selection import KFold
+    from flame.stats import crossval
+
+    X, Y = data
+    if not quantitative:
+        Y = (Y > np.median(Y)).astype(float)
+    cv = KFold(n_splits=4, shuffle=True, random_state=46)
+    levels = [0.1, 0.2, 0.3]
+
+    fitted = crossval.conformal_fit_folds(_rf(quantitative), quantitative,
+                                          X, Y, cv, n_models=4)
+    oof = crossval.conformal_oof(fitted, quantitative, X, Y)
+    predictions = conformal.oof_levels(oof, levels)
+    for significance, prediction in zip(levels, predictions):
+        expected, fold_times = crossval.conformal_aggregate_folds(
+            fitted, quantitative, X, Y, significance)
+        np.testing.assert_allclose(prediction, expected)
+
+    info = conformal.oof_quality(oof, levels)
+    assert len(info) == 2 * len(levels)
+    assert info[1][0] == 'Conformal_accuracy_0.1'
@@ -0,0 +1,149 @@
+import io
+import json
+import pickle
+
+import numpy as np
+
+from flame.conveyor import Conveyor, read_header, to_column
+
+
+def _conveyor():
+    conveyor = Conveyor()
+    conveyor.addVal(["a", "b", "c", "d"], "obj_nam", "Mol name", "label")
+    conveyor.addVal([1.0, 2.5, None, 4.0], "values", "Prediction",
+                    "result", "objs", None, "main")
+    conveyor.addVal([True, False, True, True], "c0", "Class 0", "result")
+    conveyor.addVal(np.arange(8).reshape(4, 2), "ranges", "Ranges",
+                    "result")
+    conveyor.addVal(4, "obj_num", "Num mols", "method", "single")
+    return conveyor
+
+
+def test_columns():
+    conveyor = _conveyor()
+
+    # strings are not stored in fixed-width unicode arrays
+    assert conveyor.getVal("obj_nam").dtype == object
+    assert type(conveyor.getVal("obj_nam")[0]) is str
+    assert conveyor.getVal("c0").dtype == bool
+    # mixed values are not converted
+    assert conveyor.getVal("values").dtype == object
+    assert conveyor.getVal("values")[1] == 2.5
+    assert to_column([1, 2.5]).dtype == object
+    assert to_column("abc") == "abc"
+
+    assert conveyor.objectKeys() == ["obj_nam", "values", "c0", "ranges"]
+    assert conveyor.singleKeys() == ["obj_num"]
+    assert conveyor.getManifest("c0")["label"] == "Class 0"
+
+    data = json.loads(conveyor.getJSON())
+    assert data["values"] == [1.0, 2.5, None, 4.0]
+    assert data["c0"] == [True, False, True, True]
+
+
+def test_add_again():
+    conveyor = _conveyor()
+    conveyor.addVal([0.0, 0.0, 0.0, 0.0], "values", "Prediction",
+                    "result", "objs", None, "main")
+
+    assert len(conveyor.manifest) == 5
+    assert conveyor.getMain() == ["values"]
+    assert conveyor.objectKeys() == ["obj_nam", "values", "c0", "ranges"]
+
+
+def test_string_columns(tmp_path):
+    """ mixed length strings keep an object column after setVal, addVal
+        and a save/load round trip """
+    names = ["a", "a much longer molecule name", "", "b"]
+    conveyor = _conveyor()
+    conveyor.setVal("obj_nam", names)
+    conveyor.addVal(names[::-1], "smiles", "SMILES", "smiles")
+
+    for key, expected in (("obj_nam", names), ("smiles", names[::-1])):
+        assert conveyor.getVal(key).dtype == object
+        assert conveyor.getVal(key).tolist() == expected
+
+    path = str(tmp_path / "results.pkl")
+    conveyor.saveFile(path)
+    loaded = Conveyor()
+    with open(path, "rb") as fi:
+        assert loaded.load(fi)[0]
+
+    for key, expected in (("obj_nam", names), ("smiles", names[::-1])):
+        assert loaded.getVal(key).dtype == object
+        assert loaded.getVal(key).tolist() == expected
+        assert type(loaded.getVal(key)[1]) is str
+    assert loaded.getJSON() == conveyor.getJSON()
+
+
+def test_filter_objects():
+    conveyor = _conveyor()
+    conveyor.filterObjects([True, False, True, False])
+
+    assert list(conveyor.getVal("obj_nam")) == ["a", "c"]
+    assert list(conveyor.getVal("values")) == [1.0, None]
+    assert conveyor.getVal("ranges").tolist() == [[0, 1], [4, 5]]
+    assert conveyor.getVal("obj_num") == 4
+
+
+def test_load_lists():
+    """ conveyors saved in the old format (sequential pickles) with lists
+        are loaded as columns """
+    conveyor = _conveyor()
+
+    handle = io.BytesIO()
+    for value in (1, conveyor.origin, dict(conveyor.data, obj_nam=["a", "b",
+                  "c", "d"]), conveyor.manifest, conveyor.meta,
+                  conveyor.error, conveyor.warning):
+        pickle.dump(value, handle)
+    handle.seek(0)
+
+    loaded = Conveyor()
+    assert loaded.load(handle)[0]
+    assert isinstance(loaded.getVal("obj_nam"), np.ndarray)
+    assert loaded.objectKeys() == conveyor.objectKeys()
+    assert pickle.loads(pickle.dumps(loaded)).getManifest("c0") is not None
+
+
+def test_container(tmp_path):
+    conveyor = _conveyor()
+    conveyor.addVal(np.random.rand(100, 200), "xmatrix", "X matrix",
+                    "method", "vars")
+    conveyor.addMeta("output_keys", ["obj_nam", "values"])
+
+    path = str(tmp_path / "results.pkl")
+    conveyor.saveFile(path, {"md5": "abc"})
+
+    with open(path, "rb") as fi:
+        assert read_header(fi)["extra"] == {"md5": "abc"}
+        assert fi.tell() == 0
+
+        loaded = Conveyor()
+        assert loaded.load(fi)[0]
+
+    assert isinstance(loaded.getVal("xmatrix").base, np.memmap)
+    assert np.array_equal(loaded.getVal("xmatrix"), conveyor.getVal("xmatrix"))
+    assert loaded.getJSON() == conveyor.getJSON()
+    assert loaded.getMeta("output_keys") == ["obj_nam", "values"]
+
+    # copy-on-write, the file is not modified
+    loaded.getVal("xmatrix")[0, 0] = -1
+    conveyor.saveFile(path)
+    assert loaded.getVal("xmatrix")[0, 0] == -1
+
+    # only some keys
+    partial = Conveyor()
+    with open(path, "rb") as fi:
+        assert partial.load(fi, ["obj_num"])[0]
+    assert partial.getVal("obj_num") == 4
+    assert not partial.isKey("xmatrix")
+    assert partial.objectKeys() == conveyor.objectKeys()
+
+    # streams are read in memory
+    handle = io.BytesIO()
+    conveyor.save(handle)
+    handle.seek(0)
+    streamed = Conveyor()
+    assert streamed.load(handle)[0]
+    assert not isinstance(streamed.getVal("xmatrix").base, np.memmap)
+    assert streamed.getJSON() == conveyor.getJSON()
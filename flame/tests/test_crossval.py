@@ -0,0 +1,177 @@
+import pytest
+
+import yaml
+import numpy as np
+from pathlib import Path
+from sklearn import model_selection
+from sklearn.linear_model import Ridge
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.cross_decomposition import PLSRegression
+from sklearn.model_selection import KFold, LeaveOneOut
+
+from flame.parameters import Parameters
+from flame.stats import crossval
+
+TEMPLATE = Path(__file__).resolve().parent.parent / "children" / "parameters.yaml"
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(0)
+    X = rng.rand(40, 5)
+    Y = X @ rng.rand(5) + rng.normal(scale=0.1, size=40)
+    return X, Y
+
+
+class Budget:
+    def __init__(self, ncpu):
+        self.ncpu = ncpu
+
+    def getVal(self, key):
+        return self.ncpu
+
+
+@pytest.mark.parametrize("ncpu", [1, 3])
+@pytest.mark.parametrize("cv", [KFold(5), LeaveOneOut()])
+def test_quantitative(data, cv, ncpu):
+    X, Y = data
+    y_pred, fold_times = crossval.cross_val_predict(Ridge(), X, Y, cv, ncpu)
+
+    expected = model_selection.cross_val_predict(Ridge(), X, Y, cv=cv)
+    np.testing.assert_allclose(y_pred, expected)
+    assert fold_times.shape == (cv.get_n_splits(X), 2)
+    assert np.all(fold_times >= 0)
+
+
+def test_qualitative(data):
+    X, Y = data
+    Y = (Y > np.median(Y)).astype(int)
+    estimator = RandomForestClassifier(n_estimators=10, random_state=46,
+                                       n_jobs=-1)
+
+    y_pred, _ = crossval.cross_val_predict(estimator, X, Y, KFold(4), 2)
+
+    expected = model_selection.cross_val_predict(estimator, X, Y, cv=KFold(4))
+    np.testing.assert_array_equal(y_pred, expected)
+    # the original estimator is not modified
+    assert estimator.get_params()["n_jobs"] == -1
+
+
+def test_fold_info(data):
+    X, Y = data
+    _, fold_times = crossval.cross_val_predict(Ridge(), X, Y, KFold(3))
+    info = dict((key, value) for key, _, value in
+                crossval.fold_info(fold_times))
+    assert info["CV_folds"] == 3
+    assert info["CV_fit_time"] == pytest.approx(fold_times[:, 0].sum())
+
+
+def test_cpu_budget():
+    assert crossval.cpu_budget(Budget(None)) == 1
+    assert crossval.cpu_budget(Budget(2)) == min(2, crossval.pool.cpu_count())
+    assert crossval.cpu_budget(Budget(10000)) == crossval.pool.cpu_count()
+
+
+@pytest.mark.parametrize("scale", [False, True])
+@pytest.mark.parametrize("nvar", [5, 60])
+@pytest.mark.parametrize("cv", [KFold(5), LeaveOneOut()])
+def test_pls(cv, nvar, scale):
+    rng = np.random.RandomState(1)
+    X = rng.rand(30, nvar) * 10 + 100
+    X[:, 1] = 3.0
+    Y = X[:, :3] @ rng.rand(3) + rng.normal(size=30)
+
+    y_preds, fold_times = crossval.pls_cross_val_predict(X, Y, cv, [1, 2, 4],
+                                                         scale)
+
+    assert fold_times.shape == (cv.get_n_splits(X), 2)
+    for n_comp in [1, 2, 4]:
+        expected = model_selection.cross_val_predict(
+            PLSRegression(n_comp, scale=scale), X, Y, cv=cv)
+        np.testing.assert_allclose(y_preds[n_comp], expected.ravel(),
+                                   rtol=1e-6)
+
+
+@pytest.mark.parametrize("quantitative", [True, False])
+def test_rf_oob(data, quantitative):
+    from flame.stats.RF import RF
+
+    X, Y = data
+    if not quantitative:
+        Y = (Y > np.median(Y)).astype(float)
+
+    param = Parameters()
+    with open(TEMPLATE) as f:
+        param.p = yaml.safe_load(f)
+    param.extended = True
+    param.setVal("quantitative", quantitative)
+    param.setVal("conformal", False)
+    param.setVal("ModelValidationCV", "oob")
+
+    model = RF(X, Y, param)
+    model.build()
+    success, results = model.validate()
+    assert success
+
+    if quantitative:
+        expected = model.estimator.oob_prediction_
+    else:
+        expected = np.argmax(model.estimator.oob_decision_function_, axis=1)
+    np.testing.assert_array_equal(results["Y_pred"], expected)
+
+    info = dict((key, value) for key, _, value in results["quality"])
+    assert info["CV_folds"] == 0
+
+
+@pytest.mark.parametrize("quantitative", [True, False])
+def test_rf_oob_not_predicted(data, quantitative):
+    """objects in the bootstrap sample of every tree are not validated"""
+    from flame.stats.RF import RF, oob_predicted
+
+    X, Y = data
+    if not quantitative:
+        Y = (Y > np.median(Y)).astype(float)
+
+    param = Parameters()
+    with open(TEMPLATE) as f:
+        param.p = yaml.safe_load(f)
+    param.extended = True
+    param.setVal("quantitative", quantitative)
+    param.setVal("conformal", False)
+    param.setVal("ModelValidationCV", "oob")
+    param.setInnerVal("RF_parameters", "n_estimators", 2)
+    param.setInnerVal("RF_parameters", "random_state", 46)
+
+    model = RF(X, Y, param)
+    model.build()
+
+    # sklearn predicts 0 for these objects, never NaN
+    predicted = oob_predicted(model.estimator, quantitative)
+    assert not predicted.all()
+    if quantitative:
+        assert not np.isnan(model.estimator.oob_prediction_).any()
+        assert np.all(model.estimator.oob_prediction_[~predicted] == 0)
+
+    with pytest.raises(ValueError, match="not out-of-bag"):
+        model.cross_val_predict(X, Y)
+
+
+def test_conformal(data):
+    X, Y = data
+    y_pred, fold_times = crossval.conformal_cross_val_predict(
+        Ridge(), True, X, Y, KFold(4), 0.2, n_models=5)
+
+    assert y_pred.shape == (40, 2) and fold_times.shape == (4, 2)
+    assert np.all(y_pred[:, 0] < y_pred[:, 1])
+    assert np.mean((y_pred[:, 0] < Y) & (y_pred[:, 1] > Y)) > 0.6
+
+    # the result does not depend on the number of processes
+    parallel, _ = crossval.conformal_cross_val_predict(
+        Ridge(), True, X, Y, KFold(4), 0.2, ncpu=3, n_models=5)
+    np.testing.assert_array_equal(y_pred, parallel)
+
+    Y = (Y > np.median(Y)).astype(float)
+    estimator = RandomForestClassifier(n_estimators=10, random_state=46)
+    y_pred, _ = crossval.conformal_cross_val_predict(
+        estimator, False, X, Y, KFold(4), 0.2, n_models=5)
+    assert y_pred.shape == (40, 2) and y_pred.dtype == bool
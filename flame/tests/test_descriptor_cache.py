@@ -0,0 +1,99 @@
+import pytest
+
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+from flame.chem import compute_md
+from flame.chem import descriptor_cache
+
+current = Path(__file__).parent.resolve()
+SDF_FILE_NAME = str(current / "data" / "minicaco.sdf")
+
+
+class CountingMethod:
+    """ wraps a compute_md method, recording the number of molecules """
+
+    def __init__(self, method, **kwargs):
+        self.method = method
+        self.kwargs = kwargs
+        self.nmols = []
+
+    def __call__(self, ifile):
+        success, results = self.method(ifile, **self.kwargs)
+        self.nmols.append(len(results["success_arr"]))
+        return success, results
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return descriptor_cache.DescriptorCache(str(tmp_path / "cache.db"))
+
+
+def _first_molecules(tmp_path, n):
+    blocks = descriptor_cache.read_blocks(SDF_FILE_NAME)
+    ofile = tmp_path / "first.sdf"
+    ofile.write_text("".join(blocks[:n]))
+    return str(ofile)
+
+
+def test_cache_reuses_descriptors(cache, tmp_path):
+    settings = descriptor_cache.settings_key("RDKit_properties", {})
+    method = CountingMethod(compute_md._RDKit_properties)
+
+    # first 6 molecules, then the complete file
+    success, _ = cache.compute(method, _first_molecules(tmp_path, 6), settings)
+    assert success is True
+    success, results = cache.compute(method, SDF_FILE_NAME, settings)
+    assert success is True
+    assert method.nmols == [6, 4]
+
+    _, expected = compute_md._RDKit_properties(SDF_FILE_NAME)
+    assert results["names"] == expected["names"]
+    np.testing.assert_array_equal(results["success_arr"],
+                                  expected["success_arr"])
+    ok = expected["success_arr"]
+    np.testing.assert_array_equal(results["matrix"][ok], expected["matrix"][ok])
+
+    # everything cached now
+    cache.compute(method, SDF_FILE_NAME, settings)
+    assert method.nmols == [6, 4]
+
+
+def test_cache_settings(cache):
+    """ different settings do not share descriptors """
+    method = CountingMethod(compute_md._RDKit_morganFPS, morgan_radius=2)
+    for radius in (2, 3):
+        settings = descriptor_cache.settings_key(
+            "morganFP", {"morgan_radius": radius})
+        cache.compute(method, SDF_FILE_NAME, settings)
+
+    assert method.nmols == [10, 10]
+
+
+def test_cache_packed(cache, tmp_path):
+    settings = descriptor_cache.settings_key("morganFP",
+                                             {"morgan_packed": True})
+    method = CountingMethod(compute_md._RDKit_morganFPS, morgan_packed=True)
+
+    cache.compute(method, _first_molecules(tmp_path, 3), settings)
+    _, results = cache.compute(method, SDF_FILE_NAME, settings)
+    _, expected = compute_md._RDKit_morganFPS(SDF_FILE_NAME,
+                                              morgan_packed=True)
+
+    np.testing.assert_array_equal(results["matrix"].words,
+                                  expected["matrix"].words)
+
+
+def test_cache_lru(tmp_path):
+    cache = descriptor_cache.DescriptorCache(str(tmp_path / "cache.db"),
+                                             max_entries=5)
+    settings = descriptor_cache.settings_key("RDKit_properties", {})
+    cache.compute(CountingMethod(compute_md._RDKit_properties),
+                  SDF_FILE_NAME, settings)
+
+    con = sqlite3.connect(cache.path)
+    nrows = con.execute("SELECT COUNT(*) FROM descriptors").fetchone()[0]
+    con.close()
+    assert nrows == 5
@@ -0,0 +1,95 @@
+import pytest
+
+import sys
+import json
+import types
+from pathlib import Path
+
+import yaml
+
+from flame import context
+from flame.conveyor import Conveyor
+from flame.parameters import Parameters
+
+current = Path(__file__).parent.resolve()
+TEMPLATE = current.parent / "children" / "parameters.yaml"
+
+# endpoint: (input signature, ext_input)
+MODELS = {"A": ("md1", False), "B": ("md2", False), "C": ("md1", False),
+          "D": ("md1", True), "E": ("md2", False)}
+
+
+class FakePredict:
+    """ records which model computed the input used by every model """
+
+    def __init__(self, model, version, output_format=None, parameters=None):
+        self.model = model
+        self.param = Parameters()
+        self.param.p = {"endpoint": model}
+        self.conveyor = Conveyor()
+
+    def get_model_set(self):
+        return MODELS[self.model][1], None
+
+    def idata_signature(self):
+        return MODELS[self.model][0]
+
+    def run_idata(self, input_source):
+        self.conveyor.addVal(self.model, "idata_by", "", "method", "single")
+
+    def run_apply(self):
+        pass
+
+    def run_odata(self):
+        return True, json.dumps({"model": self.model,
+                                 "idata_by": self.conveyor.getVal("idata_by")})
+
+
+def _fake_predict_cmd(model, output_format=None):
+    return True, json.dumps({"model": model["endpoint"], "idata_by": "cmd"})
+
+
+def test_model_set_groups(monkeypatch):
+    monkeypatch.setitem(sys.modules, "flame.predict",
+                        types.SimpleNamespace(Predict=FakePredict))
+    monkeypatch.setattr(context, "predict_cmd", _fake_predict_cmd)
+
+    # the workers only receive the model and the path of the shared input
+    tasks = []
+    pool_map = context.pool.map
+
+    def recording_map(func, items, ncpu):
+        tasks.extend(items)
+        return pool_map(func, items, ncpu)
+
+    monkeypatch.setattr(context.pool, "map", recording_map)
+
+    model_set = [{"endpoint": e, "version": 0, "infile": "mols.sdf"}
+                 for e in "ABCDE"]
+    model_suc, model_res = context.predict_model_set(model_set)
+
+    assert model_suc == [True] * 5
+    results = [json.loads(r) for r in model_res]
+    assert [r["model"] for r in results] == list("ABCDE")
+    assert [r["idata_by"] for r in results] == ["A", "B", "A", "cmd", "B"]
+
+    assert len(tasks) == 3 + 4
+    for model, input_path in tasks:
+        assert model in model_set and isinstance(input_path, str)
+
+
+def test_idata_signature():
+    from flame.predict import Predict
+
+    def predict(**values):
+        param = Parameters()
+        with open(TEMPLATE) as f:
+            param.p = yaml.safe_load(f)
+        param.extended = True
+        for key, value in values.items():
+            param.setVal(key, value)
+        return Predict("A", 0, parameters=param)
+
+    reference = predict().idata_signature()
+    assert predict(model="SVM", conformal=True).idata_signature() == reference
+    assert predict(computeMD_method=["morganFP"]).idata_signature() != reference
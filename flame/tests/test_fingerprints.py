@@ -0,0 +1,154 @@
+import pytest
+import yaml
+
+from pathlib import Path
+
+import numpy as np
+from rdkit import Chem, DataStructs
+from rdkit.Chem import AllChem
+
+from flame.chem import compute_md
+from flame.chem import fingerprints
+from flame.conveyor import Conveyor
+from flame.parameters import Parameters
+
+current = Path(__file__).parent.resolve()
+SDF_FILE_NAME = str(current / "data" / "minicaco.sdf")
+CLASSIF_FILE_NAME = str(current / "data" / "classification.sdf")
+TEMPLATE = current.parent / "children" / "parameters.yaml"
+
+
+@pytest.fixture
+def dense_bits():
+    rng = np.random.RandomState(46)
+    return (rng.rand(30, 100) < 0.2).astype(np.uint8)
+
+
+def test_pack_roundtrip(dense_bits):
+    packed = fingerprints.PackedFingerprints.from_dense(dense_bits)
+
+    assert packed.shape == (30, 100)
+    assert packed.words.shape == (30, 2)
+    np.testing.assert_array_equal(packed.unpack(), dense_bits)
+    np.testing.assert_array_equal(np.asarray(packed), dense_bits)
+    np.testing.assert_array_equal(packed.popcount(), dense_bits.sum(axis=1))
+
+
+def test_row_selection(dense_bits):
+    packed = fingerprints.PackedFingerprints.from_dense(dense_bits)
+    mask = dense_bits[:, 0] == 1
+
+    np.testing.assert_array_equal(packed[mask, :].unpack(), dense_bits[mask])
+    np.testing.assert_array_equal(packed[2:5].unpack(), dense_bits[2:5])
+    np.testing.assert_array_equal(packed[:, 3], dense_bits[:, 3])
+    assert isinstance(packed[[1, 4], ...], fingerprints.PackedFingerprints)
+    np.testing.assert_array_equal(packed[[1, 4], ...].unpack(),
+                                  dense_bits[[1, 4]])
+
+    stacked = fingerprints.vstack([packed[:10], packed[10:]])
+    np.testing.assert_array_equal(stacked.words, packed.words)
+
+
+def test_tanimoto(dense_bits):
+    a = dense_bits.astype(bool)
+    common = (a[:, None, :] & a[None, :, :]).sum(axis=2)
+    union = (a[:, None, :] | a[None, :, :]).sum(axis=2)
+    expected = np.where(union > 0, common / np.maximum(union, 1), 0.0)
+
+    packed = fingerprints.PackedFingerprints.from_dense(dense_bits)
+    np.testing.assert_allclose(packed.tanimoto(block_size=7), expected)
+    np.testing.assert_allclose(
+        fingerprints.jaccard_distance(dense_bits, packed[:4]),
+        1.0 - expected[:, :4])
+
+    # same result with the kernel used by the SVM on dense matrices
+    np.testing.assert_allclose(
+        fingerprints.tanimoto_kernel(dense_bits * 2.5, dense_bits[:4]),
+        expected[:, :4])
+
+
+def test_tanimoto_blocks(dense_bits, monkeypatch):
+    """blocks are sized by the number of words of both X and Y"""
+    monkeypatch.setattr(fingerprints, "BLOCK_WORDS", 2 * 5 * 5)
+    assert fingerprints._block_rows(2) == 5
+
+    packed = fingerprints.PackedFingerprints.from_dense(dense_bits)
+    np.testing.assert_allclose(packed.tanimoto(packed[:12]),
+                               packed.tanimoto(block_size=64)[:, :12])
+
+
+def test_tanimoto_rdkit():
+    mols = [m for m in Chem.SDMolSupplier(SDF_FILE_NAME) if m is not None]
+    fps = [AllChem.GetMorganFingerprintAsBitVect(m, 2, nBits=2048)
+           for m in mols]
+    expected = np.array([DataStructs.BulkTanimotoSimilarity(fp, fps)
+                         for fp in fps])
+
+    success, results = compute_md._RDKit_morganFPS(
+        SDF_FILE_NAME, morgan_packed=True, morgan_features=False)
+    assert success is True
+    packed = results["matrix"]
+    assert isinstance(packed, fingerprints.PackedFingerprints)
+    np.testing.assert_allclose(packed.tanimoto(), expected)
+
+
+def test_packed_morgan_matches_dense():
+    _, dense = compute_md._RDKit_morganFPS(SDF_FILE_NAME)
+    _, packed = compute_md._RDKit_morganFPS(SDF_FILE_NAME, morgan_packed=True)
+
+    assert packed["names"] == dense["names"]
+    np.testing.assert_array_equal(packed["success_arr"], dense["success_arr"])
+    np.testing.assert_array_equal(packed["matrix"].unpack(), dense["matrix"])
+    assert packed["matrix"].nbytes * 8 == dense["matrix"].nbytes
+
+
+@pytest.mark.parametrize("conformal", [True, False])
+@pytest.mark.parametrize("quantitative", [True, False])
+def test_svm_tanimoto_packed(quantitative, conformal, monkeypatch):
+    """SVM models with the Tanimoto kernel are built, validated and applied
+    on packed fingerprints, which are never unpacked"""
+    from flame.stats.SVM import SVM, TanimotoSVC, TanimotoSVR
+
+    success, results = compute_md._RDKit_morganFPS(
+        CLASSIF_FILE_NAME, morgan_packed=True)
+    assert success is True
+    X = results["matrix"]
+    rng = np.random.RandomState(46)
+    if quantitative:
+        Y = rng.normal(size=len(X))
+    else:
+        Y = np.tile([0.0, 1.0], len(X) // 2 + 1)[:len(X)]
+
+    param = Parameters()
+    with open(TEMPLATE) as f:
+        param.p = yaml.safe_load(f)
+    param.extended = True
+    param.setVal("quantitative", quantitative)
+    param.setVal("conformal", conformal)
+    param.setVal("tune", False)
+    param.setVal("numCPUs", 1)
+    # skipped for packed fingerprints
+    param.setVal("modelAutoscaling", True)
+    param.setInnerVal("SVM_parameters", "kernel", "tanimoto")
+
+    def unpack(*args, **kwargs):
+        raise AssertionError("packed fingerprints expanded")
+    monkeypatch.setattr(fingerprints, "unpack_bits", unpack)
+
+    model = SVM(X, Y, param)
+    assert model.X is X
+    assert model.scaler is None
+
+    success, _ = model.build()
+    assert success is True
+    estimator = TanimotoSVR if quantitative else TanimotoSVC
+    assert type(model.estimator_temp) is estimator
+    success, _ = model.validate()
+    assert success is True
+
+    conveyor = Conveyor()
+    model.project(X[:5], conveyor)
+    assert not conveyor.getError()
+    if not conformal:
+        np.testing.assert_array_equal(conveyor.getVal("values"),
+                                      model.estimator.predict(X[:5]))
@@ -0,0 +1,88 @@
+import pytest
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import KFold
+
+from flame.stats import crossval
+from flame.stats import fold_cache
+
+
+class Counter:
+    """ wraps a function, recording the number of calls """
+
+    def __init__(self, function):
+        self.function = function
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.function(*args)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(60, 5))
+    Y = X[:, 0] + 0.1 * rng.normal(size=60)
+    return X, Y
+
+
+def test_signature(data):
+    X, Y = data
+    key = fold_cache.signature("cv", {"a": 1}, X, Y)
+
+    assert key == fold_cache.signature("cv", {"a": 1}, X.copy(), Y.copy())
+    assert key != fold_cache.signature("cv", {"a": 2}, X, Y)
+    assert key != fold_cache.signature("cv", {"a": 1}, X, Y + 1)
+    assert key != fold_cache.signature("cv", {"a": 1}, X.astype(np.float32), Y)
+
+
+def test_cached_results(tmp_path, data):
+    X, Y = data
+    cache = fold_cache.FoldCache(str(tmp_path / "fold_cache"))
+    cv = KFold(n_splits=3, shuffle=True, random_state=46)
+    estimator = RandomForestRegressor(n_estimators=10, random_state=46)
+    function = Counter(crossval.cross_val_predict)
+
+    key = fold_cache.signature(estimator.get_params(), repr(cv), X, Y)
+    y_pred, fold_times = cache.cached(key, function, estimator, X, Y, cv)
+    y_cached, times_cached = cache.cached(key, function, estimator, X, Y, cv)
+
+    assert function.calls == 1
+    assert np.array_equal(y_pred, y_cached)
+    assert np.array_equal(fold_times, times_cached)
+
+
+def test_conformal_folds_reused(tmp_path, data):
+    """ fold models are reused when only the significance changes """
+    X, Y = data
+    cache = fold_cache.FoldCache(str(tmp_path / "fold_cache"))
+    cv = KFold(n_splits=3, shuffle=True, random_state=46)
+    estimator = RandomForestRegressor(n_estimators=10, random_state=46)
+    function = Counter(crossval.conformal_fit_folds)
+
+    key = fold_cache.signature(estimator.get_params(), repr(cv), X, Y)
+    for significance in (0.2, 0.1):
+        fitted = cache.cached(key, function, estimator, True, X, Y, cv)
+        y_pred, fold_times = crossval.conformal_aggregate_folds(
+            fitted, True, X, Y, significance)
+        expected, expected_times = crossval.conformal_cross_val_predict(
+            estimator, True, X, Y, cv, significance)
+        assert np.allclose(y_pred, expected)
+
+    assert function.calls == 1
+
+
+def test_eviction_and_errors(tmp_path):
+    cache = fold_cache.FoldCache(str(tmp_path / "fold_cache"), max_entries=2)
+    for i in range(4):
+        cache.put(str(i), i)
+
+    assert cache.get("0") is None
+    assert cache.get("3") == 3
+    assert len(list((tmp_path / "fold_cache").glob("*.pkl"))) == 2
+
+    # corrupted entries are reported as misses
+    (tmp_path / "fold_cache" / "3.pkl").write_bytes(b"not a pickle")
+    assert cache.get("3") is None
@@ -0,0 +1,77 @@
+import pytest
+
+import io
+import json
+
+import numpy as np
+
+from flame.util import jsonwriter
+
+
+def _values():
+    return {
+        "names": np.array(["a", "bé", "c\"d"]),
+        "values": np.array([0.1, 2.0, 1e-07]),
+        "ints": np.arange(3, dtype=np.int32),
+        "flags": np.array([True, False, True]),
+        "mixed": np.array([1.5, None, "x"], dtype=object),
+        "matrix": np.arange(6.0).reshape(3, 2),
+        "info": [("R2", "Goodness of fit", np.float64(0.5)),
+                 ("n", "Number of objects", np.int64(3))],
+        "single": np.int64(4),
+        1: None,
+    }
+
+
+def test_same_as_json():
+    values = _values()
+    reference = json.dumps({
+        "names": values["names"].tolist(),
+        "values": values["values"].tolist(),
+        "ints": [0, 1, 2],
+        "flags": [True, False, True],
+        "mixed": [1.5, None, "x"],
+        "matrix": values["matrix"].tolist(),
+        "info": [("R2", "Goodness of fit", 0.5),
+                 ("n", "Number of objects", 3)],
+        "single": 4,
+        1: None,
+    })
+
+    assert jsonwriter.dumps(values) == reference
+
+
+def test_floats():
+    values = np.array([1.23456, np.nan, np.inf, 2.0])
+
+    assert json.loads(jsonwriter.dumps(values)) == [1.23456, None, None, 2.0]
+    assert jsonwriter.dumps(values, float_format="%.2f") == \
+        "[1.23, null, null, 2.00]"
+    assert jsonwriter.dumps(np.float32(np.nan), nan="-") == "\"-\""
+
+
+def test_stream(monkeypatch):
+    monkeypatch.setattr(jsonwriter, "CHUNK_SIZE", 7)
+    values = {"values": np.random.rand(100), "ints": np.arange(100)}
+
+    # binary streams receive the output in several writes
+    class Stream(io.BytesIO):
+        writes = 0
+
+        def write(self, data):
+            self.writes += 1
+            return super().write(data)
+
+    stream = Stream()
+    jsonwriter.JSONWriter(stream, buffer_size=100).write(values)
+
+    assert stream.writes > 1
+    assert stream.getvalue().decode() == json.dumps(
+        {"values": values["values"].tolist(), "ints": list(range(100))})
+
+
+def test_default():
+    with pytest.raises(TypeError):
+        jsonwriter.dumps({"value": object()})
+
+    assert jsonwriter.dumps({"value": 1j}, default=str) == "{\"value\": \"1j\"}"
@@ -0,0 +1,43 @@
+import io
+
+import numpy as np
+
+from flame import odata
+
+
+def _write(function, *args):
+    fo = io.StringIO()
+    function(fo, *args)
+    return fo.getvalue()
+
+
+def test_write_results(monkeypatch):
+    monkeypatch.setattr(odata, "BLOCK_ROWS", 2)
+    columns = [np.array(["a", "b", "c"]),
+               np.array([1.23456, np.nan, 2.0]),
+               np.array([True, False, True]),
+               np.array([None, 0.5, "x"], dtype=object),
+               np.array([1, 2]),
+               np.float32([0.5, 1.5, 2.5]),
+               None]
+
+    assert _write(odata._write_results, columns, 3) == \
+        "a\t1.2346\tTrue\t-\t1\t0.5\t-\t\n" \
+        "b\tnan\tFalse\t0.5000\t2\t1.5\t-\t\n" \
+        "c\t2.0000\tTrue\tx\t-\t2.5\t-\t\n"
+
+
+def test_write_matrix(monkeypatch):
+    monkeypatch.setattr(odata, "BLOCK_CELLS", 2)
+    names = np.array(["a", "b"])
+
+    assert _write(odata._write_matrix, names,
+                  np.array([[0, 1], [1, 0]], dtype=np.uint8)) == \
+        "a\t0\t1\nb\t1\t0\n"
+    assert _write(odata._write_matrix, names, np.array([[0, 12], [3, 4]])) == \
+        "a\t0\t12\nb\t3\t4\n"
+    assert _write(odata._write_matrix, names,
+                  np.array([[0.1, 1e-05], [np.nan, 2.0]])) == \
+        "a\t0.1\t1e-05\nb\tnan\t2.0\n"
+    assert _write(odata._write_matrix, names, np.float32([1.5, 0.1])) == \
+        "a\t1.5\t0.1\n"
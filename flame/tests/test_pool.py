@@ -0,0 +1,74 @@
+import pytest
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from flame.util import pool
+
+
+def _square(x):
+    return x * x
+
+
+def _nested(x):
+    """ pool calls inside workers run sequentially """
+    return pool.in_worker(), pool.map(_square, range(x), 2)
+
+
+def _pid(x):
+    return os.getpid()
+
+
+def test_map_order():
+    assert pool.map(_square, range(50), 3) == [x * x for x in range(50)]
+    assert list(pool.imap(_square, iter(range(20)), 2, max_pending=1)) == \
+        [x * x for x in range(20)]
+
+
+def test_pool_reused():
+    pool.map(_square, range(4), 2)
+    first = pool.get_pool(2)
+    pool.map(_square, range(4), 2)
+    assert pool.get_pool(2) is first
+    assert os.getpid() not in pool.map(_pid, range(4), 2)
+
+
+def test_nested_and_serial():
+    assert pool.map(_nested, [3], 2) == [(True, [0, 1, 4])]
+    assert pool.map(_pid, range(3), 1) == [os.getpid()] * 3
+
+
+def test_shutdown():
+    pool.map(_square, range(4), 2)
+    pool.shutdown()
+    assert pool._pool is None
+    assert pool.map(_square, range(4), 2) == [0, 1, 4, 9]
+
+
+def test_grow_while_busy():
+    """a pool used by a running map is replaced but not closed"""
+    pool.shutdown()
+    results = pool.imap(_square, range(10), 2, max_pending=1)
+    assert next(results) == 0
+
+    small = pool._pool
+    assert pool.get_pool(3) is not small
+    assert small in pool._retired
+
+    # the running map completes with the old pool, closed afterwards
+    assert list(results) == [x * x for x in range(1, 10)]
+    assert small not in pool._retired
+    with pytest.raises(ValueError):
+        small.apply_async(_square, (1,))
+
+    assert pool.map(_square, range(4), 3) == [0, 1, 4, 9]
+
+
+def test_threads():
+    pool.shutdown()
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(
+            lambda n: pool.map(_square, range(n), 2 + n % 2), range(8)))
+
+    assert results == [[x * x for x in range(n)] for n in range(8)]
+    assert not pool._users and not pool._retired
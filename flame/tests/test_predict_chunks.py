@@ -0,0 +1,89 @@
+import pytest
+
+import shutil
+from pathlib import Path
+
+import yaml
+import numpy as np
+
+from flame.chem import sdfileutils
+from flame.idata import Idata
+from flame.odata import Odata
+from flame.conveyor import Conveyor
+from flame.parameters import Parameters
+
+current = Path(__file__).parent.resolve()
+SDF_FILE_NAME = str(current / "data" / "minicaco.sdf")
+TEMPLATE = current.parent / "children" / "parameters.yaml"
+
+
+@pytest.fixture
+def params():
+    param = Parameters()
+    with open(TEMPLATE) as f:
+        param.p = yaml.safe_load(f)
+    param.extended = True
+    param.setVal("computeMD_method", ["RDKit_properties"])
+    param.setVal("output_format", ["TSV"])
+    param.setVal("output_md", True)
+    param.setVal("verbose_error", True)
+    return param
+
+
+def _predict(params, ifile, chunk=None, obj_offset=0, output_keys=None):
+    """ runs Idata and Odata, replacing Apply by a dummy prediction """
+    conveyor = Conveyor()
+    if chunk is not None:
+        conveyor.addMeta("chunk", chunk)
+        conveyor.addMeta("obj_offset", obj_offset)
+        conveyor.addMeta("output_keys", output_keys)
+
+    Idata(params, conveyor, ifile).run()
+    assert not conveyor.getError()
+
+    values = conveyor.getVal("xmatrix")[:, 0].astype(float)
+    conveyor.addVal(values, "values", "Prediction", "result", "objs",
+                    "Dummy prediction")
+    conveyor.addMain("values")
+    conveyor.setOrigin("apply")
+
+    success, _ = Odata(params, conveyor).run()
+    assert success is True
+    return conveyor
+
+
+def test_chunks_append(params, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    # remove the names, so the molecules are numbered
+    index = sdfileutils.SDFIndex(SDF_FILE_NAME, cache=False)
+    unnamed = str(tmp_path / "unnamed.sdf")
+    with open(unnamed, "wb") as fo:
+        for record in index[:]:
+            fo.write(b"\n" + record.split(b"\n", 1)[1])
+    params.setVal("SDFile_name", "missing_field")
+
+    whole = tmp_path / "whole"
+    whole.mkdir()
+    shutil.copy(unnamed, whole / "mols.sdf")
+    _predict(params, str(whole / "mols.sdf"))
+    expected = {name: (tmp_path / name).read_text()
+                for name in ("output.tsv", "output_md.tsv")}
+    assert "mol0000000009" in expected["output.tsv"]
+
+    index = sdfileutils.SDFIndex(unnamed, cache=False)
+    obj_offset, output_keys = 0, None
+    for chunk, start in enumerate(range(0, len(index), 4)):
+        path = tmp_path / str(chunk)
+        path.mkdir()
+        source = (unnamed,) + index.byte_range(
+            start, min(start + 4, len(index)))
+        sdfileutils.write_range(source, str(path / "mols.sdf"))
+
+        conveyor = _predict(params, str(path / "mols.sdf"), chunk,
+                            obj_offset, output_keys)
+        obj_offset += conveyor.getMeta("obj_read")
+        output_keys = conveyor.getMeta("output_keys")
+
+    for name, text in expected.items():
+        assert (tmp_path / name).read_text() == text
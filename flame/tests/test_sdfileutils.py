@@ -0,0 +1,126 @@
+import pytest
+
+import os
+import collections
+from pathlib import Path
+
+from rdkit import Chem
+
+from flame.chem import sdfileutils
+
+current = Path(__file__).parent.resolve()
+SDF_FILE_NAME = str(current / "data" / "minicaco.sdf")
+CLASSIF_FILE_NAME = str(current / "data" / "classification.sdf")
+
+
+def _supplier_info(ifile):
+    suppl = Chem.SDMolSupplier(ifile)
+    return len(suppl), sum(m is not None for m in suppl)
+
+
+@pytest.fixture
+def variants(tmp_path):
+    """ SDFiles with unusual endings """
+    content = Path(SDF_FILE_NAME).read_text()
+    files = {
+        "no_terminator": content.rstrip()[:-4],
+        "blank_end": content + "\n\n",
+        "garbage_end": content + "garbage\n",
+        "crlf": content.replace("\n", "\r\n"),
+    }
+    for name, text in files.items():
+        (tmp_path / f"{name}.sdf").write_bytes(text.encode())
+    return [str(tmp_path / f"{name}.sdf") for name in files]
+
+
+def test_index_matches_supplier(variants):
+    for ifile in [SDF_FILE_NAME, CLASSIF_FILE_NAME] + variants:
+        index = sdfileutils.SDFIndex(ifile, cache=False)
+        assert (len(index), index.count_valid()) == _supplier_info(ifile)
+
+
+def test_count_mols_without_parsing(variants, monkeypatch):
+    """records without connection table are not counted, without RDKit"""
+    expected = [_supplier_info(ifile)[1]
+                for ifile in [SDF_FILE_NAME, CLASSIF_FILE_NAME] + variants]
+
+    monkeypatch.setattr(sdfileutils.Chem, "SDMolSupplier", None)
+    assert [sdfileutils.count_mols(ifile) for ifile in
+            [SDF_FILE_NAME, CLASSIF_FILE_NAME] + variants] == expected
+
+
+def test_index_memo(tmp_path, monkeypatch):
+    monkeypatch.setattr(sdfileutils, "MAX_INDEXES", 2)
+    monkeypatch.setattr(sdfileutils, "_index_memo",
+                        collections.OrderedDict())
+
+    ifiles = []
+    for i in range(3):
+        ifiles.append(str(tmp_path / f"mols{i}.sdf"))
+        Path(ifiles[-1]).write_text(Path(SDF_FILE_NAME).read_text())
+
+    first = sdfileutils.SDFIndex.get(ifiles[0])
+    sdfileutils.SDFIndex.get(ifiles[1])
+    assert sdfileutils.SDFIndex.get(ifiles[0]) is first
+    sdfileutils.SDFIndex.get(ifiles[2])
+
+    # the least recently used index is discarded
+    assert list(sdfileutils._index_memo) == [os.path.abspath(ifiles[0]),
+                                             os.path.abspath(ifiles[2])]
+
+
+def test_index_records(tmp_path):
+    ifile = tmp_path / "mols.sdf"
+    ifile.write_text(Path(SDF_FILE_NAME).read_text())
+    index = sdfileutils.SDFIndex.get(str(ifile))
+
+    data = ifile.read_bytes()
+    assert b"".join(index[:]) == data
+    assert index[3:5] == [index[3], index[4]]
+    assert index.byte_range(0, len(index)) == (0, len(data))
+
+    suppl = Chem.SDMolSupplier(str(ifile))
+    assert Chem.MolToSmiles(index.mol(4)) == Chem.MolToSmiles(suppl[4])
+    assert index.mol(4).GetProp("name") == suppl[4].GetProp("name")
+
+
+def test_index_cache(tmp_path):
+    ifile = tmp_path / "mols.sdf"
+    ifile.write_text(Path(CLASSIF_FILE_NAME).read_text())
+
+    assert sdfileutils.count_mols(str(ifile)) == _supplier_info(str(ifile))[1]
+    assert sdfileutils.SDFIndex.get(str(ifile)).count_valid() == \
+        _supplier_info(str(ifile))[1]
+    assert os.path.isfile(sdfileutils.SDFIndex(str(ifile)).cache_file)
+
+    # valid mask is read from the cache file
+    index = sdfileutils.SDFIndex(str(ifile))
+    assert index._valid is not None
+
+    # modified files are indexed again
+    ifile.write_text(Path(SDF_FILE_NAME).read_text())
+    assert sdfileutils.count_mols(str(ifile)) == 10
+
+
+def test_split_ranges(tmp_path):
+    ifile = tmp_path / "mols.sdf"
+    ifile.write_text(Path(CLASSIF_FILE_NAME).read_text())
+    ifile = str(ifile)
+
+    success, (ranges, sizes) = sdfileutils.split_SDFile_ranges(ifile, 4)
+    assert success is True
+    assert len(ranges) == 4
+    assert sum(sizes) == _supplier_info(ifile)[1]
+
+    # ranges keep the original order of the molecules
+    smiles = [Chem.MolToSmiles(m) for m in Chem.SDMolSupplier(ifile)
+              if m is not None]
+    chunks = [sdfileutils.read_mols(r) for r in ranges]
+    assert [len(c) for c in chunks] == sizes
+    assert [Chem.MolToSmiles(m) for c in chunks for m in c] == smiles
+
+    # single records
+    records = sdfileutils.record_ranges(ranges[1])
+    assert len(records) == sizes[1]
+    assert [Chem.MolToSmiles(sdfileutils.read_mols(r)[0])
+            for r in records] == [Chem.MolToSmiles(m) for m in chunks[1]]
@@ -0,0 +1,173 @@
+import pytest
+
+import os
+import json
+import pickle
+import asyncio
+
+import numpy as np
+from sklearn.cross_decomposition import PLSRegression
+
+from flame import serve
+from flame.conveyor import Conveyor
+from flame.stats import estimator_cache
+from flame.stats import persistence
+from flame.util import jsonwriter
+
+SMILES = ["CCO", "c1ccccc1", "CC(=O)O", "CCN", "CCCC", "OCCO"]
+
+
+class CountingServer(serve.ModelServer):
+    """ replaces the model prediction by the number of heavy atoms """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    def predict_batch(self, key, batch):
+        self.batches.append((key, [len(mols) for mols in batch]))
+        return [[{"values": m.GetNumAtoms()} if m is not None else
+                 {"error": "unable to predict molecule"} for m in mols]
+                for mols in batch]
+
+
+def _run_server(server, tmp_path, requests):
+    """ sends all the requests through a single connection """
+    socket_path = str(tmp_path / "flame.sock")
+
+    async def run():
+        listener = await server.start(socket_path)
+        responses = await asyncio.get_event_loop().run_in_executor(
+            None, serve.send, requests, socket_path)
+        listener.close()
+        await listener.wait_closed()
+        return responses
+
+    return asyncio.run(run())
+
+
+def test_micro_batching(tmp_path):
+    server = CountingServer(batch_wait=0.2, max_batch=100)
+    requests = [{"endpoint": "A", "smiles": s} for s in SMILES]
+    requests.append({"endpoint": "B", "version": 1, "smiles": ["CC", "C1"]})
+
+    responses = _run_server(server, tmp_path, requests)
+
+    assert sorted(server.batches) == [(("A", 0), [1] * 6), (("B", 1), [2])]
+    assert [r["results"][0]["values"] for r in responses[:6]] == \
+        [3, 6, 4, 3, 4, 4]
+    assert responses[6]["results"][1] == {"error": "unable to predict molecule"}
+
+
+def test_max_batch(tmp_path):
+    server = CountingServer(batch_wait=0.2, max_batch=4)
+    requests = [{"endpoint": "A", "smiles": s} for s in SMILES]
+
+    responses = _run_server(server, tmp_path, requests)
+
+    assert [sizes for _, sizes in server.batches] == [[1] * 4, [1] * 2]
+    assert all(r["success"] for r in responses)
+
+
+def test_wrong_requests(tmp_path):
+    server = CountingServer()
+    responses = _run_server(server, tmp_path, [{"endpoint": "A"}])
+    assert responses[0]["success"] is False
+
+
+def test_split_results():
+    conveyor = Conveyor()
+    conveyor.addVal(["flame_batch_1", "flame_batch_0"], "obj_nam", "Mol name",
+                    "label", "objs", "")
+    conveyor.addVal(np.array([1.5, 2.5]), "values", "Prediction",
+                    "result", "objs", "")
+
+    results = serve.split_results(
+        conveyor, ["flame_batch_0", None, "flame_batch_1", "flame_batch_2"])
+
+    assert results["flame_batch_0"]["values"] == 2.5
+    assert results["flame_batch_1"]["obj_nam"] == "flame_batch_1"
+    assert "flame_batch_2" not in results
+    assert json.loads(jsonwriter.dumps(results))["flame_batch_0"] == \
+        {"obj_nam": "flame_batch_0", "values": 2.5}
+
+
+def test_estimator_cache(tmp_path):
+    model_file = str(tmp_path / "estimator.pkl")
+    with open(model_file, "wb") as fo:
+        pickle.dump({"estimator": [1, 2, 3], "version": 1}, fo)
+
+    estimator_cache.set_size(0)
+    assert estimator_cache.load(model_file) is not \
+        estimator_cache.load(model_file)
+
+    estimator_cache.set_size(2)
+    first = estimator_cache.load(model_file)
+    assert estimator_cache.load(model_file) is first
+
+    # modified files are loaded again
+    with open(model_file, "wb") as fo:
+        pickle.dump({"estimator": [4], "version": 1, "new": True}, fo)
+    assert estimator_cache.load(model_file)["estimator"] == [4]
+
+    estimator_cache.set_size(0)
+    with pytest.raises(FileNotFoundError):
+        estimator_cache.load(str(tmp_path / "missing.pkl"))
+
+
+def test_persistence(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistence, "MIN_BYTES", 1024)
+    rng = np.random.RandomState(0)
+    X = rng.rand(200, 50)
+    pls = PLSRegression(n_components=3).fit(X, X[:, 0])
+    model = {"estimator": pls, "small": np.arange(3), "version": 2}
+    model_dir = str(tmp_path / "estimator")
+
+    # the X weights and loadings are stored in .npy files
+    assert persistence.save(model, model_dir) > 0
+    loaded = persistence.load(model_dir)
+    assert isinstance(loaded["estimator"].x_weights_, np.memmap)
+    assert not isinstance(loaded["small"], np.memmap)
+    assert np.allclose(loaded["estimator"].predict(X), pls.predict(X))
+
+    # saved again over the previous directory, reloaded by the cache
+    estimator_cache.set_size(2)
+    assert estimator_cache.load(model_dir)["version"] == 2
+    persistence.save({"estimator": None, "version": 3}, model_dir)
+    assert estimator_cache.load(model_dir)["version"] == 3
+    estimator_cache.set_size(0)
+
+
+def test_persistence_swap(tmp_path):
+    """the estimator directory is replaced atomically by a link swap"""
+    model_dir = str(tmp_path / "estimator")
+
+    # directory saved by previous versions
+    os.makedirs(model_dir)
+    with open(os.path.join(model_dir, persistence.PICKLE_FILE), "wb") as f:
+        pickle.dump({"version": 1}, f)
+
+    persistence.save({"version": 2}, model_dir)
+    assert os.path.islink(model_dir)
+    first = os.path.realpath(model_dir)
+
+    # the data of the previous save is removed
+    persistence.save({"version": 3}, model_dir)
+    assert persistence.load(model_dir)["version"] == 3
+    assert not os.path.exists(first)
+    assert sorted(os.listdir(tmp_path)) == \
+        sorted(["estimator", os.readlink(model_dir)])
+
+
+def test_persistence_without_links(tmp_path, monkeypatch):
+    def no_symlink(*args):
+        raise OSError("symbolic links not supported")
+
+    monkeypatch.setattr(os, "symlink", no_symlink)
+    model_dir = str(tmp_path / "estimator")
+    persistence.save({"version": 2}, model_dir)
+    persistence.save({"version": 3}, model_dir)
+
+    assert not os.path.islink(model_dir)
+    assert persistence.load(model_dir)["version"] == 3
+    assert os.listdir(tmp_path) == ["estimator"]
@@ -0,0 +1,84 @@
+import pytest
+
+import yaml
+import numpy as np
+from pathlib import Path
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import get_scorer
+from sklearn.svm import SVR
+
+from flame.parameters import Parameters
+from flame.stats import tuning
+
+TEMPLATE = Path(__file__).resolve().parent.parent / "children" / "parameters.yaml"
+
+GRID = {"C": [0.1, 1, 10, 100], "epsilon": [0.01, 0.1, 0.5]}
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(0)
+    X = rng.rand(120, 4)
+    Y = X @ np.array([1.0, 2.0, 0.0, -1.0]) + rng.normal(scale=0.1, size=120)
+    return X, Y
+
+
+@pytest.mark.parametrize("ncpu", [1, 2])
+def test_halving(data, ncpu):
+    X, Y = data
+    search = tuning.Search(SVR(), GRID, get_scorer("r2"), "halving",
+                           ncpu=ncpu).fit(X, Y)
+
+    resources = [value for resource, value, _ in search.history]
+    ncands = [len(evaluated) for _, _, evaluated in search.history]
+    assert ncands == [12, 4, 1]
+    assert resources[-1] == 80 and resources == sorted(resources)
+    assert search.best_params_["C"] >= 10
+    assert search.fits == 3 * sum(ncands)
+
+
+def test_halving_n_estimators(data):
+    X, Y = data
+    search = tuning.Search(RandomForestRegressor(n_estimators=90),
+                           {"max_features": [1, 2, 4]}, get_scorer("r2"),
+                           "halving").fit(X, Y)
+
+    assert [(r, v) for r, v, _ in search.history] == \
+        [("n_estimators", 30), ("n_estimators", 90)]
+
+
+def test_random_budget(data):
+    X, Y = data
+    search = tuning.Search(SVR(), GRID, get_scorer("r2"), "random",
+                           budget=12).fit(X, Y)
+    assert len(search.history[0][2]) == 4
+    assert search.fits == 12
+
+    # no new candidates are evaluated once the budget is exhausted
+    search = tuning.Search(SVR(), GRID, get_scorer("r2"), "halving",
+                           budget=10, ncpu=2).fit(X, Y)
+    assert search.fits == 12
+    assert len(search.history) == 1 and len(search.history[0][2]) == 4
+
+
+def test_rf_warm_start(data):
+    from flame.stats import RF
+
+    X, Y = data
+    param = Parameters()
+    with open(TEMPLATE) as f:
+        param.p = yaml.safe_load(f)
+    param.extended = True
+    param.setVal("quantitative", True)
+
+    model = RF.RF(X, Y, param)
+    grid = {"max_features": [1, 4], "n_estimators": [30, 10, 20]}
+    model.optimize(X, Y, RandomForestRegressor(), grid)
+
+    params = model.estimator.get_params()
+    assert params["n_estimators"] in (10, 20, 30)
+    assert params["warm_start"] is False
+    # the forests scored are seeded, not the estimator returned
+    assert params["random_state"] is None
+    # all the variables are needed for these data
+    assert params["max_features"] == 4
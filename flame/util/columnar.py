@@ -0,0 +1,221 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame columnar binary output
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2018 Manuel Pastor
+#
+# This file is part of Flame
+#
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Columnar binary output of the results (output format COLUMNAR), written by
+Odata in the directory output_columns.
+
+Every prediction (or every chunk of a prediction run in chunks) is written
+as a part file, containing one typed column per result (obj_nam, SMILES,
+predictions, confidence...) and, optionally, the descriptor matrix as a 2D
+column named xmatrix. A JSON schema describes the columns (key, label,
+type) and contains the variable names and some model metadata.
+
+The parts are written as Arrow IPC files (.arrow) when pyarrow is
+installed, readable with pyarrow or pandas.read_feather, or otherwise as
+uncompressed .npz files with the schema stored in the member __schema__.
+In both cases the data is stored uncompressed, so read() memory-maps the
+numeric columns of a part instead of reading them.
+'''
+
+import os
+import json
+import struct
+import zipfile
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+COLUMNAR_VER = 1
+
+SCHEMA_KEY = '__schema__'
+
+# length of the fixed part of the zip local file headers and position
+# of the name and extra field lengths
+ZIP_HEADER = 30
+ZIP_LENGTHS = 26
+
+
+def extension() -> str:
+    ''' returns the extension of the part files written in this system '''
+    return '.arrow' if pa is not None else '.npz'
+
+
+def to_array(values, nobj: int) -> np.ndarray:
+    '''
+    Returns the values of a result column as a typed numpy array of nobj
+    rows. Missing values are stored as NaN in numeric columns and as
+    empty strings in text columns
+    '''
+    if values is None:
+        return np.full(nobj, np.nan)
+
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biufU' \
+       and len(values) == nobj:
+        return values
+
+    items = list(values)[:nobj]
+    items += [None] * (nobj - len(items))
+
+    numbers = [v for v in items if v is not None]
+    if all(isinstance(v, (int, float, np.number)) and
+           not isinstance(v, (bool, np.bool_)) for v in numbers):
+        return np.array([np.nan if v is None else v for v in items],
+                        dtype=np.float64)
+
+    return np.array(['' if v is None else str(v) for v in items])
+
+
+def write(path: str, columns: dict, schema: dict) -> None:
+    '''
+    Writes the columns (a dictionary of numpy arrays of one or two
+    dimensions, with the same number of rows) in the part file path,
+    with the given schema
+    '''
+    schema = dict(schema, format=COLUMNAR_VER)
+    serial = json.dumps(schema, default=str)
+
+    tmp_path = path + '.tmp'
+
+    if path.endswith('.arrow'):
+        arrays = []
+        for values in columns.values():
+            if values.ndim > 1:
+                arrays.append(pa.FixedSizeListArray.from_arrays(
+                    pa.array(values.ravel()), values.shape[1]))
+            else:
+                arrays.append(pa.array(values))
+
+        table = pa.Table.from_arrays(
+            arrays, names=list(columns),
+            metadata={SCHEMA_KEY: serial})
+
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    else:
+        with open(tmp_path, 'wb') as fo:
+            np.savez(fo, **columns, **{SCHEMA_KEY: np.array(serial)})
+
+    os.replace(tmp_path, path)
+
+
+def parts(path: str) -> list:
+    ''' returns the part files of the output directory path, in order '''
+    if os.path.isfile(path):
+        return [path]
+
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.endswith(('.arrow', '.npz')))
+
+
+def _npz_member(fi, zipped, name):
+    '''
+    Returns the array stored in the member name of the npz, memory-mapped
+    when it is not compressed
+    '''
+    info = zipped.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        with zipped.open(info) as member:
+            return np.lib.format.read_array(member, allow_pickle=False)
+
+    # the data starts after the local header, its name and extra field
+    fi.seek(info.header_offset + ZIP_LENGTHS)
+    name_length, extra_length = struct.unpack('<HH', fi.read(4))
+    fi.seek(info.header_offset + ZIP_HEADER + name_length + extra_length)
+
+    if np.lib.format.read_magic(fi) == (1, 0):
+        shape, fortran, dtype = np.lib.format.read_array_header_1_0(fi)
+    else:
+        shape, fortran, dtype = np.lib.format.read_array_header_2_0(fi)
+    if dtype.hasobject:
+        raise ValueError(f'column {name} contains python objects')
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+
+    return np.memmap(fi.name, dtype=dtype, mode='r', shape=shape,
+                     order='F' if fortran else 'C', offset=fi.tell())
+
+
+def _read_part(path, keys):
+    ''' returns the schema and the columns keys (all if None) of a part '''
+
+    if path.endswith('.arrow'):
+        if pa is None:
+            raise ImportError(f'pyarrow is required for reading {path}')
+
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        schema = json.loads(table.schema.metadata[SCHEMA_KEY.encode()])
+
+        columns = {}
+        for key in (table.column_names if keys is None else keys):
+            column = table.column(key).combine_chunks()
+            if isinstance(column.type, pa.FixedSizeListType):
+                columns[key] = column.flatten().to_numpy(
+                    zero_copy_only=False).reshape(-1, column.type.list_size)
+            elif pa.types.is_string(column.type):
+                # same type of the text columns of the npz files
+                columns[key] = column.to_numpy(
+                    zero_copy_only=False).astype(str)
+            else:
+                columns[key] = column.to_numpy(zero_copy_only=False)
+        return schema, columns
+
+    with open(path, 'rb') as fi, zipfile.ZipFile(fi) as zipped:
+        schema = json.loads(str(_npz_member(fi, zipped, SCHEMA_KEY)[()]))
+
+        names = [name[:-4] for name in zipped.namelist()]
+        columns = {}
+        for key in (names if keys is None else keys):
+            if key != SCHEMA_KEY:
+                columns[key] = _npz_member(fi, zipped, key)
+        return schema, columns
+
+
+def read_schema(path: str) -> dict:
+    ''' returns the schema of the first part of the output path '''
+    return _read_part(parts(path)[0], [])[0]
+
+
+def read(path: str, keys=None) -> dict:
+    '''
+    Returns a dictionary with the columns keys (all if None) stored in path
+    (an output directory or a single part file). The numeric columns of a
+    single part are memory-mapped; the columns of several parts are
+    concatenated in memory
+    '''
+    paths = parts(path)
+    if not paths:
+        return {}
+
+    columns = [_read_part(ipath, keys)[1] for ipath in paths]
+    if len(columns) == 1:
+        return columns[0]
+
+    return {key: np.concatenate([part[key] for part in columns])
+            for key in columns[0]}
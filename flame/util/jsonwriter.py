@@ -0,0 +1,203 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame streaming JSON writer
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2018 Manuel Pastor
+#
+# This file is part of Flame
+#
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+JSON writer encoding numpy arrays and scalars directly, used for
+returning the prediction results.
+
+The arrays are encoded in chunks, never converted to complete lists, and
+the output is written incrementally to any stream with a write method
+(text or binary files, sockets opened with makefile, asyncio stream
+writers...), so large results are never held in memory as a whole.
+
+The output is the same produced by json.dumps, except for the non-finite
+numbers (NaN and infinity), which are not valid JSON and are written as
+null, and for the floats, which can be written with a given format
+(e.g. '%.4f') instead of their full representation.
+'''
+
+import io
+import json
+import math
+from json.encoder import encode_basestring_ascii
+
+import numpy as np
+
+# same separators used by json.dumps
+ITEM_SEPARATOR = ', '
+KEY_SEPARATOR = ': '
+
+# number of array elements encoded at once
+CHUNK_SIZE = 65536
+
+# characters accumulated before writing to the stream
+BUFFER_SIZE = 1 << 20
+
+_encoder = json.JSONEncoder()
+
+
+class JSONWriter:
+    '''
+    Writes values as JSON to the stream fo.
+
+    float_format is a %-format applied to the floats (None for their full
+    representation) and nan the value written instead of non-finite
+    numbers. default is a function returning a serializable version of
+    other objects, which raise a TypeError otherwise
+    '''
+
+    def __init__(self, fo, float_format=None, nan=None, default=None,
+                 buffer_size=BUFFER_SIZE):
+        self.fo = fo
+        self.binary = not isinstance(fo, io.TextIOBase)
+        self.float_format = float_format
+        self.nan_value = nan
+        self.nan = _encoder.encode(nan)
+        self.default = default
+        self.buffer_size = buffer_size
+
+        self.parts = []
+        self.size = 0
+
+    def write(self, value) -> None:
+        ''' writes value and flushes the buffer '''
+        self._value(value)
+        self.flush()
+
+    def flush(self) -> None:
+        ''' writes the buffered text to the stream '''
+        if not self.parts:
+            return
+
+        # ensure_ascii output, safe to encode as ascii
+        text = ''.join(self.parts)
+        self.fo.write(text.encode('ascii') if self.binary else text)
+
+        self.parts = []
+        self.size = 0
+
+    def _put(self, text: str) -> None:
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def _float(self, value: float) -> str:
+        if not math.isfinite(value):
+            return self.nan
+        if self.float_format is not None:
+            return self.float_format % value
+        return float.__repr__(value)
+
+    def _value(self, value) -> None:
+        if isinstance(value, str):
+            self._put(encode_basestring_ascii(value))
+        elif value is None:
+            self._put('null')
+        elif isinstance(value, (bool, np.bool_)):
+            self._put('true' if value else 'false')
+        elif isinstance(value, (int, np.integer)):
+            self._put(int.__repr__(int(value)))
+        elif isinstance(value, (float, np.floating)):
+            self._put(self._float(float(value)))
+        elif isinstance(value, np.ndarray):
+            self._array(value)
+        elif isinstance(value, dict):
+            self._dict(value)
+        elif isinstance(value, (list, tuple)):
+            self._sequence(value)
+        elif self.default is not None:
+            self._value(self.default(value))
+        else:
+            raise TypeError(f'Object of type {type(value).__name__} '
+                            f'is not JSON serializable')
+
+    def _dict(self, value: dict) -> None:
+        self._put('{')
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                self._put(ITEM_SEPARATOR)
+            if not isinstance(key, str):
+                # same conversion of json.dumps (e.g. 1 to "1")
+                if isinstance(key, np.generic):
+                    key = key.item()
+                key = _encoder.encode(key)
+            self._put(encode_basestring_ascii(key))
+            self._put(KEY_SEPARATOR)
+            self._value(item)
+        self._put('}')
+
+    def _sequence(self, value) -> None:
+        self._put('[')
+        for i, item in enumerate(value):
+            if i:
+                self._put(ITEM_SEPARATOR)
+            self._value(item)
+        self._put(']')
+
+    def _array(self, array: np.ndarray) -> None:
+        if array.ndim == 0:
+            self._value(array.item())
+            return
+
+        if array.ndim > 1 or array.dtype.kind not in 'biufU':
+            self._sequence(array)
+            return
+
+        self._put('[')
+        for start in range(0, len(array), CHUNK_SIZE):
+            if start:
+                self._put(ITEM_SEPARATOR)
+            self._put(self._chunk(array[start:start+CHUNK_SIZE]))
+        self._put(']')
+
+    def _chunk(self, chunk: np.ndarray) -> str:
+        ''' returns the elements of a 1D array, without brackets '''
+        values = chunk.tolist()
+
+        if chunk.dtype.kind != 'f':
+            return _encoder.encode(values)[1:-1]
+
+        nonfinite = np.flatnonzero(~np.isfinite(chunk)).tolist()
+
+        if self.float_format is None:
+            for i in nonfinite:
+                values[i] = self.nan_value
+            return _encoder.encode(values)[1:-1]
+
+        texts = list(map(self.float_format.__mod__, values))
+        for i in nonfinite:
+            texts[i] = self.nan
+
+        return ITEM_SEPARATOR.join(texts)
+
+
+def dump(value, fo, **kwargs) -> None:
+    ''' writes value as JSON to the stream fo (see JSONWriter) '''
+    JSONWriter(fo, **kwargs).write(value)
+
+
+def dumps(value, **kwargs) -> str:
+    ''' returns value encoded as JSON (see JSONWriter) '''
+    fo = io.StringIO()
+    JSONWriter(fo, buffer_size=float('inf'), **kwargs).write(value)
+    return fo.getvalue()
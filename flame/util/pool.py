@@ -0,0 +1,219 @@
+#! -*- coding: utf-8 -*-
+
+# Description    Flame shared process pool
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2018 Manuel Pastor
+#
+# This file is part of Flame
+#
+# Flame is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Flame. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Process pool shared by all the Flame tasks running in a process (building,
+predicting, computing MD, ETKDG conversion...).
+
+The pool is created the first time it is needed and reused by the following
+calls, growing when more processes are requested. A pool used by a running
+map is never closed: when it must grow, the bigger pool is created alongside
+it and the old one is closed when its maps finish. The pool can be shared
+by several threads. The workers import the
+RDKit modules at startup, and any other module (e.g. sklearn) only once, the
+first time it is used. The pool is closed when the process exits or when
+shutdown() is called.
+
+Tasks are pickled before being sent to the workers and unpickled only after
+adding the model repository to the Python path, so the workers can process
+instances of the model child classes imported after the pool was created.
+
+When called from a pool worker (which cannot create processes), the tasks
+are run sequentially in the calling process.
+'''
+
+import os
+import sys
+import atexit
+import pickle
+import threading
+import collections
+import multiprocessing as mp
+
+from flame.util import get_logger
+
+LOG = get_logger(__name__)
+
+_lock = threading.Lock()
+
+_pool = None
+_pool_size = 0
+
+# number of running maps using every pool, and replaced pools which are
+# closed when their maps finish
+_users = {}
+_retired = []
+
+
+def _warm_import():
+    ''' initializer of the workers, imports the modules used by most tasks '''
+    try:
+        import rdkit.Chem.AllChem
+        import rdkit.Chem.Descriptors
+        import flame.chem.compute_md
+    except Exception as e:
+        LOG.debug(f'Warm import failed in pool worker with exception {e}')
+
+
+def _run_task(task):
+    ''' runs a task pickled by _pack_task in a worker '''
+    paths, payload = task
+    for path in paths:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    func, item = pickle.loads(payload)
+    return func(item)
+
+
+def _pack_task(func, item):
+    return (list(sys.path), pickle.dumps((func, item)))
+
+
+def in_worker() -> bool:
+    ''' True if the current process is a pool worker '''
+    return mp.current_process().daemon
+
+
+def cpu_count() -> int:
+    return os.cpu_count() or 1
+
+
+def get_pool(ncpu: int):
+    '''
+    Returns the shared pool, making sure that it has at least ncpu processes
+    '''
+    with _lock:
+        return _get_pool(ncpu)
+
+
+def _get_pool(ncpu: int):
+    ''' get_pool, called with the lock acquired '''
+    global _pool, _pool_size
+
+    if _pool is not None and _pool_size >= ncpu:
+        return _pool
+
+    if _pool is not None:
+        LOG.debug(f'Growing process pool from {_pool_size} to {ncpu}')
+        if _users.get(_pool):
+            # the running maps keep using it until they finish
+            _retired.append(_pool)
+        else:
+            _close(_pool)
+
+    LOG.debug(f'Starting process pool with {ncpu} workers')
+    _pool = mp.Pool(ncpu, initializer=_warm_import)
+    _pool_size = ncpu
+
+    return _pool
+
+
+def _close(pool) -> None:
+    pool.close()
+    pool.join()
+
+
+def _acquire(ncpu: int):
+    ''' returns the shared pool, registering a map using it '''
+    with _lock:
+        pool = _get_pool(ncpu)
+        _users[pool] = _users.get(pool, 0) + 1
+        return pool
+
+
+def _release(pool) -> None:
+    ''' unregisters a map using pool, closing it if it was replaced '''
+    with _lock:
+        _users[pool] -= 1
+        if _users[pool] > 0:
+            return
+        del _users[pool]
+        if pool not in _retired:
+            return
+        _retired.remove(pool)
+
+    _close(pool)
+
+
+def shutdown() -> None:
+    ''' closes the shared pool, waiting for the workers to finish. Pools
+        used by running maps are closed when these maps finish '''
+    global _pool, _pool_size
+
+    with _lock:
+        pools = [pool for pool in [_pool] + _retired
+                 if pool is not None and not _users.get(pool)]
+        if _pool is not None and _users.get(_pool):
+            _retired.append(_pool)
+        _retired[:] = [pool for pool in _retired if pool not in pools]
+        _pool = None
+        _pool_size = 0
+
+    for pool in pools:
+        _close(pool)
+
+
+atexit.register(shutdown)
+
+
+def imap(func, iterable, ncpu: int, max_pending=None):
+    '''
+    Applies func to every item of iterable using up to ncpu processes and
+    yields the results in the order of the items
+
+    No more than max_pending tasks (by default, twice the number of
+    processes) are submitted at any time, so the items are consumed
+    as the results are obtained
+
+    When ncpu is 1 or the caller is a pool worker, the items are
+    processed sequentially in the calling process
+    '''
+    if ncpu is None or ncpu < 2 or in_worker():
+        for item in iterable:
+            yield func(item)
+        return
+
+    if max_pending is None:
+        max_pending = 2 * ncpu
+
+    pool = _acquire(ncpu)
+    try:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(pool.apply_async(_run_task,
+                                            (_pack_task(func, item),)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        _release(pool)
+
+
+def map(func, iterable, ncpu: int) -> list:
+    '''
+    Returns the list of results of applying func to every item of iterable,
+    using up to ncpu processes of the shared pool
+    '''
+    return list(imap(func, iterable, ncpu))